@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+""" Benchmarks for the REST API list endpoints used by the frontend. """
+import pytest
+
+
+@pytest.mark.parametrize('endpoint', (
+        '/api/assets/',
+        '/api/image_assets/',
+        '/api/web_assets/',
+        '/api/playlists/',
+        '/api/playlist_items/',
+        '/api/tickers/',
+        '/api/content_feeds/',
+        '/api/device_groups/',
+))
+def test_list_endpoint(measure, api_client, content_feed, device_group, endpoint):
+    def list_objects():
+        response = api_client.get(endpoint)
+        assert response.status_code == 200
+        return response
+
+    measure(list_objects)
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+""" Benchmarks for building the content that devices download. """
+from feedmanager.models import WebFeed
+from mediamanager.models import CalendarAsset, ContentFeed, Playlist, TickerSeries
+
+
+def test_content_feed_as_dict(measure, content_feed, device_group):
+    measure(lambda: ContentFeed.objects.get(pk=content_feed.pk).as_dict(device_group))
+
+
+def test_playlist_as_list(measure, playlist):
+    measure(lambda: Playlist.objects.get(pk=playlist.pk).as_list())
+
+
+def test_ticker_series_as_list(measure, ticker_series):
+    measure(lambda: TickerSeries.objects.get(pk=ticker_series.pk).as_list())
+
+
+def test_web_feed_rendered_content(measure, web_feed):
+    # Rendered content is memoised on the instance, so load a fresh one every round.
+    measure(lambda: WebFeed.objects.get(pk=web_feed.pk).rendered_content())
+
+
+def test_calendar_asset_rendered_content(measure, calendar_asset):
+    measure(lambda: CalendarAsset.objects.get(pk=calendar_asset.pk).rendered_content)
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+""" Benchmarks for resolving device group schedules. """
+from schedule_manager.models import get_next_schedule_change
+
+
+def test_next_schedule_change(measure, device_group):
+    measure(get_next_schedule_change, device_group)
+
+
+def test_content_feed_valid_until(measure, content_feed, device_group):
+    measure(content_feed.get_valid_until, device_group)
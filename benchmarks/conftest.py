@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Fixtures for the benchmark suite.
+
+Benchmarks live in ``bench_*.py`` files so the regular test run doesn't pick them up. Run them
+with ``make benchmark``, which needs pytest-benchmark and stores the results, including the
+query count of every benchmark, as JSON under ``benchmarks/results``. ``make benchcompare``
+compares a new run with the last stored one. The data sizes can be set with the
+``BENCHMARK_SIZES`` environment variable, e.g. ``BENCHMARK_SIZES=10,1000``.
+"""
+import datetime
+import hashlib
+import os
+
+import pytest
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from client_manager.models import Client, ClientUserProfile
+from devicemanager.models import DeviceGroup
+from feedmanager.models import Category, Template, WebFeed, WebSnippet
+from mediamanager.models import (CalendarAsset, ContentFeed, ImageAsset, Playlist, PlaylistItem,
+                                 Ticker, TickerSeries, WebAsset, WebAssetTemplate, )
+from mediamanager.types import AssetTypes
+from schedule_manager.models import ScheduledContent, WeekDays
+from utils.bulk import bulk_create_inherited
+
+SIZES = [int(size) for size in os.environ.get('BENCHMARK_SIZES', '10,100,1000').split(',')]
+
+
+@pytest.fixture(params=SIZES, ids=lambda size: 'size={}'.format(size))
+def size(request):
+    return request.param
+
+
+@pytest.fixture
+def measure(benchmark):
+    """
+    Runs a function once to count its queries, then benchmarks it. The query count is stored in
+    the extra info of the benchmark so it ends up in the JSON results.
+    """
+    def run(function, *args, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            function(*args, **kwargs)
+        benchmark.extra_info['queries'] = len(queries)
+        return benchmark(function, *args, **kwargs)
+
+    return run
+
+
+@pytest.fixture
+def owner(db):
+    return Client.objects.create(name='Benchmark Client', logo='logos/benchmark.png')
+
+
+@pytest.fixture
+def api_client(owner):
+    user = User.objects.create_user('benchmark', password='benchmark')
+    ClientUserProfile.objects.create(user=user, client=owner)
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+def _checksum(value):
+    return hashlib.md5(str(value).encode('utf-8')).hexdigest()
+
+
+@pytest.fixture
+def playlist(owner, size):
+    """ A playlist with the given number of image and web assets. """
+    images = bulk_create_inherited(ImageAsset, [
+        ImageAsset(name='Image {}'.format(index), type=AssetTypes.IMAGE, owner=owner,
+                   checksum=_checksum(index), media_file='benchmark/{}.png'.format(index),
+                   asset_url='')
+        for index in range(size - size // 4)
+    ])
+    pages = bulk_create_inherited(WebAsset, [
+        WebAsset(name='Page {}'.format(index), type=AssetTypes.WEB, owner=owner,
+                 content='<p>Page {}</p>'.format(index), asset_url='')
+        for index in range(size // 4)
+    ])
+    playlist = Playlist.objects.create(name='Benchmark Playlist', owner=owner,
+                                       auto_add_feeds=False)
+    PlaylistItem.objects.bulk_create([
+        PlaylistItem(playlist=playlist, item_id=asset.pk, position=position, duration=10)
+        for position, asset in enumerate(images + pages)
+    ])
+    return playlist
+
+
+@pytest.fixture
+def ticker_series(owner, size):
+    series = TickerSeries.objects.create(name='Benchmark Tickers', owner=owner)
+    Ticker.objects.bulk_create([
+        Ticker(ticker_series=series, text='Ticker {}'.format(index), position=index)
+        for index in range(size)
+    ])
+    return series
+
+
+@pytest.fixture
+def content_feed(playlist, ticker_series):
+    return ContentFeed.objects.create(title='Benchmark Feed', media_playlist=playlist,
+                                      ticker_series=ticker_series)
+
+
+@pytest.fixture
+def device_group(owner, content_feed, size):
+    """ A device group with the given number of schedules spread over the week. """
+    group = DeviceGroup.objects.create(name='Benchmark Group', owner=owner, feed=content_feed)
+    slots_per_day = max(size // len(WeekDays.CODES), 1)
+    slot_minutes = 24 * 60 // (slots_per_day + 1)
+    schedules = []
+    for day in WeekDays.CODES:
+        schedules.append(ScheduledContent(day=day, default=True, content=content_feed,
+                                          device_group=group))
+        for slot in range(slots_per_day):
+            start = datetime.datetime(2000, 1, 1) + datetime.timedelta(minutes=slot * slot_minutes)
+            schedules.append(ScheduledContent(
+                    day=day, start_time=start.time(),
+                    end_time=(start + datetime.timedelta(minutes=slot_minutes - 1)).time(),
+                    content=content_feed, device_group=group))
+    # Bulk inserts skip validation, which would check each schedule against all others.
+    ScheduledContent.objects.bulk_create(schedules)
+    return group
+
+
+@pytest.fixture
+def web_feed(db, size):
+    """ A dated web feed with snippets for the given number of days around today. """
+    category = Category.objects.create(name='Benchmark Category', type=Category.DATED_TYPE)
+    today = timezone.localtime(timezone.now()).date()
+    bulk_create_inherited(WebSnippet, [
+        WebSnippet(category=category, title='Snippet {}'.format(offset), content='Content',
+                   date=today + datetime.timedelta(days=offset - size // 2))
+        for offset in range(size)
+    ])
+    template = Template.objects.create(name='Benchmark Template', duration=10,
+                                       template_data='<h1>{{ title }}</h1><p>{{ content }}</p>')
+    return WebFeed.objects.create(name='Benchmark Web Feed', category=category,
+                                  template=template)
+
+
+@pytest.fixture
+def calendar_asset(owner, size):
+    """ A calendar asset with the given number of events, one of which is happening now. """
+    now = timezone.now()
+    events = []
+    for index in range(size):
+        start = now + datetime.timedelta(hours=index - 1)
+        events.append('\r\n'.join((
+            'BEGIN:VEVENT',
+            'UID:benchmark-{}'.format(index),
+            'SUMMARY:Event {}'.format(index),
+            'DESCRIPTION:Description of event {}'.format(index),
+            'DTSTART:{:%Y%m%dT%H%M%SZ}'.format(start),
+            'DTEND:{:%Y%m%dT%H%M%SZ}'.format(start + datetime.timedelta(minutes=50)),
+            'END:VEVENT',
+        )))
+    data = '\r\n'.join(['BEGIN:VCALENDAR', 'VERSION:2.0'] + events + ['END:VCALENDAR'])
+    template = WebAssetTemplate.objects.create(
+            name='Benchmark Calendar', template='<h1>{{ title }}</h1><p>{{ content }}</p>',
+            variables='title,content', help_text='', calendar_support=True)
+    return CalendarAsset.objects.create(name='Benchmark Calendar', owner=owner,
+                                        template=template, url='http://example.com/cal.ics',
+                                        data=data, last_update=now)
@@ -1,13 +1,16 @@
 # -*- coding: utf-8 -*-
 import json
+import threading
 from urllib.parse import parse_qs
 
 from channels import Group
 from channels.sessions import channel_session
-from rest_framework.authentication import TokenAuthentication
+from django.db import transaction
 from rest_framework.exceptions import AuthenticationFailed
 
 from client_manager.models import Client
+from utils.authentication import CachedTokenAuthentication
+from utils.metrics import websocket_connections
 from utils.mixins import get_owner_from_user
 
 
@@ -26,7 +29,7 @@ def notify_connect(message, **kwargs):
 
     if token != '':
         try:
-            auth = TokenAuthentication()
+            auth = CachedTokenAuthentication()
             user, _ = auth.authenticate_credentials(token)
             client = get_owner_from_user(user)
         except AuthenticationFailed:
@@ -40,6 +43,7 @@ def notify_connect(message, **kwargs):
         group_name = get_group_for_client(client)
         message.channel_session['client_group'] = group_name
         Group(group_name).add(message.reply_channel)
+        websocket_connections.connect('frontend', group_name, message.reply_channel.name)
         message.reply_channel.send({'accept': True})
     else:
         message.reply_channel.send({'close': True})
@@ -50,20 +54,91 @@ def notify_disconnect(message, **kwargs):
     try:
         group_name = message.channel_session['client_group']
         Group(group_name).discard(message.reply_channel)
+        websocket_connections.disconnect('frontend', group_name, message.reply_channel.name)
     except (KeyError, Client.DoesNotExist):
         message.reply_channel.send({'close': True})
 
 
+class RefreshBroadcaster:
+    """
+    Coalesces refresh signals sent to client groups.
+
+    Refreshes sent inside a transaction are held until it commits and are then merged into a
+    single message per group, which keeps bulk operations from sending a storm of identical
+    messages to every open frontend and keeps frontends from refreshing before the changes are
+    visible to them. Refreshes outside of a transaction are sent right away. A transaction that
+    is rolled back sends nothing, its refreshes are only merged into the next message of the
+    thread, where they cause at most a redundant refresh.
+    """
+
+    def __init__(self, send=None, using=None):
+        self._send = send or self._send_to_group
+        self.using = using
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        #: Number of messages actually sent to groups.
+        self.sent = 0
+        #: Number of refresh signals merged into another message instead of being sent.
+        self.suppressed = 0
+
+    @staticmethod
+    def _send_to_group(group_name, refresh):
+        Group(group_name).send({
+            'text': json.dumps({
+                'refresh': refresh
+            })
+        })
+
+    @staticmethod
+    def _merge_scopes(scopes):
+        """ Merges refresh scopes into a single scope, 'all' if they differ. """
+        if len(scopes) == 1:
+            return next(iter(scopes))
+        return 'all'
+
+    def _pending(self):
+        pending = getattr(self._local, 'pending', None)
+        if pending is None:
+            pending = self._local.pending = {}
+        return pending
+
+    def refresh(self, group_name, refresh='all'):
+        """ Queues a refresh for the group, sending it when the current transaction commits. """
+        scopes = self._pending().setdefault(group_name, set())
+        if scopes:
+            with self._lock:
+                self.suppressed += 1
+        scopes.add(refresh)
+        # A callback is registered for every refresh, as those of a rolled back savepoint are
+        # discarded. Only the first one to run has anything left to send.
+        transaction.on_commit(self.flush, using=self.using)
+
+    def flush(self):
+        """ Immediately sends the pending refreshes of the current thread. """
+        pending, self._local.pending = self._pending(), {}
+        with self._lock:
+            self.sent += len(pending)
+        for group_name, scopes in pending.items():
+            self._send(group_name, self._merge_scopes(scopes))
+
+    def stats(self):
+        """ Returns the counters for messages sent and suppressed. """
+        return {
+            'sent': self.sent,
+            'suppressed': self.suppressed,
+        }
+
+
+refresh_broadcaster = RefreshBroadcaster()
+
+
 def refresh_client_users(client, refresh='all'):
     """
     Sends a refresh signal to all users of the same client.
 
     This signal can be handled by the frontend which can then refresh itself,
-    thus keeping multiple users from the same client in sync.
+    thus keeping multiple users from the same client in sync. Refreshes sent in quick
+    succession are merged into a single message by the refresh broadcaster.
     """
     group_name = get_group_for_client(client)
-    Group(group_name).send({
-        'text': json.dumps({
-            'refresh': refresh
-        })
-    })
+    refresh_broadcaster.refresh(group_name, refresh)
@@ -7,11 +7,12 @@ from dateutil.relativedelta import relativedelta
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.db import models
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.utils.text import slugify
 from rest_framework.authtoken.models import Token
 
+from utils.cache import invalidate, owner_cache_key, token_cache_key
 from utils.files import calculate_checksum
 from utils.storage import NormalStorage
 
@@ -224,3 +225,40 @@ def create_auth_token(sender, instance=None, created=False, **kwargs):
     """ Automatically creates a new token for a user when a new user is added. """
     if created:
         Token.objects.create(user=instance)
+
+
+# noinspection PyUnusedLocal
+@receiver(post_save, sender=ClientUserProfile)
+@receiver(post_delete, sender=ClientUserProfile)
+def invalidate_profile_owner(sender, instance=None, **kwargs):
+    """ Clears the cached owner for a user when their profile changes. """
+    invalidate(owner_cache_key(instance.user_id))
+
+
+# noinspection PyUnusedLocal
+@receiver(post_save, sender=Client)
+@receiver(post_delete, sender=Client)
+def invalidate_client_owner(sender, instance=None, **kwargs):
+    """ Clears the cached owner for all users of a client when the client changes. """
+    user_ids = ClientUserProfile.objects.filter(client=instance).values_list('user_id', flat=True)
+    invalidate(*[owner_cache_key(user_id) for user_id in user_ids])
+
+
+# noinspection PyUnusedLocal
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_token_user(sender, instance=None, **kwargs):
+    """ Clears the cached user for a token when the token changes or is deleted. """
+    invalidate(token_cache_key(instance.key))
+
+
+# noinspection PyUnusedLocal
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def invalidate_user_tokens(sender, instance=None, created=False, **kwargs):
+    """
+    Clears cached users for all the tokens of a user when the user changes, so changes such as
+    deactivating a user take effect immediately.
+    """
+    if not created:
+        token_keys = Token.objects.filter(user=instance).values_list('key', flat=True)
+        invalidate(*[token_cache_key(key) for key in token_keys])
@@ -1,2 +1,46 @@
 # -*- coding: utf-8 -*-
 """ Tests for client manager. """
+import pytest
+from django.db import transaction
+
+from client_manager.consumers import RefreshBroadcaster
+
+
+def _broadcaster():
+    sent = []
+    broadcaster = RefreshBroadcaster(send=lambda group, refresh: sent.append((group, refresh)))
+    return broadcaster, sent
+
+
+@pytest.mark.django_db(transaction=True)
+def test_refreshes_are_merged_per_group_until_commit():
+    broadcaster, sent = _broadcaster()
+    with transaction.atomic():
+        broadcaster.refresh('group-1', 'assets')
+        broadcaster.refresh('group-1', 'playlists')
+        broadcaster.refresh('group-1', 'assets')
+        broadcaster.refresh('group-2', 'devices')
+        broadcaster.refresh('group-2', 'devices')
+        assert sent == []
+
+    assert sorted(sent) == [('group-1', 'all'), ('group-2', 'devices')]
+    assert broadcaster.stats() == {'sent': 2, 'suppressed': 3}
+
+
+@pytest.mark.django_db(transaction=True)
+def test_rolled_back_refreshes_are_not_sent():
+    broadcaster, sent = _broadcaster()
+    with pytest.raises(ValueError):
+        with transaction.atomic():
+            broadcaster.refresh('group-1', 'assets')
+            raise ValueError
+    assert sent == []
+
+
+@pytest.mark.django_db(transaction=True)
+def test_refreshes_outside_a_transaction_are_sent_immediately():
+    broadcaster, sent = _broadcaster()
+    broadcaster.refresh('group-1', 'assets')
+    broadcaster.refresh('group-1', 'assets')
+    assert sent == [('group-1', 'assets'), ('group-1', 'assets')]
+    assert broadcaster.stats() == {'sent': 2, 'suppressed': 0}
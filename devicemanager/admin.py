@@ -1,18 +1,50 @@
 # -*- coding: utf-8 -*-
 """ Admin setup for device manager app. """
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
 
+from devicemanager.commands import send_device_command, send_group_command
+from devicemanager.heartbeat import device_heartbeats, get_status, mirror_heartbeats
 from devicemanager.models import (AppBuild, AppBuildChannel, Device, DeviceGroup, DeviceScreenShot,
                                   MirrorServer, )
 
 
+def _command_actions(send, key_field):
+    """ Returns admin actions that send each device command to the selected objects. """
+    def make_action(command, label):
+        def action(modeladmin, request, queryset):
+            ids = list(queryset.values_list(key_field, flat=True))
+            for object_id in ids:
+                send(str(object_id), command)
+            modeladmin.message_user(request, 'Sent "{}" to {} item(s).'.format(label, len(ids)))
+
+        action.__name__ = 'send_{}'.format(command.replace(':', '_').replace('-', '_'))
+        action.short_description = 'Send command: {}'.format(label)
+        return action
+
+    return [make_action(command, label)
+            for command, label in Device._meta.get_field('command').choices]
+
+
+def _heartbeat_changelist(heartbeats):
+    """ Returns a change list class that loads the buffered pings of a page at once. """
+    class HeartbeatChangeList(ChangeList):
+        def get_results(self, request):
+            super().get_results(request)
+            heartbeats.load_last_pings(self.result_list)
+
+    return HeartbeatChangeList
+
+
 @admin.register(Device)
 class DeviceAdmin(admin.ModelAdmin):
     """ The device admin panel setup class. """
-    list_display = ('name', 'device_id', 'last_ping', 'group', 'debug_mode', 'enabled', 'owner',
-                    'build_version',)
+    list_display = ('name', 'device_id', 'last_seen', 'status', 'group', 'debug_mode', 'enabled',
+                    'owner', 'build_version',)
     list_filter = ('last_ping', 'group', 'debug_mode', 'enabled', 'owner', 'build_version',)
     list_editable = ('debug_mode', 'enabled',)
+    list_select_related = ('owner', 'group',)
+    actions = _command_actions(send_device_command, 'device_id')
     fields = (
         'device_id', 'name', 'group', 'last_ping',
         ('debug_mode', 'enabled',),
@@ -21,12 +53,28 @@ class DeviceAdmin(admin.ModelAdmin):
     )
     readonly_fields = ('device_id', 'last_ping', 'build_version')
 
+    def last_seen(self, obj):
+        """ Latest ping of the device including pings that haven't been saved yet. """
+        return device_heartbeats.last_ping(obj)
+
+    last_seen.admin_order_field = 'last_ping'
+
+    def status(self, obj):
+        # The update interval comes from the owner, devices without one have no status.
+        if obj.owner is None:
+            return None
+        return get_status(device_heartbeats.last_ping(obj), obj.owner.update_interval)
+
+    def get_changelist(self, request, **kwargs):
+        return _heartbeat_changelist(device_heartbeats)
+
 
 @admin.register(DeviceGroup)
 class DeviceGroupAdmin(admin.ModelAdmin):
     """ The device group admin panel setup class. """
     list_display = ('name', 'owner', 'display_date_time', 'mirror', 'orientation')
     list_filter = ('owner', 'orientation')
+    actions = _command_actions(send_group_command, 'pk')
 
 
 @admin.register(AppBuild)
@@ -37,15 +85,25 @@ class AppBuildAdmin(admin.ModelAdmin):
 
 @admin.register(MirrorServer)
 class MirrorServerAdmin(admin.ModelAdmin):
-    list_display = ('name', 'mirror_id', 'address', 'last_ping', 'owner',)
+    list_display = ('name', 'mirror_id', 'address', 'last_seen', 'owner',)
     list_filter = ('owner',)
     readonly_fields = ('mirror_id', 'last_ping',)
 
+    def last_seen(self, obj):
+        """ Latest ping of the mirror including pings that haven't been saved yet. """
+        return mirror_heartbeats.last_ping(obj)
+
+    last_seen.admin_order_field = 'last_ping'
+
+    def get_changelist(self, request, **kwargs):
+        return _heartbeat_changelist(mirror_heartbeats)
+
 
 @admin.register(DeviceScreenShot)
 class DeviceScreenShotAdmin(admin.ModelAdmin):
     list_display = ('__str__', 'device', 'timestamp')
     list_filter = ('device', 'timestamp', 'device__owner')
+    list_select_related = ('device',)
     readonly_fields = ('timestamp',)
 
 
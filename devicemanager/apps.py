@@ -7,3 +7,8 @@ class DeviceManagerConfig(AppConfig):
     """ Device manager app config class. """
     name = 'devicemanager'
     verbose_name = 'Device Manager'
+
+    def ready(self):
+        """ Connects the signals that push content changes to devices. """
+        from devicemanager.signals import connect_signals
+        connect_signals()
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Command dispatch for devices.
+
+Commands are stored in Redis, either in a queue per device or in a single broadcast list per
+device group, and are numbered from one global sequence. Connected devices receive them over
+their websocket right away, other devices pick them up through the poll endpoint. Devices
+acknowledge the highest sequence number they have handled, which clears everything up to it, so
+sending a command to a whole group is a single write no matter how many devices it has. The
+sequence number at which a device joined its group is recorded as well, so devices that join a
+group later don't run the commands that were sent to it before.
+"""
+import json
+import time
+import uuid
+
+from channels import Group
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.http import Http404, HttpResponseNotAllowed, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django_redis import get_redis_connection
+
+from devicemanager.models import Device
+
+#: Number of seconds after which an undelivered command is dropped. Devices that come online
+#: later shouldn't run commands like reboot that were meant for much earlier.
+COMMAND_TTL = getattr(settings, 'SIGNOXE_DEVICE_COMMAND_TTL', 15 * 60)
+
+#: Maximum number of commands kept in a single queue.
+MAX_QUEUED_COMMANDS = 50
+
+SEQUENCE_KEY = 'device-commands:sequence'
+ACKS_KEY = 'device-commands:acks'
+MEMBERSHIPS_KEY = 'device-commands:memberships'
+
+#: Records the group of a device along with the current sequence number if the group changed,
+#: and returns the sequence number at which the device joined its group.
+RECORD_MEMBERSHIP = """
+local current = redis.call('HGET', KEYS[1], ARGV[1])
+if current and string.match(current, '^[^:]*') == ARGV[2] then
+    return tonumber(string.match(current, ':(%d+)$'))
+end
+local sequence = redis.call('GET', KEYS[2]) or '0'
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2] .. ':' .. sequence)
+return tonumber(sequence)
+"""
+
+
+class InvalidCommandError(ValueError):
+    pass
+
+
+def normalize_device_id(device_id):
+    """
+    Returns the canonical form of a device id, which may be a UUID or a string in any format
+    accepted by UUID, so keys and groups match however the device spelled it.
+    Raises ValueError for ids that aren't UUIDs.
+    """
+    return str(uuid.UUID(str(device_id)))
+
+
+def get_group_for_device(device_id):
+    """ Returns a channel group name unique to a given device. """
+    return 'device-{id}'.format(id=normalize_device_id(device_id))
+
+
+def _device_queue_key(device_id):
+    return 'device-commands:device:{}'.format(device_id)
+
+
+def _group_queue_key(device_group_id):
+    return 'device-commands:group:{}'.format(device_group_id)
+
+
+def get_command_choices():
+    return [command for command, _ in Device._meta.get_field('command').choices]
+
+
+def _enqueue(queue_key, channel_group, command):
+    if command not in get_command_choices():
+        raise InvalidCommandError('Unknown command: {}'.format(command))
+
+    redis = get_redis_connection('default')
+    sequence = redis.incr(SEQUENCE_KEY)
+    entry = {'id': sequence, 'command': command, 'expires': time.time() + COMMAND_TTL}
+    pipeline = redis.pipeline()
+    pipeline.zadd(queue_key, sequence, json.dumps(entry))
+    pipeline.zremrangebyrank(queue_key, 0, -MAX_QUEUED_COMMANDS - 1)
+    pipeline.expire(queue_key, COMMAND_TTL)
+    pipeline.execute()
+
+    Group(channel_group).send({
+        'text': json.dumps({'command': command, 'id': sequence})
+    })
+    return sequence
+
+
+def send_device_command(device_id, command):
+    """ Queues a command for a single device and pushes it if the device is connected. """
+    device_id = normalize_device_id(device_id)
+    return _enqueue(_device_queue_key(device_id), get_group_for_device(device_id), command)
+
+
+def send_group_command(device_group_id, command):
+    """ Queues a command for all devices in a group and pushes it to the connected ones. """
+    # Imported here since the consumers import this module.
+    from devicemanager.consumers import get_group_for_device_group
+    return _enqueue(_group_queue_key(device_group_id),
+                    get_group_for_device_group(device_group_id), command)
+
+
+def record_group_membership(device_id, device_group_id):
+    """
+    Records the group of the device if it changed, and returns the sequence number at which the
+    device joined the group. Commands sent to the group up to that number aren't for the device.
+    """
+    return get_redis_connection('default').eval(
+            RECORD_MEMBERSHIP, 2, MEMBERSHIPS_KEY, SEQUENCE_KEY, normalize_device_id(device_id),
+            device_group_id)
+
+
+def get_pending_commands(device_id, device_group_id):
+    """ Returns the commands the device hasn't acknowledged yet, oldest first. """
+    device_id = normalize_device_id(device_id)
+    redis = get_redis_connection('default')
+    acked = int(redis.hget(ACKS_KEY, device_id) or 0)
+    pipeline = redis.pipeline()
+    pipeline.zrangebyscore(_device_queue_key(device_id), '({}'.format(acked), '+inf')
+    if device_group_id is not None:
+        joined = record_group_membership(device_id, device_group_id)
+        pipeline.zrangebyscore(_group_queue_key(device_group_id),
+                               '({}'.format(max(acked, joined)), '+inf')
+    now = time.time()
+    entries = [json.loads(entry.decode('utf-8'))
+               for entries in pipeline.execute() for entry in entries]
+    return [{'id': entry['id'], 'command': entry['command']}
+            for entry in sorted(entries, key=lambda entry: entry['id'])
+            if entry['expires'] > now]
+
+
+def acknowledge_commands(device_id, sequence):
+    """ Marks all commands for the device up to and including the sequence number as handled. """
+    device_id = normalize_device_id(device_id)
+    redis = get_redis_connection('default')
+    pipeline = redis.pipeline()
+    # Acknowledgements can arrive out of order, only ever move the cursor forward.
+    pipeline.eval("""
+        local current = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0')
+        if tonumber(ARGV[2]) > current then
+            redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+        end
+    """, 1, ACKS_KEY, device_id, sequence)
+    pipeline.zremrangebyscore(_device_queue_key(device_id), '-inf', sequence)
+    pipeline.execute()
+
+
+@csrf_exempt
+def device_commands_view(request, device_id):
+    """
+    Poll fallback for devices that aren't connected over a websocket. GET returns the pending
+    commands, and POST with an ``ack`` parameter acknowledges them.
+    """
+    try:
+        device = Device.objects.only('device_id', 'group_id').get(device_id=device_id,
+                                                                  enabled=True)
+    except (Device.DoesNotExist, ValidationError):
+        raise Http404('Device not found')
+
+    if request.method == 'POST':
+        try:
+            sequence = int(request.POST['ack'])
+        except (KeyError, ValueError):
+            return JsonResponse({'error': 'An integer ack parameter is required.'}, status=400)
+        acknowledge_commands(device.device_id, sequence)
+    elif request.method != 'GET':
+        return HttpResponseNotAllowed(['GET', 'POST'])
+
+    return JsonResponse({
+        'commands': get_pending_commands(device.device_id, device.group_id),
+    })
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Websocket consumers that let devices receive updates as soon as their content changes, and
+commands as soon as they are sent.
+"""
+import json
+from urllib.parse import parse_qs
+
+from channels import Group
+from channels.sessions import channel_session
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+from devicemanager.commands import (acknowledge_commands, get_group_for_device,
+                                    get_pending_commands, normalize_device_id)
+from devicemanager.models import Device, DeviceGroup
+from utils.metrics import websocket_connections
+
+
+def get_group_for_device_group(device_group_id):
+    """ Returns a channel group name unique to a given device group. """
+    return 'device-group-{id}'.format(id=device_group_id)
+
+
+@channel_session
+def device_connect(message, **kwargs):
+    params = parse_qs(message.content['query_string'])
+    # Devices pass their device id as a parameter while connecting
+    device_id = params.get(b'device_id', [b''])[0].decode('utf8')
+    device = None
+
+    if device_id != '':
+        try:
+            device_id = normalize_device_id(device_id)
+            device = Device.objects.get(device_id=device_id, enabled=True)
+        except (Device.DoesNotExist, ValidationError, ValueError):
+            pass
+
+    if device is not None and device.group_id is not None:
+        message.channel_session['device_id'] = device_id
+        # Save the group name in channel session so disconnection
+        # doesn't need the database
+        group_name = get_group_for_device_group(device.group_id)
+        message.channel_session['device_group'] = group_name
+        Group(group_name).add(message.reply_channel)
+        Group(get_group_for_device(device_id)).add(message.reply_channel)
+        websocket_connections.connect('device', group_name, message.reply_channel.name)
+        message.reply_channel.send({'accept': True})
+        # Deliver commands that were sent while the device was disconnected.
+        for command in get_pending_commands(device_id, device.group_id):
+            message.reply_channel.send({'text': json.dumps(command)})
+    else:
+        message.reply_channel.send({'close': True})
+
+
+@channel_session
+def device_disconnect(message, **kwargs):
+    try:
+        group_name = message.channel_session['device_group']
+        Group(group_name).discard(message.reply_channel)
+        websocket_connections.disconnect('device', group_name, message.reply_channel.name)
+        device_id = message.channel_session['device_id']
+        Group(get_group_for_device(device_id)).discard(message.reply_channel)
+    except KeyError:
+        message.reply_channel.send({'close': True})
+
+
+@channel_session
+def device_receive(message, **kwargs):
+    """ Handles command acknowledgements sent by devices as ``{"ack": <command id>}``. """
+    try:
+        device_id = message.channel_session['device_id']
+        sequence = int(json.loads(message.content['text'])['ack'])
+    except (KeyError, TypeError, ValueError):
+        return
+    acknowledge_commands(device_id, sequence)
+
+
+def get_device_groups_for_content_feeds(content_feeds):
+    """
+    Returns the device groups that show any of the provided content feeds, either as their main
+    feed or through a schedule or special content.
+    """
+    return DeviceGroup.objects.filter(
+            Q(feed__in=content_feeds) |
+            Q(scheduledcontent__content__in=content_feeds) |
+            Q(specialcontent__content__in=content_feeds)
+    ).distinct()
+
+
+def notify_device_groups(device_group_ids):
+    """
+    Sends a content changed message to all devices connected in the provided device groups.
+
+    The message is deliberately compact, devices are expected to fetch their content feed again
+    when they receive it.
+    """
+    message = {
+        'text': json.dumps({
+            'changed': 'content'
+        })
+    }
+    for device_group_id in set(device_group_ids):
+        Group(get_group_for_device_group(device_group_id)).send(message)
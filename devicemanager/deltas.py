@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Binary delta updates for app builds.
+
+For each release channel, a bsdiff patch is generated between every pair of consecutive builds
+ordered by version code. A device that reports its build version gets the chain of patches from
+its version to the latest build, or the full build if that is smaller or a patch is missing.
+Patches are generated in the background and their sizes are cached so selecting an update
+doesn't touch storage.
+"""
+import os
+
+from channels import Channel
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.http import Http404, JsonResponse
+
+from devicemanager.models import AppBuild, Device
+from utils.storage import NormalStorage
+
+try:
+    import bsdiff4
+except ImportError:
+    bsdiff4 = None
+
+PATCH_STORAGE = NormalStorage()
+PATCH_DIR = 'app-patches'
+
+#: How long the size of a generated patch is cached. Patches never change once generated.
+PATCH_SIZE_TIMEOUT = 30 * 24 * 60 * 60
+
+
+def get_patch_name(from_build, to_build):
+    """ Returns the storage path of the patch between two builds. """
+    return os.path.join(PATCH_DIR, str(to_build.release_channel_id),
+                        '{}-{}-{}-{}.bsdiff'.format(from_build.version_code, from_build.pk,
+                                                    to_build.version_code, to_build.pk))
+
+
+def _patch_size_cache_key(patch_name):
+    return 'app-patch-size:{}'.format(patch_name)
+
+
+def get_patch_sizes(patch_names):
+    """
+    Returns a dict of patch name to size for the patches that exist. Sizes are read from the
+    cache, falling back to storage for patches that aren't cached yet.
+    """
+    keys = {_patch_size_cache_key(name): name for name in patch_names}
+    sizes = {keys[key]: size for key, size in cache.get_many(keys.keys()).items()}
+    for name in patch_names:
+        if name not in sizes and PATCH_STORAGE.exists(name):
+            sizes[name] = PATCH_STORAGE.size(name)
+            cache.set(_patch_size_cache_key(name), sizes[name], PATCH_SIZE_TIMEOUT)
+    return sizes
+
+
+def get_channel_builds(release_channel_id):
+    """ Returns the builds in the release channel ordered by version code. """
+    return list(AppBuild.objects.filter(release_channel_id=release_channel_id)
+                .order_by('version_code'))
+
+
+def _read_build(build):
+    build.build_file.open('rb')
+    try:
+        return build.build_file.read()
+    finally:
+        build.build_file.close()
+
+
+def generate_patch(from_build, to_build):
+    """ Generates and stores the patch between two builds unless it already exists. """
+    patch_name = get_patch_name(from_build, to_build)
+    if PATCH_STORAGE.exists(patch_name):
+        return patch_name
+    patch = bsdiff4.diff(_read_build(from_build), _read_build(to_build))
+    patch_name = PATCH_STORAGE.save(patch_name, ContentFile(patch))
+    cache.set(_patch_size_cache_key(patch_name), len(patch), PATCH_SIZE_TIMEOUT)
+    return patch_name
+
+
+def queue_patch_generation(release_channel_id):
+    """ Queues patch generation for the channel once the current transaction commits. """
+    if bsdiff4 is None or release_channel_id is None:
+        return
+    transaction.on_commit(lambda: Channel('generate-app-patches').send({
+        'release_channel': release_channel_id,
+    }))
+
+
+def generate_app_patches(message):
+    """ Consumer that generates missing patches between consecutive builds of a channel. """
+    builds = get_channel_builds(message.content['release_channel'])
+    for from_build, to_build in zip(builds, builds[1:]):
+        generate_patch(from_build, to_build)
+
+
+def select_update(release_channel_id, current_version):
+    """
+    Returns a description of the cheapest way to update from the current version to the latest
+    build in the channel, or None if the device is up to date or the channel has no builds.
+    """
+    builds = get_channel_builds(release_channel_id)
+    if not builds or builds[-1].version_code == current_version:
+        return None
+
+    latest = builds[-1]
+    full_size = latest.build_file.size
+    update = {
+        'version_code': latest.version_code,
+        'type': 'full',
+        'url': latest.build_file.url,
+        'size': full_size,
+    }
+
+    start = [index for index, build in enumerate(builds) if build.version_code == current_version]
+    if not start:
+        return update  # The device runs a build that isn't in this channel.
+
+    chain = builds[start[-1]:]
+    patch_names = [get_patch_name(from_build, to_build)
+                   for from_build, to_build in zip(chain, chain[1:])]
+    sizes = get_patch_sizes(patch_names)
+    if len(sizes) < len(patch_names):
+        return update  # Some patches haven't been generated yet.
+
+    patches_size = sum(sizes.values())
+    if patches_size >= full_size:
+        return update
+
+    update.update({
+        'type': 'patch',
+        'size': patches_size,
+        'patches': [{
+            'from_version_code': from_build.version_code,
+            'to_version_code': to_build.version_code,
+            'url': PATCH_STORAGE.url(name),
+            'size': sizes[name],
+        } for (from_build, to_build), name in zip(zip(chain, chain[1:]), patch_names)],
+    })
+    return update
+
+
+def app_update_view(request, device_id):
+    """
+    Returns the update a device should download to get to the latest build in the release
+    channel of its owner. Devices pass their current version code as ``version_code``, otherwise
+    the build version last reported by the device is used.
+    """
+    try:
+        device = Device.objects.select_related('owner').get(device_id=device_id, enabled=True)
+    except (Device.DoesNotExist, ValidationError):
+        raise Http404('Device not found')
+    if device.owner is None or device.owner.app_build_channel_id is None:
+        return JsonResponse({'update': None})
+
+    try:
+        current_version = int(request.GET.get('version_code', device.build_version))
+    except (TypeError, ValueError):
+        current_version = None
+    return JsonResponse({
+        'update': select_update(device.owner.app_build_channel_id, current_version),
+    })
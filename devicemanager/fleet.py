@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Fleet status summaries.
+
+Counts online, stale and offline devices per device group and per app build for an owner using
+a single aggregate query, so the dashboard doesn't need to load every device to show the state
+of the fleet. Devices with pings that are still buffered are left out of the aggregate and
+counted from their buffered ping and build instead, so the summary doesn't lag behind by up to a
+flush interval.
+"""
+from django.db.models import Case, Count, IntegerField, Q, When
+from django.utils import timezone
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+
+from devicemanager.heartbeat import (DeviceStatus, device_heartbeats, get_status,
+                                     get_status_thresholds, )
+from devicemanager.models import Device
+from utils.mixins import get_owner_from_request
+from utils.queries import query_budget
+
+STATUSES = (DeviceStatus.ONLINE, DeviceStatus.STALE, DeviceStatus.OFFLINE)
+
+
+def _count_where(*args, **kwargs):
+    return Count(Case(When(*args, then=1, **kwargs), output_field=IntegerField()))
+
+
+def _empty_counts():
+    return dict.fromkeys(STATUSES + ('total',), 0)
+
+
+def _add_counts(totals, row):
+    for status in STATUSES:
+        totals[status] += row[status]
+        totals['total'] += row[status]
+
+
+def _pending_rows(devices, pending, update_interval, now):
+    """ Returns a row like those of the aggregate for each device with a buffered ping. """
+    if not pending:
+        return
+    for device in devices.filter(pk__in=pending).values('pk', 'group_id', 'group__name',
+                                                          'build_version'):
+        entry = pending[device['pk']]
+        status = get_status(entry['last_ping'], update_interval, now)
+        row = dict.fromkeys(STATUSES, 0)
+        row[status] = 1
+        row.update(group_id=device['group_id'], group__name=device['group__name'],
+                   build_version=entry.get('build_version', device['build_version']))
+        yield row
+
+
+def get_fleet_summary(owner, now=None):
+    """
+    Returns the device counts of the owner by status, overall as well as per device group and
+    per build version.
+    """
+    if now is None:
+        now = timezone.now()
+    devices = Device.objects.filter(owner=owner)
+    pending = device_heartbeats.pending_many(devices.values_list('pk', flat=True))
+
+    online_after, stale_after = get_status_thresholds(owner.update_interval, now)
+    rows = list(devices.exclude(pk__in=pending).values(
+            'group_id', 'group__name', 'build_version'
+    ).annotate(**{
+        DeviceStatus.ONLINE: _count_where(last_ping__gte=online_after),
+        DeviceStatus.STALE: _count_where(last_ping__lt=online_after, last_ping__gte=stale_after),
+        DeviceStatus.OFFLINE: _count_where(Q(last_ping__lt=stale_after) |
+                                           Q(last_ping__isnull=True)),
+    }).order_by())
+    rows.extend(_pending_rows(devices, pending, owner.update_interval, now))
+
+    totals = _empty_counts()
+    groups = {}
+    builds = {}
+    for row in rows:
+        _add_counts(totals, row)
+        group = groups.setdefault(row['group_id'], dict(_empty_counts(),
+                                                        id=row['group_id'],
+                                                        name=row['group__name']))
+        _add_counts(group, row)
+        build = builds.setdefault(row['build_version'], dict(_empty_counts(),
+                                                             build_version=row['build_version']))
+        _add_counts(build, row)
+
+    return {
+        'generated_at': now.isoformat(),
+        'totals': totals,
+        'groups': sorted(groups.values(), key=lambda group: group['name'] or ''),
+        'builds': sorted(builds.values(), key=lambda build: build['build_version'] or ''),
+    }
+
+
+@query_budget(5)
+@api_view(['GET'])
+def fleet_summary_view(request):
+    """ Returns device counts by status for the fleet of the current user. """
+    owner = get_owner_from_request(request)
+    if owner is None:
+        return Response({'totals': _empty_counts(), 'groups': [], 'builds': []})
+    return Response(get_fleet_summary(owner))
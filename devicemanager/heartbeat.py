@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Buffered heartbeats for devices and mirror servers.
+
+Instead of updating a row every time a device checks in, pings are recorded in Redis and
+written to the database in bulk at most once per flush interval. The buffer also serves the
+latest ping for each device so status displays stay accurate between flushes.
+"""
+import datetime
+import json
+
+from django.conf import settings
+from django.db import models
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django_redis import get_redis_connection
+
+from devicemanager.models import Device, MirrorServer
+
+#: Minimum number of seconds between writes of buffered heartbeats to the database.
+HEARTBEAT_FLUSH_INTERVAL = getattr(settings, 'SIGNOXE_HEARTBEAT_FLUSH_INTERVAL', 60)
+
+#: Number of rows updated in a single UPDATE statement while flushing.
+HEARTBEAT_FLUSH_BATCH_SIZE = 500
+
+#: Devices that haven't pinged for this long are considered offline rather than stale.
+DEVICE_OFFLINE_AFTER = getattr(settings, 'SIGNOXE_DEVICE_OFFLINE_AFTER',
+                               datetime.timedelta(days=1))
+
+
+class DeviceStatus:
+    """ Connection states of a device based on its last ping. """
+    ONLINE = 'online'
+    STALE = 'stale'
+    OFFLINE = 'offline'
+
+
+def get_status_thresholds(update_interval, now=None):
+    """
+    Returns the times after which a ping counts as online and as stale. A device is online if it
+    pinged within two update intervals, stale if it pinged more recently than the offline
+    threshold, and offline otherwise.
+    """
+    if now is None:
+        now = timezone.now()
+    return now - 2 * update_interval, now - DEVICE_OFFLINE_AFTER
+
+
+def get_status(last_ping, update_interval, now=None):
+    """ Returns the connection status for a ping time. """
+    online_after, stale_after = get_status_thresholds(update_interval, now)
+    if last_ping is not None and last_ping >= online_after:
+        return DeviceStatus.ONLINE
+    elif last_ping is not None and last_ping >= stale_after:
+        return DeviceStatus.STALE
+    return DeviceStatus.OFFLINE
+
+
+class HeartbeatBuffer:
+    """ Buffers pings for a model in a Redis hash keyed by primary key. """
+
+    def __init__(self, model, name, fields=()):
+        self.model = model
+        self.fields = tuple(fields)
+        self.key = 'heartbeats:{}'.format(name)
+        self.flush_lock_key = 'heartbeats:{}:flushed'.format(name)
+
+    @property
+    def redis(self):
+        return get_redis_connection('default')
+
+    def record(self, pk, **values):
+        """
+        Records a ping for the object with the provided primary key, along with values for any
+        of the buffered fields. Flushes the buffer if it hasn't been flushed recently.
+        """
+        entry = {field: values[field] for field in self.fields if field in values}
+        entry['last_ping'] = timezone.now().isoformat()
+        self.redis.hset(self.key, pk, json.dumps(entry))
+        # Only one process gets the lock per interval, so the buffer is flushed at most once
+        # per interval no matter how many processes are recording pings.
+        if self.redis.set(self.flush_lock_key, 1, nx=True, ex=HEARTBEAT_FLUSH_INTERVAL):
+            self.flush()
+
+    def pending(self, pk):
+        """ Returns the buffered values for the object, or None if it has no buffered ping. """
+        entry = self.redis.hget(self.key, pk)
+        if entry is None:
+            return None
+        return self._decode(entry)
+
+    def pending_many(self, pks):
+        """ Returns the buffered values for the objects by primary key, with a single HMGET. """
+        pks = list(pks)
+        if not pks:
+            return {}
+        entries = self.redis.hmget(self.key, pks)
+        return {pk: self._decode(entry) for pk, entry in zip(pks, entries) if entry is not None}
+
+    def load_last_pings(self, instances):
+        """
+        Loads the latest pings of many instances with a single Redis call, so that
+        ``last_ping`` doesn't need one call per instance.
+        """
+        instances = list(instances)
+        pending = self.pending_many(instance.pk for instance in instances)
+        for instance in instances:
+            entry = pending.get(instance.pk)
+            instance.buffered_last_ping = entry['last_ping'] if entry else instance.last_ping
+
+    def last_ping(self, instance):
+        """ Returns the time of the latest ping of the instance, buffered or saved. """
+        if hasattr(instance, 'buffered_last_ping'):
+            return instance.buffered_last_ping
+        entry = self.pending(instance.pk)
+        if entry is not None:
+            return entry['last_ping']
+        return instance.last_ping
+
+    @staticmethod
+    def _decode(entry):
+        entry = json.loads(entry.decode('utf-8'))
+        entry['last_ping'] = parse_datetime(entry['last_ping'])
+        return entry
+
+    def flush(self):
+        """ Writes all buffered pings to the database in bulk updates. Returns the row count. """
+        pipeline = self.redis.pipeline(transaction=True)
+        pipeline.hgetall(self.key)
+        pipeline.delete(self.key)
+        entries, _ = pipeline.execute()
+        entries = [(int(pk), self._decode(entry)) for pk, entry in entries.items()]
+
+        for start in range(0, len(entries), HEARTBEAT_FLUSH_BATCH_SIZE):
+            batch = entries[start:start + HEARTBEAT_FLUSH_BATCH_SIZE]
+            updates = {
+                'last_ping': self._case('last_ping', batch, models.DateTimeField()),
+            }
+            for field in self.fields:
+                output_field = self.model._meta.get_field(field)
+                updates[field] = self._case(field, batch, output_field)
+            self.model.objects.filter(pk__in=[pk for pk, _ in batch]).update(**updates)
+        return len(entries)
+
+    @staticmethod
+    def _case(field, batch, output_field):
+        """ Builds a CASE expression that sets each row to its buffered value for the field. """
+        whens = [When(pk=pk, then=Value(entry[field], output_field=output_field))
+                 for pk, entry in batch if field in entry]
+        return Case(*whens, default=F(field), output_field=output_field)
+
+
+device_heartbeats = HeartbeatBuffer(Device, 'device', fields=('build_version',))
+mirror_heartbeats = HeartbeatBuffer(MirrorServer, 'mirror')
@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+""" Writes buffered device and mirror heartbeats to the database. """
+from django.core.management.base import BaseCommand
+
+from devicemanager.heartbeat import device_heartbeats, mirror_heartbeats
+
+
+class Command(BaseCommand):
+    help = 'Writes buffered device and mirror heartbeats to the database.'
+
+    def handle(self, *args, **options):
+        devices = device_heartbeats.flush()
+        mirrors = mirror_heartbeats.flush()
+        self.stdout.write('Flushed {} device and {} mirror heartbeats.'.format(devices, mirrors))
@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+""" Deletes device screenshots that fall outside the retention policy. """
+from django.core.management.base import BaseCommand
+
+from devicemanager.screenshots import purge_screenshots
+
+
+class Command(BaseCommand):
+    help = 'Deletes device screenshots that fall outside the retention policy.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--device', type=int, action='append', dest='device_ids',
+                            help='Only purge screenshots of the device with this id.')
+
+    def handle(self, *args, **options):
+        deleted = purge_screenshots(options['device_ids'])
+        self.stdout.write('Deleted {} screenshots.'.format(deleted))
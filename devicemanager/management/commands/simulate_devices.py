@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+Simulates a fleet of devices to measure how much device traffic a server can handle.
+
+Every simulated device polls its content and its pending commands on its update interval, and
+downloads media whose checksum changed since its last download. Requests are either handled
+in-process with the Django test client, which also counts database queries, or sent over HTTP to
+a running server.
+"""
+import heapq
+import json
+import math
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from devicemanager.models import Device
+
+DEFAULT_CONTENT_PATH = '/devices/{device_id}/'
+DEFAULT_COMMANDS_PATH = '/api/device_commands/{device_id}/'
+
+
+def percentile(values, fraction):
+    """ Returns the value at the fraction of the sorted values using the nearest-rank method. """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(int(math.ceil(fraction * len(ordered))) - 1, 0)]
+
+
+class EndpointStats:
+    """ Collects latencies, errors and query counts of the requests to one endpoint. """
+
+    def __init__(self):
+        self.latencies = []
+        self.query_counts = []
+        self.errors = 0
+
+    def add(self, latency, ok, query_count=None):
+        self.latencies.append(latency)
+        if not ok:
+            self.errors += 1
+        if query_count is not None:
+            self.query_counts.append(query_count)
+
+    def summary(self, duration):
+        count = len(self.latencies)
+        return {
+            'requests': count,
+            'rate': count / duration if duration else 0,
+            'error_rate': self.errors / count if count else 0,
+            'p50': percentile(self.latencies, 0.5),
+            'p90': percentile(self.latencies, 0.9),
+            'p99': percentile(self.latencies, 0.99),
+            'max': max(self.latencies) if self.latencies else None,
+            'queries': (sum(self.query_counts) / len(self.query_counts)
+                        if self.query_counts else None),
+        }
+
+
+class InProcessTransport:
+    """
+    Sends requests through the Django test client and counts their queries. Absolute URLs, like
+    the media URLs of other hosts, are sent with their host as the Host header.
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.local = threading.local()
+
+    def get(self, url):
+        if not hasattr(self.local, 'client'):
+            self.local.client = Client()
+        parts = urlsplit(url)
+        extra = {}
+        if parts.netloc or self.host:
+            extra['HTTP_HOST'] = parts.netloc or self.host
+        with CaptureQueriesContext(connection) as queries:
+            try:
+                response = self.local.client.get(parts.path, dict(parse_qsl(parts.query)),
+                                                 **extra)
+            except Exception:
+                # The test client raises exceptions from views, count them as server errors.
+                return 500, b'', len(queries)
+            if response.streaming:
+                content = b''.join(response.streaming_content)
+            else:
+                content = response.content
+        return response.status_code, content, len(queries)
+
+
+class HttpTransport:
+    """ Sends requests to a running server. Query counts aren't available in this mode. """
+
+    def __init__(self, base_url, host):
+        self.base_url = base_url.rstrip('/')
+        self.headers = {'Host': host} if host else {}
+        self.local = threading.local()
+
+    def get(self, url):
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        if not urlsplit(url).netloc:
+            url = self.base_url + url
+        try:
+            response = self.local.session.get(url, headers=self.headers, timeout=30)
+        except requests.RequestException:
+            return None, b'', None
+        return response.status_code, response.content, None
+
+
+def find_media(data):
+    """ Yields (url, checksum) pairs for every item with both in a content response. """
+    if isinstance(data, dict):
+        if isinstance(data.get('url'), str) and data.get('checksum'):
+            yield data['url'], data['checksum']
+        for value in data.values():
+            yield from find_media(value)
+    elif isinstance(data, list):
+        for value in data:
+            yield from find_media(value)
+
+
+class SimulatedDevice:
+    """ State of one simulated device. """
+
+    def __init__(self, device_id, interval):
+        self.device_id = device_id
+        self.interval = interval
+        self.checksums = {}
+
+
+class Command(BaseCommand):
+    help = 'Simulates a fleet of devices polling the server and reports latency per endpoint.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--devices', type=int, default=100,
+                            help='Number of devices to simulate, taken from enabled devices.')
+        parser.add_argument('--duration', type=float, default=60,
+                            help='Number of seconds to run the simulation for.')
+        parser.add_argument('--concurrency', type=int, default=10,
+                            help='Number of requests in flight at the same time.')
+        parser.add_argument('--time-scale', type=float, default=1,
+                            help='Divides update intervals, e.g. 60 turns minutes into seconds.')
+        parser.add_argument('--url', default=None,
+                            help='Base URL of a running server. Requests are handled in-process '
+                                 'with query counting if omitted.')
+        parser.add_argument('--host', default=None, help='Host header to send with requests.')
+        parser.add_argument('--content-path', default=DEFAULT_CONTENT_PATH,
+                            help='Path devices poll for content, with a {device_id} field.')
+        parser.add_argument('--commands-path', default=DEFAULT_COMMANDS_PATH,
+                            help='Path devices poll for commands, with a {device_id} field.')
+
+    def handle(self, *args, **options):
+        if options['url']:
+            transport = HttpTransport(options['url'], options['host'])
+        else:
+            transport = InProcessTransport(options['host'])
+
+        devices = [
+            SimulatedDevice(str(device.device_id),
+                            device.owner.update_interval.total_seconds() / options['time_scale'])
+            for device in Device.objects.filter(enabled=True, owner__isnull=False)
+            .select_related('owner')[:options['devices']]
+        ]
+        if not devices:
+            raise CommandError('There are no enabled devices to simulate.')
+
+        stats = defaultdict(EndpointStats)
+        stats_lock = threading.Lock()
+
+        def request(endpoint, url):
+            started = time.monotonic()
+            status, content, query_count = transport.get(url)
+            with stats_lock:
+                stats[endpoint].add(time.monotonic() - started,
+                                    status is not None and status < 400, query_count)
+            return status, content
+
+        def poll(device):
+            request('commands', options['commands_path'].format(device_id=device.device_id))
+            status, content = request('content',
+                                      options['content_path'].format(device_id=device.device_id))
+            if status != 200:
+                return
+            try:
+                data = json.loads(content.decode('utf-8'))
+            except ValueError:
+                return
+            for url, checksum in find_media(data):
+                if device.checksums.get(url) != checksum:
+                    media_status, _ = request('media', url)
+                    if media_status == 200:
+                        device.checksums[url] = checksum
+
+        # Spread the first polls over one interval, like a fleet that has been running a while.
+        started = time.monotonic()
+        schedule = [(started + index * device.interval / len(devices), index)
+                    for index, device in enumerate(devices)]
+        heapq.heapify(schedule)
+        end = started + options['duration']
+
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            pending = set()
+            while schedule and schedule[0][0] < end:
+                due, index = heapq.heappop(schedule)
+                time.sleep(max(due - time.monotonic(), 0))
+                # Apply back pressure so a slow server doesn't build up an unbounded backlog.
+                while len(pending) >= options['concurrency'] * 2:
+                    pending = {future for future in pending if not future.done()}
+                    time.sleep(0.01)
+                pending.add(executor.submit(poll, devices[index]))
+                heapq.heappush(schedule, (due + devices[index].interval, index))
+
+        self._report(stats, time.monotonic() - started)
+
+    def _report(self, stats, duration):
+        self.stdout.write('{:<12}{:>10}{:>10}{:>10}{:>10}{:>10}{:>10}{:>10}{:>10}'.format(
+                'endpoint', 'requests', 'req/s', 'errors', 'p50 ms', 'p90 ms', 'p99 ms',
+                'max ms', 'queries'))
+        for endpoint, endpoint_stats in sorted(stats.items()):
+            summary = endpoint_stats.summary(duration)
+            self.stdout.write('{:<12}{:>10}{:>10.1f}{:>9.1f}%{:>10}{:>10}{:>10}{:>10}{:>10}'.format(
+                    endpoint, summary['requests'], summary['rate'], summary['error_rate'] * 100,
+                    *[self._milliseconds(summary[key]) for key in ('p50', 'p90', 'p99', 'max')],
+                    '-' if summary['queries'] is None else '{:.1f}'.format(summary['queries'])))
+
+    @staticmethod
+    def _milliseconds(seconds):
+        return '-' if seconds is None else '{:.1f}'.format(seconds * 1000)
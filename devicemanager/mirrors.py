@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Prefetch manifests for mirror servers.
+
+A mirror server caches content for the devices in the device groups linked to it. The manifest
+lists every blob those devices may need over the next few days so the mirror can fetch them
+ahead of time, for instance during off-peak hours, instead of waiting for devices to ask.
+"""
+import datetime
+import hashlib
+
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.db.models import Q
+from django.http import Http404, JsonResponse
+from django.utils import timezone
+
+from devicemanager.models import DeviceGroup, MirrorServer
+from feedmanager.models import WebFeed
+from mediamanager.models import (CalendarAsset, ContentFeed, FeedAsset, ImageAsset, VideoAsset,
+                                 WebAsset, )
+from schedule_manager.models import SpecialContent
+from utils.errors import InvalidAssetError, NoContentAssetError
+
+#: Default and maximum number of days of upcoming content included in a manifest.
+DEFAULT_MANIFEST_DAYS = 3
+MAX_MANIFEST_DAYS = 14
+
+#: How long the manifests sent to a mirror are remembered for delta requests.
+MIRROR_MANIFEST_TIMEOUT = 30 * 24 * 60 * 60
+
+
+def _manifest_cache_key(mirror, days, manifest_id):
+    return 'mirror-manifest:{}:{}:{}'.format(mirror.mirror_id, days, manifest_id)
+
+
+def _parse_flag(value):
+    return value is not None and value.lower() in ('1', 'true', 'yes', 'on')
+
+
+def get_mirror_content_feeds(mirror, days):
+    """
+    Returns the content feeds shown by device groups behind the mirror, including scheduled
+    content and special content for the next number of days.
+    """
+    device_groups = DeviceGroup.objects.filter(mirror=mirror)
+    today = timezone.localtime(timezone.now()).date()
+    special_content = SpecialContent.objects.filter(
+            device_group__in=device_groups,
+            date__gte=today,
+            date__lt=today + datetime.timedelta(days=days),
+    ).values('content_id')
+    return ContentFeed.objects.filter(
+            Q(devicegroup__in=device_groups) |
+            Q(scheduledcontent__device_group__in=device_groups) |
+            Q(id__in=special_content)
+    ).distinct().select_related('media_playlist')
+
+
+def _file_blob(url, checksum, size):
+    return {'url': url, 'checksum': checksum, 'size': size}
+
+
+def _field_file_size(field_file):
+    try:
+        return field_file.size
+    except (OSError, NotImplementedError):
+        return None
+
+
+def _asset_blobs(asset, days):
+    """ Yields the blobs needed to show an asset over the next number of days. """
+    if isinstance(asset, (VideoAsset, ImageAsset)):
+        yield _file_blob(asset.media_file.url, asset.checksum, asset.file_size)
+    elif isinstance(asset, FeedAsset):
+        feed = asset.feed.get_subtype()
+        if isinstance(feed, WebFeed):
+            yield _file_blob(feed.get_asset_url(), feed.checksum, None)
+            return
+        # Image and video feeds show a different snippet every day.
+        today = datetime.date.today()
+        for offset in range(days):
+            try:
+                snippet = feed.get_snippet_for_date(today + datetime.timedelta(days=offset))
+            except ObjectDoesNotExist:
+                continue
+            yield _file_blob(snippet.media.url, snippet.checksum, _field_file_size(snippet.media))
+    elif isinstance(asset, (WebAsset, CalendarAsset)):
+        media_item = asset.as_dict()
+        yield _file_blob(media_item['url'], media_item['checksum'], None)
+
+
+def build_mirror_manifest(mirror, days=DEFAULT_MANIFEST_DAYS):
+    """ Returns a list of the blobs referenced by all content feeds behind the mirror. """
+    now = timezone.now()
+    blobs = {}
+    for content_feed in get_mirror_content_feeds(mirror, days):
+        if content_feed.media_playlist is None:
+            continue
+        playlist_items = content_feed.media_playlist.playlistitem_set.exclude(
+                expire_on__lt=now).select_related('item')
+        for pl_item in playlist_items:
+            try:
+                for blob in _asset_blobs(pl_item.item.get_subtype(), days):
+                    blobs[blob['checksum']] = blob
+            except (NoContentAssetError, InvalidAssetError, ObjectDoesNotExist):
+                continue
+    return sorted(blobs.values(), key=lambda blob: blob['checksum'])
+
+
+def mirror_manifest_view(request, mirror_id):
+    """
+    Returns the prefetch manifest for a mirror server.
+
+    The ``days`` parameter sets how many days of upcoming content to include. Every manifest has
+    an id, with ``delta=1`` and ``since`` set to the id of the last manifest the mirror has
+    synced, only blobs added since that manifest are listed along with the checksums of blobs
+    that are no longer needed. A full manifest is returned if that manifest is unknown or was
+    for a different number of days.
+    """
+    try:
+        mirror = MirrorServer.objects.get(mirror_id=mirror_id)
+    except (MirrorServer.DoesNotExist, ValidationError, ValueError):
+        raise Http404()
+
+    try:
+        days = min(max(int(request.GET.get('days', DEFAULT_MANIFEST_DAYS)), 1),
+                   MAX_MANIFEST_DAYS)
+    except ValueError:
+        days = DEFAULT_MANIFEST_DAYS
+
+    blobs = build_mirror_manifest(mirror, days)
+    checksums = {blob['checksum'] for blob in blobs}
+    # Manifests are identified by their content, so requests that see the same content share
+    # an id and remembering a manifest doesn't depend on the mirror having synced it.
+    manifest_id = hashlib.md5(' '.join(sorted(checksums)).encode('utf-8')).hexdigest()
+    cache.set(_manifest_cache_key(mirror, days, manifest_id), checksums, MIRROR_MANIFEST_TIMEOUT)
+
+    synced = None
+    since = request.GET.get('since')
+    if _parse_flag(request.GET.get('delta')) and since:
+        synced = cache.get(_manifest_cache_key(mirror, days, since))
+
+    manifest = {
+        'mirror_id': str(mirror.mirror_id),
+        'manifest_id': manifest_id,
+        'generated': timezone.now().isoformat(),
+        'days': days,
+    }
+    if synced is not None:
+        manifest['delta'] = True
+        manifest['since'] = since
+        manifest['blobs'] = [blob for blob in blobs if blob['checksum'] not in synced]
+        manifest['removed'] = sorted(synced - checksums)
+    else:
+        manifest['delta'] = False
+        manifest['blobs'] = blobs
+    return JsonResponse(manifest)
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Screenshot processing and retention.
+
+Devices upload full-size PNG screenshots. Uploads are saved as they arrive and a background task
+recompresses them to JPEG and generates a thumbnail. Retention keeps the latest screenshots of
+each device, plus one screenshot per history interval for a while longer, and deletes the rest
+along with their files in batches.
+"""
+import datetime
+import io
+import os
+
+from PIL import Image
+from channels import Channel
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+
+from devicemanager.models import DeviceScreenShot
+from utils.files import generate_image_thumbnail
+
+#: Number of most recent screenshots kept for every device.
+SCREENSHOT_KEEP_LATEST = getattr(settings, 'SIGNOXE_SCREENSHOT_KEEP_LATEST', 20)
+
+#: Older screenshots are downsampled to one per interval...
+SCREENSHOT_HISTORY_INTERVAL = getattr(settings, 'SIGNOXE_SCREENSHOT_HISTORY_INTERVAL',
+                                      datetime.timedelta(hours=6))
+
+#: ...and deleted entirely once they are older than this.
+SCREENSHOT_HISTORY_MAX_AGE = getattr(settings, 'SIGNOXE_SCREENSHOT_HISTORY_MAX_AGE',
+                                     datetime.timedelta(days=30))
+
+#: Number of screenshots deleted in a single query.
+SCREENSHOT_PURGE_BATCH_SIZE = 200
+
+SCREENSHOT_QUALITY = 80
+SCREENSHOT_THUMBNAIL_SIZE = (320, 180)
+
+
+def get_thumbnail_path(screenshot):
+    """
+    Returns the storage path of the thumbnail of the screenshot. Thumbnails are named by primary
+    key, since screenshots of different devices can have the same file name.
+    """
+    return os.path.join('thumbnails', 'screenshots', '{}.jpg'.format(screenshot.pk))
+
+
+def queue_screenshot_processing(screenshot_ids):
+    """ Queues the screenshots for recompression once the current transaction commits. """
+    transaction.on_commit(lambda: Channel('process-screenshots').send({
+        'ids': list(screenshot_ids),
+    }))
+
+
+def process_screenshot(screenshot):
+    """
+    Recompresses the screenshot image to JPEG and generates its thumbnail. Images that are
+    already JPEG are only thumbnailed.
+    """
+    image_file = screenshot.image
+    storage = image_file.storage
+    old_name = image_file.name
+
+    image_file.open('rb')
+    try:
+        data = image_file.read()
+    finally:
+        image_file.close()
+    image = Image.open(io.BytesIO(data))
+
+    thumbnail = generate_image_thumbnail(io.BytesIO(data), *SCREENSHOT_THUMBNAIL_SIZE)
+    thumbnail_path = get_thumbnail_path(screenshot)
+    if storage.exists(thumbnail_path):
+        storage.delete(thumbnail_path)
+    storage.save(thumbnail_path, ContentFile(thumbnail.getvalue()))
+
+    if image.format == 'JPEG':
+        return
+
+    filename, _ = os.path.splitext(os.path.basename(old_name))
+    image_file.save(filename + '.jpg', ContentFile(_to_jpeg(image).getvalue()), save=False)
+    DeviceScreenShot.objects.filter(pk=screenshot.pk).update(image=image_file.name)
+    storage.delete(old_name)
+
+
+def _to_jpeg(image):
+    output = io.BytesIO()
+    image.convert('RGB').save(output, format='JPEG', quality=SCREENSHOT_QUALITY, optimize=True)
+    return output
+
+
+def process_screenshots(message):
+    """
+    Consumer that processes the screenshots with the ids in the message, and then applies the
+    retention policy to their devices.
+    """
+    device_ids = set()
+    for screenshot in DeviceScreenShot.objects.filter(pk__in=message.content['ids']):
+        process_screenshot(screenshot)
+        device_ids.add(screenshot.device_id)
+    purge_screenshots(device_ids)
+
+
+def get_expired_screenshots(device_id, now=None):
+    """
+    Returns the ids and file names of screenshots of the device that retention doesn't keep.
+    """
+    if now is None:
+        now = timezone.now()
+    oldest = now - SCREENSHOT_HISTORY_MAX_AGE
+    interval = SCREENSHOT_HISTORY_INTERVAL.total_seconds()
+
+    screenshots = DeviceScreenShot.objects.filter(device_id=device_id).order_by(
+            '-timestamp', '-pk').values_list('pk', 'timestamp', 'image')
+    expired = []
+    kept_buckets = set()
+    for index, (pk, timestamp, image) in enumerate(screenshots.iterator()):
+        if index < SCREENSHOT_KEEP_LATEST:
+            continue
+        # Intervals are aligned to the epoch rather than to now, so the screenshot kept for an
+        # interval stays the same from one run to the next.
+        bucket = int(timestamp.timestamp() // interval)
+        if timestamp >= oldest and bucket not in kept_buckets:
+            # Screenshots are newest first, so this keeps the latest one in every interval.
+            kept_buckets.add(bucket)
+            continue
+        expired.append((pk, image))
+    return expired
+
+
+def purge_screenshots(device_ids=None, now=None):
+    """
+    Deletes screenshots, and their files, that fall outside the retention policy for the
+    provided devices or all devices. Returns the number of deleted screenshots.
+    """
+    if device_ids is None:
+        device_ids = (DeviceScreenShot.objects.order_by().values_list('device_id', flat=True)
+                      .distinct())
+    storage = DeviceScreenShot._meta.get_field('image').storage
+
+    deleted = 0
+    for device_id in list(device_ids):
+        expired = get_expired_screenshots(device_id, now)
+        for start in range(0, len(expired), SCREENSHOT_PURGE_BATCH_SIZE):
+            batch = expired[start:start + SCREENSHOT_PURGE_BATCH_SIZE]
+            DeviceScreenShot.objects.filter(pk__in=[pk for pk, _ in batch]).delete()
+            for pk, name in batch:
+                for path in (name, get_thumbnail_path(DeviceScreenShot(pk=pk))):
+                    if path and storage.exists(path):
+                        storage.delete(path)
+            deleted += len(batch)
+    return deleted
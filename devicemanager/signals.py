@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Signal handlers that notify connected devices when the effective content feed of their device
+group changes, that record when devices join a device group, and that queue background
+processing of uploaded screenshots and app builds.
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from devicemanager.commands import record_group_membership
+from devicemanager.consumers import get_device_groups_for_content_feeds, notify_device_groups
+from devicemanager.deltas import queue_patch_generation
+from devicemanager.models import AppBuild, Device, DeviceGroup, DeviceScreenShot
+from devicemanager.screenshots import queue_screenshot_processing
+from mediamanager.models import (CalendarAsset, ContentFeed, Playlist, PlaylistItem, Ticker,
+                                 TickerSeries, WebAsset, playlist_items_added, )
+from schedule_manager.models import ScheduledContent, SpecialContent
+
+
+def _content_feeds_for(instance):
+    """ Returns a queryset of the content feeds affected by a change to the instance. """
+    if isinstance(instance, ContentFeed):
+        return ContentFeed.objects.filter(pk=instance.pk)
+    elif isinstance(instance, Playlist):
+        return ContentFeed.objects.filter(media_playlist=instance)
+    elif isinstance(instance, PlaylistItem):
+        return ContentFeed.objects.filter(media_playlist_id=instance.playlist_id)
+    elif isinstance(instance, TickerSeries):
+        return ContentFeed.objects.filter(ticker_series=instance)
+    elif isinstance(instance, Ticker):
+        return ContentFeed.objects.filter(ticker_series_id=instance.ticker_series_id)
+    elif isinstance(instance, (WebAsset, CalendarAsset)):
+        return ContentFeed.objects.filter(media_playlist__playlistitem__item=instance)
+    return ContentFeed.objects.none()
+
+
+# noinspection PyUnusedLocal
+def content_changed(sender, instance=None, **kwargs):
+    """ Notifies devices in all device groups whose content feed is affected by the change. """
+    if kwargs.get('raw', False):
+        return  # Don't notify devices while loading fixtures
+
+    if isinstance(instance, DeviceGroup):
+        device_group_ids = [instance.pk]
+    elif isinstance(instance, (ScheduledContent, SpecialContent)):
+        device_group_ids = [instance.device_group_id]
+    else:
+        content_feeds = _content_feeds_for(instance)
+        device_group_ids = list(get_device_groups_for_content_feeds(content_feeds)
+                                .values_list('pk', flat=True))
+
+    if device_group_ids:
+        # Wait for the transaction to commit so devices don't fetch stale content.
+        transaction.on_commit(lambda: notify_device_groups(device_group_ids))
+
+
+# noinspection PyUnusedLocal
+def playlist_items_created(sender, playlist_ids=(), **kwargs):
+    """ Notifies devices showing any of the playlists that items were added to in bulk. """
+    content_feeds = ContentFeed.objects.filter(media_playlist_id__in=playlist_ids)
+    device_group_ids = list(get_device_groups_for_content_feeds(content_feeds)
+                            .values_list('pk', flat=True))
+    if device_group_ids:
+        transaction.on_commit(lambda: notify_device_groups(device_group_ids))
+
+
+# noinspection PyUnusedLocal
+def device_saved(sender, instance=None, **kwargs):
+    """ Records the group of the device, so it doesn't get commands sent to it before it joined. """
+    if kwargs.get('raw', False) or instance.group_id is None:
+        return
+    device_id, device_group_id = instance.device_id, instance.group_id
+    transaction.on_commit(lambda: record_group_membership(device_id, device_group_id))
+
+
+# noinspection PyUnusedLocal
+def screenshot_uploaded(sender, instance=None, created=False, **kwargs):
+    """ Queues new screenshots for recompression. """
+    if created and not kwargs.get('raw', False):
+        queue_screenshot_processing([instance.pk])
+
+
+# noinspection PyUnusedLocal
+def app_build_saved(sender, instance=None, **kwargs):
+    """ Queues patch generation for the release channel of the build. """
+    if not kwargs.get('raw', False):
+        queue_patch_generation(instance.release_channel_id)
+
+
+CONTENT_MODELS = (
+    CalendarAsset,
+    ContentFeed,
+    DeviceGroup,
+    Playlist,
+    PlaylistItem,
+    ScheduledContent,
+    SpecialContent,
+    Ticker,
+    TickerSeries,
+    WebAsset,
+)
+
+
+def connect_signals():
+    for model in CONTENT_MODELS:
+        post_save.connect(content_changed, sender=model,
+                          dispatch_uid='device-content-changed-save')
+        post_delete.connect(content_changed, sender=model,
+                            dispatch_uid='device-content-changed-delete')
+    playlist_items_added.connect(playlist_items_created,
+                                 dispatch_uid='device-playlist-items-added')
+    post_save.connect(device_saved, sender=Device, dispatch_uid='device-saved')
+    post_save.connect(screenshot_uploaded, sender=DeviceScreenShot,
+                      dispatch_uid='device-screenshot-uploaded')
+    post_save.connect(app_build_saved, sender=AppBuild, dispatch_uid='app-build-saved')
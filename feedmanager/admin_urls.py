@@ -2,8 +2,10 @@
 """ URL routing configuration for feed manager app. """
 from django.conf.urls import url
 
-from feedmanager.views import BulkUploadSnippetsView
+from feedmanager.views import BulkUploadSnippetsView, bulk_upload_report_view
 
 urlpatterns = [
-    url(r'bulk-upload-snippets/', BulkUploadSnippetsView.as_view(), name='bulk-upload-snippets')
+    url(r'bulk-upload-snippets/(?P<import_id>[0-9a-f]+)/', bulk_upload_report_view,
+        name='bulk-upload-snippets-report'),
+    url(r'bulk-upload-snippets/', BulkUploadSnippetsView.as_view(), name='bulk-upload-snippets'),
 ]
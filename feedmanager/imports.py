@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk snippet imports.
+
+Uploaded files, or the members of uploaded zip archives, are streamed to a staging area in
+storage and imported in a background job. The job hashes and stores the media files in parallel,
+creates the snippet rows with a few bulk inserts, and keeps a per-file report in the cache that
+the upload page polls.
+"""
+import hashlib
+import os
+import re
+import uuid
+import zipfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import magic
+import yaml
+from channels import Channel
+from django.core.cache import cache
+from django.core.files import File
+from django.db import DatabaseError, transaction
+from django.utils.dateparse import parse_date
+from raven.contrib.django.raven_compat.models import client
+
+from feedmanager.models import (WEB_FEED_PAGE, Category, ImageSnippet, VideoSnippet, WebFeed,
+                                WebSnippet, )
+from utils import files
+from utils.bulk import bulk_create_inherited
+from utils.page_cache import invalidate_pages
+from utils.storage import NormalStorage
+
+STAGING_STORAGE = NormalStorage()
+STAGING_DIR = 'snippet-imports'
+
+#: Number of files hashed and stored at the same time.
+IMPORT_WORKERS = 4
+
+#: How long the report of an import is kept.
+REPORT_TIMEOUT = 24 * 60 * 60
+
+YAML_EXTENSIONS = ('.yml', '.yaml')
+
+
+class ImportStatus:
+    """ States of an import and of the files in it. """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    CREATED = 'created'
+    FAILED = 'failed'
+
+
+def _report_cache_key(import_id):
+    return 'snippet-import:{}'.format(import_id)
+
+
+def get_report(import_id):
+    """ Returns the report of the import, or None if there is no such import. """
+    return cache.get(_report_cache_key(import_id))
+
+
+def _save_report(import_id, report):
+    cache.set(_report_cache_key(import_id), report, REPORT_TIMEOUT)
+
+
+def _iter_uploads(uploaded_files):
+    """
+    Yields the path and a file object for every uploaded file, expanding zip archives into their
+    members. Members of archives have the path of the archive and their path inside it.
+    """
+    for uploaded_file in uploaded_files:
+        if not uploaded_file.name.lower().endswith('.zip'):
+            yield uploaded_file.name, uploaded_file
+            continue
+        with zipfile.ZipFile(uploaded_file) as archive:
+            for member in archive.infolist():
+                name = os.path.basename(member.filename)
+                # Skip directories and metadata files added by some archivers
+                if not name or name.startswith('.') or member.filename.startswith('__MACOSX'):
+                    continue
+                with archive.open(member) as member_file:
+                    yield '{}/{}'.format(uploaded_file.name, member.filename), member_file
+
+
+def _pending_files(staged):
+    return [{'path': path, 'status': ImportStatus.PENDING} for path, _ in staged]
+
+
+def start_import(category, uploaded_files):
+    """
+    Streams the uploaded files to the staging area and queues the import. Returns the import id.
+    """
+    import_id = uuid.uuid4().hex
+    staged = []
+    for index, (path, upload) in enumerate(_iter_uploads(uploaded_files)):
+        # Prefix staged files with their index, different archives can hold the same names.
+        name = os.path.basename(path)
+        staged_name = STAGING_STORAGE.save(
+                os.path.join(STAGING_DIR, import_id, '{}-{}'.format(index, name)),
+                File(upload, name=name))
+        staged.append((path, staged_name))
+
+    _save_report(import_id, {
+        'status': ImportStatus.PENDING,
+        'files': _pending_files(staged),
+    })
+    Channel('import-snippets').send({
+        'import_id': import_id,
+        'category': category.pk,
+        'files': staged,
+    })
+    return import_id
+
+
+def process_file_name(file_name, has_date):
+    """
+    Returns the date and title for a snippet from its file name. Raises a ValueError if the file
+    name needs to but doesn't start with a valid date.
+    """
+    date = None
+    title = file_name
+
+    if has_date:
+        date, _, title = title.partition('_')
+        if not title or parse_date(date) is None:
+            raise ValueError('File name must start with a date, e.g. 2017-11-12_title.jpg')
+        date = parse_date(date)
+
+    title = Path(title).stem  # Remove the extension
+    title = re.sub(r'[-_]', ' ', title)  # Replace underscores and dashes with a space
+
+    return date, title
+
+
+def _load_web_snippets(staged_name, category):
+    with STAGING_STORAGE.open(staged_name, 'rb') as staged_file:
+        data = yaml.safe_load(staged_file.read())
+    if not isinstance(data, list):
+        raise ValueError('Invalid file format')
+    snippets = []
+    for item in data:
+        if not isinstance(item, dict):
+            raise ValueError('Invalid file format')
+        snippets.append(WebSnippet(category=category, **item))
+    return snippets
+
+
+def _store_media_file(name, staged_name, category):
+    """
+    Hashes the staged file and stores it as the media of a new, unsaved, file snippet. Returns
+    the snippet, and whether its media was newly written to storage.
+    """
+    with STAGING_STORAGE.open(staged_name, 'rb') as staged_file:
+        mime = magic.from_buffer(staged_file.read(1024), mime=True)
+        if mime in files.IMAGE_MIMES:
+            model = ImageSnippet
+        elif mime in files.VIDEO_MIMES:
+            model = VideoSnippet
+        else:
+            raise ValueError('Invalid file format')
+
+        date, title = process_file_name(name, has_date=category.type == Category.DATED_TYPE)
+        staged_file.seek(0)
+        md5 = hashlib.md5()
+        for chunk in iter(lambda: staged_file.read(64 * 1024), b''):
+            md5.update(chunk)
+
+        snippet = model(title=title, date=date, category=category, checksum=md5.hexdigest())
+        staged_file.seek(0)
+        storage = model._meta.get_field('media').storage
+        media_name = files.md5_file_name(snippet, name)
+        # Media is deduplicated by checksum, so the file may already belong to another snippet.
+        is_new = not storage.exists(media_name)
+        snippet.media = storage.save(media_name, File(staged_file))
+    return snippet, is_new
+
+
+def _prepare_snippets(name, staged_name, category):
+    """
+    Returns the unsaved snippets for a staged file, and the media files that were newly stored
+    for them.
+    """
+    if name.lower().endswith(YAML_EXTENSIONS):
+        return _load_web_snippets(staged_name, category), []
+    snippet, is_new = _store_media_file(name, staged_name, category)
+    return [snippet], [snippet.media] if is_new else []
+
+
+def _insert_snippets(snippets):
+    """ Inserts the snippets with one bulk insert per snippet type. """
+    by_type = defaultdict(list)
+    for snippet in snippets:
+        by_type[type(snippet)].append(snippet)
+    for model, model_snippets in by_type.items():
+        bulk_create_inherited(model, model_snippets)
+
+
+def _create_snippets(prepared, report):
+    """
+    Inserts the prepared snippets of every file in one transaction. If that fails, every file
+    is inserted in its own transaction so only the files that can't be inserted fail. Returns the
+    created snippets.
+    """
+    try:
+        with transaction.atomic():
+            _insert_snippets([snippet for _, snippets in prepared for snippet in snippets])
+        inserted = prepared
+    except DatabaseError:
+        inserted = []
+        for index, snippets in prepared:
+            try:
+                with transaction.atomic():
+                    _insert_snippets(snippets)
+            except DatabaseError as error:
+                report['files'][index].update(status=ImportStatus.FAILED, error=str(error))
+            else:
+                inserted.append((index, snippets))
+
+    for index, snippets in inserted:
+        report['files'][index].update(status=ImportStatus.CREATED, count=len(snippets))
+    return [snippet for _, snippets in inserted for snippet in snippets]
+
+
+def _discard_media(stored_media, created):
+    """ Deletes newly stored media files that no created snippet refers to. """
+    used = {snippet.media.name for snippet in created if hasattr(snippet, 'media')}
+    for media in stored_media:
+        if media.name not in used:
+            media.storage.delete(media.name)
+
+
+def import_snippets(message):
+    """ Consumer that imports the staged files of a bulk upload. """
+    import_id = message.content['import_id']
+    category = Category.objects.get(pk=message.content['category'])
+    staged = message.content['files']
+    report = {
+        'status': ImportStatus.RUNNING,
+        'files': _pending_files(staged),
+    }
+    _save_report(import_id, report)
+
+    def prepare(staged_file):
+        path, staged_name = staged_file
+        try:
+            snippets, stored_media = _prepare_snippets(os.path.basename(path), staged_name,
+                                                       category)
+            return snippets, stored_media, None
+        except ValueError as error:
+            return [], [], str(error)
+        except (TypeError, yaml.YAMLError):
+            return [], [], 'Invalid file format'
+        except Exception:
+            client.captureException()
+            return [], [], 'The file could not be processed'
+        finally:
+            STAGING_STORAGE.delete(staged_name)
+
+    prepared = []
+    stored_media = []
+    try:
+        with ThreadPoolExecutor(max_workers=IMPORT_WORKERS) as executor:
+            for index, (snippets, media, error) in enumerate(executor.map(prepare, staged)):
+                stored_media.extend(media)
+                if error is not None:
+                    report['files'][index].update(status=ImportStatus.FAILED, error=error)
+                else:
+                    prepared.append((index, snippets))
+
+        created = []
+        try:
+            created = _create_snippets(prepared, report)
+        finally:
+            _discard_media(stored_media, created)
+
+        if any(isinstance(snippet, WebSnippet) for snippet in created):
+            # Bulk inserts don't send signals, so clear rendered web feeds of the category here.
+            invalidate_pages(WEB_FEED_PAGE, *WebFeed.objects.filter(category=category)
+                             .values_list('slug', flat=True))
+        report['status'] = ImportStatus.DONE
+    except Exception:
+        report['status'] = ImportStatus.FAILED
+        for entry in report['files']:
+            if entry['status'] == ImportStatus.PENDING:
+                entry.update(status=ImportStatus.FAILED, error='The import failed')
+        raise
+    finally:
+        _save_report(import_id, report)
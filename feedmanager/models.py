@@ -6,15 +6,23 @@ import hashlib
 from django import template
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models import Max
+from django.db.models.signals import post_delete, post_save
 from django.template import Context
 from django.utils import timezone
 from django.utils.text import slugify
 from django_hosts.resolvers import reverse
 
 from client_manager.models import Client
-from mediamanager.models import FeedAsset, Playlist
+from mediamanager.models import FeedAsset, Playlist, PlaylistItem, playlist_items_added
 from mediamanager.types import AssetTypes
+from utils.dates import next_midnight
 from utils.files import md5_file_name
+from utils.page_cache import invalidate_pages
+from utils.queries import enforce_query_budget
+
+#: Kind of rendered web feed pages in the page cache
+WEB_FEED_PAGE = 'web-feed'
 
 
 def md5_checksum(content):
@@ -47,14 +55,14 @@ class Category(models.Model):
                                       '(e.g. "This day in history"), '
                                       'only content relevant to the current date will be fetched.')
 
-    def get_snippets(self, snippet_type):
+    def get_snippets(self, snippet_type, day=None):
         """
         Returns the snippets associated with this category while applying the
-        date filter if needed.
+        date filter if needed. The filter uses the current date unless a day is provided.
         """
         snippets = snippet_type.objects.filter(category=self)
         if self.type == 'DATED':
-            snippets = snippets.filter(date=timezone.now().date())
+            snippets = snippets.filter(date=day or timezone.now().date())
         return snippets
 
     def __str__(self):
@@ -220,18 +228,30 @@ class Feed(models.Model):
             feed_asset = FeedAsset.objects.get(feed=self)
         playlist.playlistitem_set.create(item=feed_asset)
 
+    @enforce_query_budget(5)
     def _create_playlist_items(self, feed_asset):
         """
-        Creates a playlist item for this feed in every playlist subscribed to feeds.
+        Creates a playlist item for this feed at the end of every playlist subscribed to feeds
+        that doesn't have one yet. Items are created in bulk, so listeners of
+        ``playlist_items_added`` are notified instead of ``post_save``.
         :param feed_asset: The feed asset associated with this Feed
         :type feed_asset: FeedAsset
         :rtype: None
         """
-        if self.published:
-            for playlist in Playlist.objects.filter(auto_add_feeds=True,
-                                                    owner__in=self.publish_to.all()):
-                if not playlist.playlistitem_set.filter(item=feed_asset).exists():
-                    self.add_feed_item_to_playlist(playlist)
+        if not self.published:
+            return
+        playlists = Playlist.objects.filter(
+                auto_add_feeds=True, owner__in=self.publish_to.all(),
+        ).exclude(playlistitem__item=feed_asset).annotate(
+                last_position=Max('playlistitem__position')).values_list('id', 'last_position')
+        items = PlaylistItem.objects.bulk_create([
+            PlaylistItem(playlist_id=playlist_id, item=feed_asset,
+                         position=0 if last_position is None else last_position + 1)
+            for playlist_id, last_position in playlists
+        ])
+        if items:
+            playlist_items_added.send(sender=PlaylistItem,
+                                      playlist_ids=[item.playlist_id for item in items])
 
     def _manage_feed_asset(self):
         """
@@ -311,24 +331,40 @@ class Feed(models.Model):
     @property
     def snippets(self):
         """Returns the snippets for this feed."""
-        if isinstance(self, Feed):
+        return self.get_snippets()
+
+    def get_snippets(self, day=None):
+        """Returns the snippets for this feed on the given day, or today."""
+        if type(self) is Feed:
             snippet_type = self.get_subtype().snippet_type
         else:
             snippet_type = self.snippet_type
-        return self.category.get_snippets(snippet_type)
+        return self.category.get_snippets(snippet_type, day=day)
 
     def get_snippet_for_today(self):
         """ Retuns the snippet for the day. """
-        snippets = self.snippets
+        return self.get_snippet_for_date(date.today())
+
+    def get_snippet_for_date(self, day):
+        """
+        Returns the snippet that this feed shows on the provided date. Snippets are memoised on
+        the instance, since the URL and checksum of a feed both need the snippet.
+        """
+        snippets_by_day = self.__dict__.setdefault('_snippets_by_day', {})
+        if day in snippets_by_day:
+            return snippets_by_day[day]
+
+        snippets = self.get_snippets(day=day)
         snippet_count = snippets.count()
 
         if snippet_count == 0:  # If there are no snippets this feed is invalid.
             raise self.snippet_type.DoesNotExist
 
         # index = hash(date.today()) % snippet_count
-        # date.today().timetuple().tm_yday returns the day of the year for today.
-        index = date.today().timetuple().tm_yday % snippet_count
-        return snippets[index]
+        # timetuple().tm_yday returns the day of the year for the date.
+        index = day.timetuple().tm_yday % snippet_count
+        snippets_by_day[day] = snippets[index]
+        return snippets_by_day[day]
 
     def __str__(self):
         return self.name
@@ -380,6 +416,10 @@ class WebFeed(Feed):
             }))
         return self._rendered_content
 
+    def render_page(self):
+        """ Returns the rendered page and the time at which it changes, at midnight. """
+        return self.rendered_content(), next_midnight()
+
     @property
     def checksum(self):
         """Returns md5_checksum for today's asset for this feed"""
@@ -427,3 +467,25 @@ class VideoFeed(Feed):
     def get_asset_url(self):
         """ Returns a URL for this feed. """
         return self.get_absolute_url()
+
+
+# noinspection PyUnusedLocal
+def invalidate_rendered_feeds(sender, instance=None, **kwargs):
+    """ Removes cached rendered web feed pages affected by a change to the instance. """
+    if isinstance(instance, WebFeed):
+        invalidate_pages(WEB_FEED_PAGE, instance.slug)
+        return
+    elif isinstance(instance, Template):
+        feeds = WebFeed.objects.filter(template=instance)
+    elif isinstance(instance, WebSnippet):
+        feeds = WebFeed.objects.filter(category_id=instance.category_id)
+    elif isinstance(instance, Category):
+        feeds = WebFeed.objects.filter(category=instance)
+    else:
+        return
+    invalidate_pages(WEB_FEED_PAGE, *feeds.values_list('slug', flat=True))
+
+
+for rendered_model in (WebFeed, Template, WebSnippet, Category):
+    post_save.connect(invalidate_rendered_feeds, sender=rendered_model)
+    post_delete.connect(invalidate_rendered_feeds, sender=rendered_model)
@@ -1,40 +1,46 @@
 # -*- coding: utf-8 -*-
 """ View for feed manager. """
-from pathlib import Path
+import zipfile
 
-import re
-import yaml
 from django.contrib.admin.views.decorators import staff_member_required
-from django.http import Http404, HttpResponse
+from django.http import Http404, JsonResponse
 from django.shortcuts import render
 from django.utils.decorators import method_decorator
 from django.views.decorators.clickjacking import xframe_options_exempt
 from django.views.generic.base import View
 
-from feedmanager.models import (Category, ImageFeed, ImageSnippet, VideoFeed, VideoSnippet,
-                                WebFeed, WebSnippet, )
-from utils import files
+from feedmanager.imports import get_report, start_import
+from feedmanager.models import (WEB_FEED_PAGE, Category, ImageFeed, ImageSnippet, VideoFeed,
+                                VideoSnippet, WebFeed, WebSnippet, )
+from utils.http import serve_media_file
+from utils.page_cache import cached_page_response
+from utils.queries import query_budget
 
 
+@query_budget(3)
 @xframe_options_exempt
 def web_feed_view(request, slug):
     """ View to display web feed. """
-    try:
-        feed = WebFeed.objects.get(slug=slug)
-    except WebFeed.DoesNotExist:
-        raise Http404()
+    def render():
+        try:
+            feed = WebFeed.objects.select_related('category', 'template').get(slug=slug)
+        except WebFeed.DoesNotExist:
+            raise Http404()
 
-    try:
-        return HttpResponse(feed.rendered_content())
-    except WebSnippet.DoesNotExist:
-        raise Http404('No snippets available for this feed')
+        try:
+            return feed.render_page()
+        except WebSnippet.DoesNotExist:
+            raise Http404('No snippets available for this feed')
+
+    return cached_page_response(request, WEB_FEED_PAGE, slug, render)
 
 
+@query_budget(3)
 @xframe_options_exempt
 def image_feed_view(request, slug):
     """ View to display image feed. """
     try:
-        feed = ImageFeed.objects.get(slug=slug)
+        feed = ImageFeed.objects.select_related('category').get(slug=slug)
     except ImageFeed.DoesNotExist:
         raise Http404()
 
@@ -43,14 +49,16 @@ def image_feed_view(request, slug):
     except ImageSnippet.DoesNotExist:
         raise Http404('No snippets available for this feed')
 
-    return HttpResponse(snip.media, content_type='image')
+    # Devices revalidate using the checksum, and only download the file when it changes.
+    return serve_media_file(request, snip.media, snip.checksum)
 
 
+@query_budget(3)
 @xframe_options_exempt
 def video_feed_view(request, slug):
     """ View to display video feed. """
     try:
-        feed = VideoFeed.objects.get(slug=slug)
+        feed = VideoFeed.objects.select_related('category').get(slug=slug)
     except VideoFeed.DoesNotExist:
         raise Http404()
 
@@ -59,100 +67,51 @@ def video_feed_view(request, slug):
     except VideoSnippet.DoesNotExist:
         raise Http404('No snippets available for this feed')
 
-    return HttpResponse(snip.media, content_type='video')
+    # Devices revalidate using the checksum, and only download the file when it changes.
+    return serve_media_file(request, snip.media, snip.checksum)
 
 
 @method_decorator(staff_member_required, name='dispatch')
 class BulkUploadSnippetsView(View):
-    """ View to enable bulk uploading of snippets. """
+    """
+    View to enable bulk uploading of snippets. Uploads are imported in the background, and the
+    page polls the import report.
+    """
 
     template_name = 'bulk_upload.html'
-    categories = Category.objects.all()
 
-    def _render_page(self, request, error=None, message=None):
+    def _render_page(self, request, error=None, import_id=None):
         categories = Category.objects.all()
         return render(request, self.template_name, {
             'categories': categories,
             'error': error,
-            'message': message
+            'import_id': import_id,
         })
 
-    @staticmethod
-    def _file_name_to_title(file_name):
-        return re.sub(r'[-_]', ' ', file_name)
-
     def get(self, request):
         return self._render_page(request)
 
     def post(self, request):
-        category_id = request.POST.get('category')
-        category = Category.objects.get(pk=category_id)
+        try:
+            category = Category.objects.get(pk=request.POST.get('category'))
+        except (Category.DoesNotExist, ValueError):
+            return self._render_page(request, error='Invalid category selection')
+
         snippet_files = request.FILES.getlist('snippets')
+        if not snippet_files:
+            return self._render_page(request, error='No files uploaded')
 
-        error = None
-        message = ''
-
-        if snippet_files is None or len(snippet_files) == 0:
-            error = 'No files uploaded'
-
-        if category is None:
-            error = 'Invalid category selection'
-
-        file_errors = {}
-
-        for snippet_file in snippet_files:
-            if (snippet_file.content_type.find('yaml') >= 0 or
-                    snippet_file.name.endswith('yml') or
-                    snippet_file.name.endswith('yaml')):
-                error = self._create_web_snippets(snippet_file, category)
-                if error is not None:
-                    file_errors[snippet_file.name] = error
-                continue
-
-            date, title = self._process_file_name(snippet_file.name,
-                                                  has_date=category.type == Category.DATED_TYPE)
-            if snippet_file.content_type in files.IMAGE_MIMES:
-                ImageSnippet.objects.create(title=title, date=date, category=category,
-                                            media=snippet_file)
-            elif snippet_file.content_type in files.VIDEO_MIMES:
-                VideoSnippet.objects.create(title=title, date=date, category=category,
-                                            media=snippet_file)
-            else:
-                file_errors[snippet_file.name] = 'Invalid file format'
-
-        if error is None:
-            error = self._build_error_message(file_errors)
-
-        return self._render_page(request, error=error, message=message)
-
-    @staticmethod
-    def _build_error_message(errors):
-        messages = []
-        for file_name, error, in errors.items():
-            messages.append('{file_name}: {error}'.format(file_name=file_name,
-                                                          error=error))
-        return '\n'.join(messages)
-
-    @staticmethod
-    def _process_file_name(file_name, has_date):
-        date = None
-        title = file_name
-
-        if has_date:
-            date, title = title.split('_', maxsplit=1)
-
-        title = Path(title).stem  # Remove the extension
-        title = re.sub(r'[-_]', ' ', title)  # Replace underscores and dashes with a space
-
-        return date, title
-
-    @staticmethod
-    def _create_web_snippets(snippet_file, category):
         try:
-            data = yaml.safe_load(snippet_file.read())
-        except yaml.YAMLError:
-            return 'Invalid file format'
-        for item in data:
-            snippet = WebSnippet(**item)
-            snippet.category = category
-            snippet.save()
+            import_id = start_import(category, snippet_files)
+        except zipfile.BadZipFile:
+            return self._render_page(request, error='Invalid zip file')
+        return self._render_page(request, import_id=import_id)
+
+
+@staff_member_required
+def bulk_upload_report_view(request, import_id):
+    """ Returns the report of a bulk upload as JSON. """
+    report = get_report(import_id)
+    if report is None:
+        raise Http404('No such import')
+    return JsonResponse(report)
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+Offline content bundles.
+
+A bundle packages everything a device needs to show a content feed in a single tar archive: the
+media files in its playlist, the rendered pages for web, calendar and feed assets, and a
+manifest with the playlist, tickers and settings. Devices and mirror servers can download it in
+one stream, and resume the download with range requests.
+
+Bundles are content-addressed by a checksum of their manifest, which includes the checksum of
+every blob, so an unchanged feed always maps to an existing bundle. Calendar and web feed pages
+come from the page cache, which is invalidated when their content changes, so resolving a
+bundle only renders pages that have changed. Rendered pages are stored in a per-blob cache, and
+media files are already stored by checksum.
+"""
+import hashlib
+import io
+import json
+import os
+import tarfile
+import tempfile
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.utils import timezone
+
+from feedmanager.models import WEB_FEED_PAGE, WebFeed
+from mediamanager.models import (CALENDAR_ASSET_PAGE, CalendarAsset, FeedAsset, ImageAsset,
+                                 VideoAsset, WebAsset, )
+from utils.errors import InvalidAssetError, NoContentAssetError
+from utils.page_cache import get_cached_page
+from utils.storage import NormalStorage
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BUNDLE_STORAGE = NormalStorage()
+
+BUNDLE_DIR = 'bundles'
+BLOB_CACHE_DIR = os.path.join(BUNDLE_DIR, 'blobs')
+
+MANIFEST_NAME = 'manifest.json'
+
+
+class Compression:
+    """ Supported compression formats for bundles. """
+    NONE = 'none'
+    ZSTD = 'zstd'
+
+    EXTENSIONS = {
+        NONE: '.tar',
+        ZSTD: '.tar.zst',
+    }
+
+    @classmethod
+    def is_available(cls, compression):
+        if compression == cls.ZSTD:
+            return zstandard is not None
+        return compression == cls.NONE
+
+
+class Blob:
+    """ A single file in a bundle, either a stored media file or a rendered page. """
+
+    def __init__(self, checksum, path, field_file=None, content=None):
+        self.checksum = checksum
+        self.path = path
+        self.field_file = field_file
+        self.content = content
+
+    def open(self):
+        """ Returns a file object and the size of the blob. """
+        if self.field_file is not None:
+            # FieldFile.open() only returns the file from Django 2.0 on.
+            self.field_file.open('rb')
+            return self.field_file, self.field_file.size
+        cache_name = os.path.join(BLOB_CACHE_DIR, os.path.basename(self.path))
+        if not BUNDLE_STORAGE.exists(cache_name):
+            BUNDLE_STORAGE.save(cache_name, ContentFile(self.content.encode('utf-8')))
+        return BUNDLE_STORAGE.open(cache_name, 'rb'), BUNDLE_STORAGE.size(cache_name)
+
+
+def _file_blob(field_file, checksum):
+    _, extension = os.path.splitext(field_file.name)
+    return Blob(checksum, 'media/{}{}'.format(checksum, extension.lower()), field_file=field_file)
+
+
+def _page_blob(content, checksum):
+    return Blob(checksum, 'pages/{}.html'.format(checksum), content=content)
+
+
+def _cached_page(kind, identifier, render):
+    """ Returns the content and checksum of a page from the page cache. """
+    page = get_cached_page(kind, identifier, render)
+    if page['content'] is None:
+        raise NoContentAssetError
+    return page['content'], page['etag'].strip('"')
+
+
+def _resolve_asset(asset):
+    """
+    Returns the manifest entry for an asset subtype, and its blob or None if it needs to be
+    fetched online.
+    """
+    if isinstance(asset, (VideoAsset, ImageAsset)):
+        return asset.as_dict(), _file_blob(asset.media_file, asset.checksum)
+    elif isinstance(asset, WebAsset):
+        media_item = asset.as_dict()
+        # Web assets that point to an external URL can't be bundled.
+        if asset.url:
+            return media_item, None
+        return media_item, _page_blob(asset.content, media_item['checksum'])
+    elif isinstance(asset, CalendarAsset):
+        content, checksum = _cached_page(CALENDAR_ASSET_PAGE, asset.pk, asset.render_page)
+        # Same as CalendarAsset.as_dict, without rendering the page again.
+        media_item = {'url': asset.get_asset_url(), 'checksum': checksum, 'type': 'web'}
+        return media_item, _page_blob(content, checksum)
+    elif isinstance(asset, FeedAsset):
+        feed = asset.feed.get_subtype()
+        if isinstance(feed, WebFeed):
+            content, checksum = _cached_page(WEB_FEED_PAGE, feed.slug, feed.render_page)
+            # Seed the feed so as_dict uses the cached page instead of rendering it again.
+            feed._rendered_content, feed._checksum = content, checksum
+            return feed.as_dict(), _page_blob(content, checksum)
+        snippet = feed.get_snippet_for_today()
+        return feed.as_dict(), _file_blob(snippet.media, snippet.checksum)
+    return asset.as_dict(), None
+
+
+def collect_bundle(content_feed, device_group=None):
+    """
+    Resolves the content feed and returns its manifest and the list of blobs it needs.
+    The manifest includes a ``bundle_id`` that identifies the bundle by its content, and a
+    ``valid_until`` that includes the next schedule change of the device group, if provided.
+    """
+    playlist = []
+    blobs = {}
+    if content_feed.media_playlist is None:
+        raise content_feed.PlaylistNotSetError('No playlist configured for content feed.')
+    playlist_items = content_feed.media_playlist.playlistitem_set.exclude(
+            expire_on__lt=timezone.now()).order_by('position').select_related('item')
+    for pl_item in playlist_items:
+        try:
+            asset = pl_item.item.get_subtype()
+            media_item, blob = _resolve_asset(asset)
+        except (NoContentAssetError, InvalidAssetError, ObjectDoesNotExist):
+            # Skip items that have no content right now, same as the playlist does
+            continue
+        if 'duration' not in media_item:
+            media_item['duration'] = pl_item.duration
+        if blob is not None:
+            media_item['path'] = blob.path
+            blobs[blob.path] = blob
+        playlist.append(media_item)
+
+    manifest = {
+        'playlist': playlist,
+        'tickers': content_feed.ticker_series.as_list() if content_feed.ticker_series else [],
+        'settings': content_feed.settings(),
+    }
+    serialized = json.dumps(manifest, sort_keys=True, default=str).encode('utf-8')
+    manifest['bundle_id'] = hashlib.md5(serialized).hexdigest()
+    # valid_until is left out of the id, it changes every day even if the content doesn't.
+    valid_until = content_feed.get_valid_until(device_group=device_group)
+    manifest['valid_until'] = valid_until.isoformat() if valid_until is not None else None
+    return manifest, list(blobs.values())
+
+
+def get_bundle_name(bundle_id, compression=Compression.NONE):
+    """ Returns the storage name of the bundle archive. """
+    return os.path.join(BUNDLE_DIR, bundle_id + Compression.EXTENSIONS[compression])
+
+
+def _write_archive(output, manifest, blobs):
+    with tarfile.open(fileobj=output, mode='w|') as archive:
+        manifest_data = json.dumps(manifest, default=str).encode('utf-8')
+        manifest_info = tarfile.TarInfo(MANIFEST_NAME)
+        manifest_info.size = len(manifest_data)
+        manifest_info.mtime = timezone.now().timestamp()
+        archive.addfile(manifest_info, io.BytesIO(manifest_data))
+        for blob in blobs:
+            blob_file, size = blob.open()
+            try:
+                blob_info = tarfile.TarInfo(blob.path)
+                blob_info.size = size
+                archive.addfile(blob_info, blob_file)
+            finally:
+                blob_file.close()
+
+
+def build_bundle(content_feed, compression=Compression.NONE):
+    """
+    Builds the bundle for the content feed unless one with the same content already exists.
+    Returns the manifest and the storage name of the bundle.
+    """
+    manifest, blobs = collect_bundle(content_feed)
+    bundle_name = get_bundle_name(manifest['bundle_id'], compression)
+    if BUNDLE_STORAGE.exists(bundle_name):
+        return manifest, bundle_name
+
+    with tempfile.TemporaryFile() as temp_file:
+        if compression == Compression.ZSTD:
+            writer = zstandard.ZstdCompressor().stream_writer(temp_file)
+            _write_archive(writer, manifest, blobs)
+            writer.flush(zstandard.FLUSH_FRAME)
+        else:
+            _write_archive(temp_file, manifest, blobs)
+        temp_file.seek(0)
+        BUNDLE_STORAGE.save(bundle_name, File(temp_file))
+    return manifest, bundle_name
@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 import json
 
-from mediamanager.models import Asset, ImageAsset, VideoAsset, CalendarAsset
+from mediamanager.bundles import Compression, build_bundle
+from mediamanager.models import Asset, ImageAsset, VideoAsset, CalendarAsset, ContentFeed
 from utils.files import get_image_metadata, get_video_metadata
 
 
@@ -25,6 +26,7 @@ def update_metadata(message, asset_type, metadata_extractor):
             metadata = metadata_extractor(file)
             asset.raw_metadata = json.dumps(metadata)
             asset.build_clean_metadata()
+            asset.file_size = file.size
             asset.save()
 
 
@@ -47,3 +49,10 @@ def update_calendar_assets(message):
     queryset, force_update = _queryset_from_message(message, CalendarAsset)
     for cal in queryset:
         cal.update_calendar_data()
+
+
+def build_content_bundles(message):
+    queryset, _ = _queryset_from_message(message, ContentFeed)
+    compression = message.content.get('compression', Compression.NONE)
+    for content_feed in queryset:
+        build_bundle(content_feed, compression=compression)
@@ -0,0 +1,423 @@
+# -*- coding: utf-8 -*-
+"""
+Generates a synthetic multi-tenant dataset for performance testing.
+
+All rows are created with bulk inserts, and all randomness comes from the seed, so the same
+options always produce the same dataset and benchmark runs on it can be compared.
+"""
+import datetime
+import hashlib
+import json
+import random
+import time
+import uuid
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.text import slugify
+from faker import Faker
+from rest_framework.authtoken.models import Token
+from taggit.models import Tag, TaggedItem
+
+from client_manager.models import Client, ClientSettings, ClientUserProfile, Features
+from devicemanager.models import Device, DeviceGroup
+from feedmanager.models import (Category, Feed, ImageFeed, ImageSnippet, Template, VideoFeed,
+                                VideoSnippet, WebFeed, WebSnippet, )
+from mediamanager.models import (Asset, AssetSearchTerm, CalendarAsset, ContentFeed, FeedAsset,
+                                 ImageAsset, Playlist, PlaylistItem, Ticker, TickerSeries,
+                                 VideoAsset, WebAsset, WebAssetTemplate, )
+from mediamanager.search import build_search_terms
+from mediamanager.types import AssetTypes
+from schedule_manager.models import ScheduledContent, SpecialContent, WeekDays
+from utils.bulk import bulk_create_inherited
+from utils.files import (clean_image_metadata, clean_video_metadata, extract_image_fields,
+                         extract_video_fields, )
+
+#: Share of each asset type among generated assets.
+ASSET_TYPE_WEIGHTS = (
+    (AssetTypes.IMAGE, 50),
+    (AssetTypes.VIDEO, 30),
+    (AssetTypes.WEB, 15),
+    (AssetTypes.CALENDAR, 5),
+)
+
+#: Short and long codec names as reported by ffprobe.
+VIDEO_CODECS = (
+    ('h264', 'H.264 / AVC / MPEG-4 AVC / MPEG-4 part 10'),
+    ('hevc', 'H.265 / HEVC (High Efficiency Video Coding)'),
+    ('vp9', 'Google VP9'),
+)
+IMAGE_FILE_TYPES = ('JPEG', 'PNG')
+RESOLUTIONS = ((1920, 1080), (1280, 720), (3840, 2160), (1080, 1920))
+
+#: All generated users get this password.
+USER_PASSWORD = 'synthetic'
+
+#: The current time of generated datasets is picked from the year starting at this time.
+EPOCH = datetime.datetime(2018, 1, 1, tzinfo=timezone.utc)
+
+
+def _parse_now(value):
+    now = parse_datetime(value)
+    if now is None:
+        raise ValueError(value)
+    if timezone.is_naive(now):
+        now = timezone.make_aware(now, timezone.utc)
+    return now
+
+
+def _sexagesimal(seconds):
+    """ Formats a duration like ffprobe does with ``-sexagesimal``, e.g. 0:01:30.040000. """
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(int(minutes), 60)
+    return '{}:{:02d}:{:09.6f}'.format(hours, minutes, seconds)
+
+
+class Command(BaseCommand):
+    help = ('Generates a synthetic multi-tenant dataset for performance testing. It is meant to '
+            'be run on an empty database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--clients', type=int, default=20)
+        parser.add_argument('--users-per-client', type=int, default=5)
+        parser.add_argument('--device-groups', type=int, default=500,
+                            help='Total number of device groups, spread over the clients.')
+        parser.add_argument('--devices', type=int, default=10000,
+                            help='Total number of devices, spread over the device groups.')
+        parser.add_argument('--assets', type=int, default=500000,
+                            help='Total number of assets, spread over the clients.')
+        parser.add_argument('--tags-per-asset', type=int, default=2)
+        parser.add_argument('--playlists-per-client', type=int, default=10)
+        parser.add_argument('--playlist-length', type=int, default=200)
+        parser.add_argument('--tickers-per-series', type=int, default=20)
+        parser.add_argument('--feeds', type=int, default=20)
+        parser.add_argument('--snippet-days', type=int, default=366,
+                            help='Number of days covered by snippets of dated categories.')
+        parser.add_argument('--now', type=_parse_now, default=None,
+                            help='The time the dataset is generated for, as an ISO 8601 date '
+                                 'and time. Defaults to a time derived from the seed.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.batch_size = options['batch_size']
+        self.random = random.Random(options['seed'])
+        self.fake = Faker()
+        self.fake.seed_instance(options['seed'])
+        # Dates of snippets, schedules and pings are relative to this time, so it is fixed by
+        # the seed rather than taken from the clock.
+        self.now = options['now'] or EPOCH + datetime.timedelta(
+                seconds=self.random.randrange(365 * 24 * 60 * 60))
+
+        with transaction.atomic():
+            clients = self._step('clients', self.create_clients)
+            self._step('users', self.create_users, clients)
+            feed_assets = self._step('feeds', self.create_feeds, clients)
+            assets = self._step('assets', self.create_assets, clients)
+            self._step('tags', self.create_tags, assets)
+            self._step('search terms', self.create_search_terms, assets)
+            content_feeds = self._step('content feeds', self.create_content_feeds, clients,
+                                       assets, feed_assets)
+            device_groups = self._step('device groups', self.create_device_groups, clients,
+                                       content_feeds)
+            self._step('devices', self.create_devices, device_groups)
+            self._step('schedules', self.create_schedules, device_groups, content_feeds)
+
+    def _step(self, name, function, *args):
+        started = time.monotonic()
+        result = function(*args)
+        self.stdout.write('Created {} in {:.1f}s'.format(name, time.monotonic() - started))
+        return result
+
+    def _uuid(self):
+        return uuid.UUID(int=self.random.getrandbits(128), version=4)
+
+    def _checksum(self):
+        return hashlib.md5(self._uuid().bytes).hexdigest()
+
+    def _spread(self, total, owners):
+        """ Yields an owner for each of the total items, with a skewed distribution. """
+        weights = [1 / (index + 1) for index in range(len(owners))]
+        return self.random.choices(owners, weights=weights, k=total)
+
+    def create_clients(self):
+        clients = Client.objects.bulk_create([
+            Client(name=self.fake.company(), logo='logos/synthetic.png',
+                   update_interval=datetime.timedelta(minutes=self.random.choice((1, 2, 5))))
+            for _ in range(self.options['clients'])
+        ], batch_size=self.batch_size)
+        # Bulk inserts skip the signals and save methods that normally create related rows.
+        ClientSettings.objects.bulk_create([ClientSettings(client=client) for client in clients])
+        Features.objects.bulk_create([Features(client=client) for client in clients])
+        return clients
+
+    def create_users(self, clients):
+        password = make_password(USER_PASSWORD)
+        users = []
+        for client in clients:
+            for index in range(self.options['users_per_client']):
+                users.append(User(username='{}-{}-{}'.format(slugify(client.name)[:100],
+                                                             client.pk, index),
+                                  email=self.fake.email(), password=password,
+                                  first_name=self.fake.first_name(),
+                                  last_name=self.fake.last_name()))
+        users = User.objects.bulk_create(users, batch_size=self.batch_size)
+        per_client = self.options['users_per_client']
+        ClientUserProfile.objects.bulk_create([
+            ClientUserProfile(user=user, client=clients[index // per_client])
+            for index, user in enumerate(users)
+        ], batch_size=self.batch_size)
+        Token.objects.bulk_create([
+            Token(user=user, key='{:040x}'.format(self.random.getrandbits(160)))
+            for user in users
+        ], batch_size=self.batch_size)
+
+    def create_feeds(self, clients):
+        """ Creates feed categories with snippets, feeds and their feed assets. """
+        template = Template.objects.create(name='Synthetic', template_data='{{ content }}',
+                                           duration=10)
+        days = [self.now.date() + datetime.timedelta(days=offset)
+                for offset in range(self.options['snippet_days'])]
+        feed_types = (
+            (WebFeed, WebSnippet, AssetTypes.WEB),
+            (ImageFeed, ImageSnippet, AssetTypes.IMAGE),
+            (VideoFeed, VideoSnippet, AssetTypes.VIDEO),
+        )
+
+        feeds_by_type = {feed_model: [] for feed_model, _, _ in feed_types}
+        snippets_by_type = {snippet_model: [] for _, snippet_model, _ in feed_types}
+        for index in range(self.options['feeds']):
+            feed_model, snippet_model, asset_type = feed_types[index % len(feed_types)]
+            dated = index % 2 == 0
+            category = Category.objects.create(
+                    name=self.fake.catch_phrase(),
+                    type=Category.DATED_TYPE if dated else Category.RANDOM_TYPE)
+            name = '{} {}'.format(self.fake.catch_phrase(), index)
+            feed = feed_model(name=name, slug=slugify(name), published=True, type=asset_type,
+                              category=category)
+            if feed_model is WebFeed:
+                feed.template = template
+            feeds_by_type[feed_model].append(feed)
+
+            for day in (days if dated else days[:30]):
+                snippet = snippet_model(title=self.fake.sentence(), category=category,
+                                        date=day if dated else None)
+                if snippet_model is WebSnippet:
+                    snippet.content = self.fake.paragraph()
+                else:
+                    snippet.checksum = self._checksum()
+                    snippet.media = 'synthetic/{}'.format(snippet.checksum)
+                snippets_by_type[snippet_model].append(snippet)
+
+        feeds = []
+        for feed_model, feed_list in feeds_by_type.items():
+            feeds.extend(bulk_create_inherited(feed_model, feed_list, self.batch_size))
+        for snippet_model, snippets in snippets_by_type.items():
+            bulk_create_inherited(snippet_model, snippets, self.batch_size)
+
+        Feed.publish_to.through.objects.bulk_create([
+            Feed.publish_to.through(feed_id=feed.pk, client_id=client.pk)
+            for feed in feeds for client in clients
+        ], batch_size=self.batch_size)
+        return bulk_create_inherited(FeedAsset, [
+            FeedAsset(name='{} Feed'.format(feed.name), type=AssetTypes.FEED, feed_id=feed.pk,
+                      asset_url='')
+            for feed in feeds
+        ], self.batch_size)
+
+    def _raw_video_metadata(self, width, height, size):
+        """ Returns metadata in the shape ffprobe outputs for a video with one video stream. """
+        codec_name, codec_long_name = self.random.choice(VIDEO_CODECS)
+        duration = _sexagesimal(round(self.random.uniform(5, 600), 2))
+        return {
+            'format': {
+                'format_long_name': 'QuickTime / MOV',
+                'duration': duration,
+                'nb_streams': 1,
+                'size': '{} B'.format(size),
+            },
+            'streams': [{
+                'index': 0,
+                'codec_type': 'video',
+                'codec_name': codec_name,
+                'codec_long_name': codec_long_name,
+                'width': width,
+                'height': height,
+                'duration': duration,
+            }],
+        }
+
+    def _raw_image_metadata(self, width, height):
+        """ Returns metadata in the shape exiftool outputs for an image. """
+        return {
+            'File': {
+                'FileType': self.random.choice(IMAGE_FILE_TYPES),
+                'ImageWidth': width,
+                'ImageHeight': height,
+            },
+        }
+
+    def _build_asset(self, asset_type, owner, calendar_template):
+        name = ' '.join(self.fake.words(self.random.randint(1, 4)))
+        if asset_type in (AssetTypes.IMAGE, AssetTypes.VIDEO):
+            width, height = self.random.choice(RESOLUTIONS)
+            model = ImageAsset if asset_type == AssetTypes.IMAGE else VideoAsset
+            asset = model(checksum=self._checksum(),
+                          file_size=self.random.randint(50 * 1024, 200 * 1024 * 1024))
+            asset.media_file = 'synthetic/{}'.format(asset.checksum)
+            if asset_type == AssetTypes.VIDEO:
+                raw_metadata = self._raw_video_metadata(width, height, asset.file_size)
+                asset.metadata = clean_video_metadata(raw_metadata)
+                fields = extract_video_fields(raw_metadata)
+            else:
+                raw_metadata = self._raw_image_metadata(width, height)
+                asset.metadata = clean_image_metadata(raw_metadata)
+                fields = extract_image_fields(raw_metadata)
+            asset.raw_metadata = json.dumps(raw_metadata)
+            for field_name, value in fields.items():
+                setattr(asset, field_name, value)
+        elif asset_type == AssetTypes.WEB:
+            asset = WebAsset(content='<p>{}</p>'.format(self.fake.paragraph()))
+        else:
+            asset = CalendarAsset(template=calendar_template, url=self.fake.url())
+        asset.name = name
+        asset.type = asset_type
+        asset.owner = owner
+        asset.asset_url = ''
+        return asset
+
+    def create_assets(self, clients):
+        calendar_template = WebAssetTemplate.objects.create(
+                name='Synthetic Calendar', template='{{ events }}', variables='events',
+                help_text='', calendar_support=True)
+        types, weights = zip(*ASSET_TYPE_WEIGHTS)
+        models = {AssetTypes.IMAGE: ImageAsset, AssetTypes.VIDEO: VideoAsset,
+                  AssetTypes.WEB: WebAsset, AssetTypes.CALENDAR: CalendarAsset}
+
+        assets = []
+        owners = self._spread(self.options['assets'], clients)
+        for start in range(0, len(owners), self.batch_size):
+            batch = {asset_type: [] for asset_type in types}
+            for owner in owners[start:start + self.batch_size]:
+                asset_type = self.random.choices(types, weights=weights)[0]
+                batch[asset_type].append(self._build_asset(asset_type, owner, calendar_template))
+            for asset_type, asset_list in batch.items():
+                assets.extend(bulk_create_inherited(models[asset_type], asset_list))
+        return assets
+
+    def create_tags(self, assets):
+        tags = Tag.objects.bulk_create([
+            Tag(name=word, slug=slugify(word))
+            for word in sorted(set(self.fake.words(200)))
+        ])
+        content_type = ContentType.objects.get_for_model(Asset)
+        tagged_items = []
+        for asset in assets:
+            asset_tags = self.random.sample(tags, min(self.options['tags_per_asset'], len(tags)))
+            # Kept on the instance to build search terms without reading the tags back.
+            asset.tag_names = [tag.name for tag in asset_tags]
+            tagged_items.extend(TaggedItem(tag=tag, content_type=content_type,
+                                           object_id=asset.pk) for tag in asset_tags)
+        TaggedItem.objects.bulk_create(tagged_items, batch_size=self.batch_size)
+
+    def create_search_terms(self, assets):
+        def search_terms():
+            for asset in assets:
+                for kind, term in set(build_search_terms(asset.name, asset.tag_names,
+                                                         asset.metadata, asset.codec)):
+                    yield AssetSearchTerm(asset_id=asset.pk, owner_id=asset.owner_id, kind=kind,
+                                          term=term)
+
+        AssetSearchTerm.objects.bulk_create(search_terms(), batch_size=self.batch_size)
+
+    def create_content_feeds(self, clients, assets, feed_assets):
+        assets_by_owner = {}
+        for asset in assets:
+            assets_by_owner.setdefault(asset.owner_id, []).append(asset)
+
+        playlists = Playlist.objects.bulk_create([
+            Playlist(name=self.fake.catch_phrase(), owner=client)
+            for client in clients for _ in range(self.options['playlists_per_client'])
+        ], batch_size=self.batch_size)
+        series = TickerSeries.objects.bulk_create([
+            TickerSeries(name=self.fake.catch_phrase(), owner=playlist.owner)
+            for playlist in playlists
+        ], batch_size=self.batch_size)
+
+        def playlist_items():
+            for playlist in playlists:
+                owned = assets_by_owner.get(playlist.owner_id, [])
+                items = self.random.sample(owned, min(self.options['playlist_length'],
+                                                      len(owned)))
+                for position, asset in enumerate(list(feed_assets) + items):
+                    yield PlaylistItem(playlist=playlist, item_id=asset.pk, position=position,
+                                       duration=self.random.choice((None, 10, 15, 30)))
+
+        PlaylistItem.objects.bulk_create(playlist_items(), batch_size=self.batch_size)
+        Ticker.objects.bulk_create((
+            Ticker(ticker_series=ticker_series, text=self.fake.sentence(), position=position)
+            for ticker_series in series
+            for position in range(self.options['tickers_per_series'])
+        ), batch_size=self.batch_size)
+
+        return ContentFeed.objects.bulk_create([
+            ContentFeed(title=playlist.name[:100], media_playlist=playlist,
+                        ticker_series=ticker_series)
+            for playlist, ticker_series in zip(playlists, series)
+        ], batch_size=self.batch_size)
+
+    def create_device_groups(self, clients, content_feeds):
+        feeds_by_owner = {}
+        for content_feed in content_feeds:
+            feeds_by_owner.setdefault(content_feed.media_playlist.owner_id, []).append(
+                    content_feed)
+        return DeviceGroup.objects.bulk_create([
+            DeviceGroup(name=self.fake.city(), owner=owner,
+                        feed=self.random.choice(feeds_by_owner[owner.pk]))
+            for owner in self._spread(self.options['device_groups'], clients)
+        ], batch_size=self.batch_size)
+
+    def create_devices(self, device_groups):
+        def devices():
+            for group in self._spread(self.options['devices'], device_groups):
+                # Mostly recent pings, with a tail of stale and offline devices.
+                last_ping = self.now - datetime.timedelta(
+                        seconds=self.random.expovariate(1 / 600))
+                yield Device(device_id=self._uuid(), name=self.fake.street_name(), group=group,
+                             owner_id=group.owner_id, enabled=True, last_ping=last_ping)
+
+        Device.objects.bulk_create(devices(), batch_size=self.batch_size)
+
+    def create_schedules(self, device_groups, content_feeds):
+        feeds_by_owner = {}
+        for content_feed in content_feeds:
+            feeds_by_owner.setdefault(content_feed.media_playlist.owner_id, []).append(
+                    content_feed)
+
+        def schedules():
+            for group in device_groups:
+                feeds = feeds_by_owner[group.owner_id]
+                for day in WeekDays.CODES:
+                    yield ScheduledContent(day=day, default=True, content=group.feed,
+                                           device_group=group)
+                    start_hour = self.random.randint(6, 18)
+                    yield ScheduledContent(day=day, start_time=datetime.time(start_hour),
+                                           end_time=datetime.time(start_hour + 4),
+                                           content=self.random.choice(feeds),
+                                           device_group=group)
+
+        def special_content():
+            for group in device_groups:
+                feeds = feeds_by_owner[group.owner_id]
+                for offset in self.random.sample(range(365), 5):
+                    yield SpecialContent(date=self.now.date() + datetime.timedelta(days=offset),
+                                         content=self.random.choice(feeds), device_group=group)
+
+        ScheduledContent.objects.bulk_create(schedules(), batch_size=self.batch_size)
+        SpecialContent.objects.bulk_create(special_content(), batch_size=self.batch_size)
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+""" Profiles the next requests or runs of a channel consumer on all workers. """
+from django.core.management.base import BaseCommand
+
+from utils.profiling import PROFILE_DIR, REQUESTS_TARGET, profile_next
+
+
+class Command(BaseCommand):
+    help = 'Profiles the next requests or runs of a channel consumer on all workers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('target',
+                            help='"{}" or the name of a consumer, e.g. create_thumbnail.'.format(
+                                    REQUESTS_TARGET))
+        parser.add_argument('count', type=int, nargs='?', default=1,
+                            help='Number of requests or consumer runs to profile.')
+
+    def handle(self, *args, **options):
+        profile_next(options['target'], options['count'])
+        self.stdout.write('Profiling the next {} {}, profiles are saved under {}/.'.format(
+                options['count'], options['target'], PROFILE_DIR))
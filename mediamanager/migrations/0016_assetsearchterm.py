@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from mediamanager.search import build_search_terms
+
+
+def build_search_index(apps, schema_editor):
+    Asset = apps.get_model('mediamanager', 'Asset')
+    AssetSearchTerm = apps.get_model('mediamanager', 'AssetSearchTerm')
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    TaggedItem = apps.get_model('taggit', 'TaggedItem')
+
+    asset_type, _ = ContentType.objects.get_or_create(app_label='mediamanager', model='asset')
+    tags = {}
+    for object_id, tag_name in TaggedItem.objects.filter(
+            content_type=asset_type).values_list('object_id', 'tag__name'):
+        tags.setdefault(object_id, []).append(tag_name)
+
+    search_terms = []
+    for asset in Asset.objects.only('id', 'owner_id', 'name', 'metadata').iterator():
+        metadata = json.loads(asset.metadata) if asset.metadata else None
+        for kind, term in build_search_terms(asset.name, tags.get(asset.id, []), metadata):
+            search_terms.append(AssetSearchTerm(asset_id=asset.id, owner_id=asset.owner_id,
+                                                kind=kind, term=term))
+        if len(search_terms) >= 5000:
+            AssetSearchTerm.objects.bulk_create(search_terms)
+            search_terms = []
+    AssetSearchTerm.objects.bulk_create(search_terms)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('taggit', '0002_auto_20150616_2121'),
+        ('client_manager', '0011_clientsettings'),
+        ('mediamanager', '0015_asset_owner_created_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AssetSearchTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False,
+                                        verbose_name='ID')),
+                ('kind', models.CharField(choices=[('name', 'Name'), ('tag', 'Tag'),
+                                                   ('codec', 'Codec'),
+                                                   ('resolution', 'Resolution'),
+                                                   ('duration', 'Duration'),
+                                                   ('file_type', 'File Type')],
+                                          max_length=20)),
+                ('term', models.CharField(db_index=True, max_length=100)),
+                ('asset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                            to='mediamanager.Asset')),
+                ('owner', models.ForeignKey(blank=True, null=True,
+                                            on_delete=django.db.models.deletion.CASCADE,
+                                            to='client_manager.Client')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='assetsearchterm',
+            index=models.Index(fields=['owner', 'term'], name='assetsearchterm_owner_term_idx'),
+        ),
+        migrations.RunPython(build_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+from mediamanager.types import AssetTypes
+from utils.files import extract_image_fields, extract_video_fields
+
+
+def convert_metadata(apps, schema_editor):
+    Asset = apps.get_model('mediamanager', 'Asset')
+    extractors = {
+        AssetTypes.VIDEO: extract_video_fields,
+        AssetTypes.IMAGE: extract_image_fields,
+    }
+    assets = Asset.objects.filter(type__in=extractors).only('id', 'type', 'metadata',
+                                                            'raw_metadata')
+    for asset in assets.iterator():
+        fields = {}
+        if asset.metadata:
+            fields['structured_metadata'] = json.loads(asset.metadata)
+        if asset.raw_metadata:
+            fields.update(extractors[asset.type](json.loads(asset.raw_metadata)))
+        if fields:
+            Asset.objects.filter(pk=asset.pk).update(**fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediamanager', '0016_assetsearchterm'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='asset',
+            name='structured_metadata',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, editable=False,
+                                                                 null=True),
+        ),
+        migrations.AddField(
+            model_name='asset',
+            name='codec',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=100,
+                                   null=True),
+        ),
+        migrations.AddField(
+            model_name='asset',
+            name='duration',
+            field=models.FloatField(blank=True, db_index=True, editable=False,
+                                    help_text='Duration in seconds.', null=True),
+        ),
+        migrations.AddField(
+            model_name='asset',
+            name='file_size',
+            field=models.BigIntegerField(blank=True, db_index=True, editable=False,
+                                         help_text='File size in bytes.', null=True),
+        ),
+        migrations.AddField(
+            model_name='asset',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, db_index=True, editable=False,
+                                              null=True),
+        ),
+        migrations.AddField(
+            model_name='asset',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, db_index=True, editable=False,
+                                              null=True),
+        ),
+        migrations.RunPython(convert_metadata, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='asset',
+            name='metadata',
+        ),
+        migrations.RenameField(
+            model_name='asset',
+            old_name='structured_metadata',
+            new_name='metadata',
+        ),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+from mediamanager.search import TermKinds, normalise_term
+
+
+def index_codec_column(apps, schema_editor):
+    """ Replaces codec terms built from the long codec names in metadata with the codec column. """
+    Asset = apps.get_model('mediamanager', 'Asset')
+    AssetSearchTerm = apps.get_model('mediamanager', 'AssetSearchTerm')
+
+    AssetSearchTerm.objects.filter(kind=TermKinds.CODEC).delete()
+    search_terms = []
+    assets = Asset.objects.exclude(codec__isnull=True).exclude(codec='')
+    for asset_id, owner_id, codec in assets.values_list('id', 'owner_id', 'codec').iterator():
+        search_terms.append(AssetSearchTerm(asset_id=asset_id, owner_id=owner_id,
+                                            kind=TermKinds.CODEC, term=normalise_term(codec)))
+        if len(search_terms) >= 5000:
+            AssetSearchTerm.objects.bulk_create(search_terms)
+            search_terms = []
+    AssetSearchTerm.objects.bulk_create(search_terms)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediamanager', '0017_structured_metadata'),
+    ]
+
+    operations = [
+        migrations.RunPython(index_codec_column, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# Search matches terms with LIKE 'word%'. Postgres can only use a b-tree index for that if the
+# column uses a pattern operator class, unless the database uses the C collation, and Django
+# can't declare one on a multi-column index.
+CREATE_INDEX = '''
+CREATE INDEX assetsearchterm_owner_term_like
+ON mediamanager_assetsearchterm (owner_id, term varchar_pattern_ops)
+'''
+
+DROP_INDEX = 'DROP INDEX assetsearchterm_owner_term_like'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediamanager', '0018_codec_search_terms'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='assetsearchterm',
+            name='assetsearchterm_owner_term_idx',
+        ),
+        migrations.RunSQL(CREATE_INDEX, DROP_INDEX),
+    ]
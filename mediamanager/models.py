@@ -12,9 +12,13 @@ import re
 import requests
 from channels import Channel
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.postgres.fields import JSONField
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
 from django.db import models
-from django.db.models.signals import post_save
+from django.db.models import Min
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import Signal
 from django.template import Context, Template
 from django.utils import timezone
 from django.utils.text import Truncator
@@ -23,16 +27,26 @@ from icalendar import Calendar
 from mistune import markdown
 from raven.contrib.django.raven_compat.models import client
 from taggit.managers import TaggableManager
+from taggit.models import TaggedItem
 
 from client_manager.models import Client
+from mediamanager.search import TermKinds, build_search_terms
 from mediamanager.types import AssetTypes
+from utils.dates import earliest, next_midnight, start_of_day
 from utils.errors import InvalidAssetError, NoContentAssetError
-from utils.files import (clean_image_metadata, clean_video_metadata, generate_image_thumbnail,
+from utils.files import (clean_image_metadata, clean_video_metadata, extract_image_fields,
+                         extract_video_fields, generate_image_thumbnail,
                          generate_video_thumbnail, generate_web_thumbnail, md5_file_name)
+from utils.page_cache import invalidate_pages
+from utils.queries import enforce_query_budget
 from utils.storage import NormalStorage
 
 THUMBNAIL_STORAGE = NormalStorage()
 
+#: Kinds of rendered pages in the page cache
+WEB_ASSET_PAGE = 'web-asset'
+CALENDAR_ASSET_PAGE = 'calendar-asset'
+
 
 class TickerSpeeds:
     """ This class consolidates the data about ticker speed choices into a single class. """
@@ -156,7 +170,17 @@ class Asset(models.Model):
     name = models.CharField(max_length=255)
     type = models.CharField(max_length=25, editable=False)
     raw_metadata = models.TextField(editable=False, blank=True)
-    metadata = models.TextField(editable=False, blank=True)
+    metadata = JSONField(editable=False, null=True, blank=True)
+    # Key metadata fields are extracted into their own columns so assets can be filtered and
+    # sorted by them in the database.
+    width = models.PositiveIntegerField(editable=False, null=True, blank=True, db_index=True)
+    height = models.PositiveIntegerField(editable=False, null=True, blank=True, db_index=True)
+    duration = models.FloatField(editable=False, null=True, blank=True, db_index=True,
+                                 help_text='Duration in seconds.')
+    codec = models.CharField(max_length=100, editable=False, null=True, blank=True,
+                             db_index=True)
+    file_size = models.BigIntegerField(editable=False, null=True, blank=True, db_index=True,
+                                       help_text='File size in bytes.')
     asset_url = models.CharField(max_length=255, editable=False)
     thumbnail = models.CharField(max_length=255, null=True, blank=True, editable=False)
     created = models.DateTimeField(auto_now_add=True)
@@ -167,16 +191,42 @@ class Asset(models.Model):
     def get_tags_list(self):
         return self.tags.names()
 
+    def update_search_terms(self):
+        """ Rebuilds the search index entries for this asset if they have changed. """
+        tag_names = TaggedItem.objects.filter(
+                content_type=ContentType.objects.get_for_model(Asset),
+                object_id=self.pk,
+        ).values_list('tag__name', flat=True)
+        terms = {(self.owner_id, kind, term)
+                 for kind, term in build_search_terms(self.name, tag_names,
+                                                      self.get_metadata_as_dict(), self.codec)}
+        existing_terms = set(self.assetsearchterm_set.values_list('owner_id', 'kind', 'term'))
+        if terms == existing_terms:
+            return
+        self.assetsearchterm_set.all().delete()
+        AssetSearchTerm.objects.bulk_create(
+                AssetSearchTerm(asset_id=self.pk, owner_id=owner_id, kind=kind, term=term)
+                for owner_id, kind, term in terms)
+
     def build_clean_metadata(self):
+        """
+        Builds the cleaned metadata from the raw metadata, and fills in the extracted metadata
+        columns.
+        """
+        raw_metadata = self.get_raw_metadata_as_dict()
         if self.type == AssetTypes.VIDEO:
-            self.metadata = clean_video_metadata(self.get_raw_metadata_as_dict())
+            self.metadata = clean_video_metadata(raw_metadata)
+            extracted_fields = extract_video_fields(raw_metadata)
         elif self.type == AssetTypes.IMAGE:
-            self.metadata = clean_image_metadata(self.get_raw_metadata_as_dict())
+            self.metadata = clean_image_metadata(raw_metadata)
+            extracted_fields = extract_image_fields(raw_metadata)
+        else:
+            return
+        for field_name, value in extracted_fields.items():
+            setattr(self, field_name, value)
 
     def get_metadata_as_dict(self):
-        if self.metadata is None or self.metadata == '':
-            return None
-        return json.loads(self.metadata)
+        return self.metadata or None
 
     def get_raw_metadata_as_dict(self):
         if self.raw_metadata is None or self.raw_metadata == '':
@@ -260,6 +310,28 @@ class Asset(models.Model):
         """ Thumbnails can only be generated for specific types of assets """
         raise NotImplementedError
 
+    class Meta:
+        indexes = [
+            # Supports listing and keyset pagination of a client's assets, newest first.
+            models.Index(fields=['owner', 'created', 'id'], name='asset_owner_created_idx'),
+        ]
+
+
+class AssetSearchTerm(models.Model):
+    """
+    An entry in the asset search index. Each asset has one entry for every word in its name, every
+    tag and a few key metadata fields so assets can be found by prefix matching terms.
+    """
+    asset = models.ForeignKey(Asset, on_delete=models.CASCADE)
+    owner = models.ForeignKey(Client, null=True, blank=True, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=20, choices=TermKinds.CHOICES)
+    # Prefix searches by owner use the (owner_id, term varchar_pattern_ops) index created by
+    # migration 0019, Django can't declare the operator class of an index.
+    term = models.CharField(max_length=100, db_index=True)
+
+    def __str__(self):
+        return '{kind}: {term}'.format(kind=self.kind, term=self.term)
+
 
 class FileAsset(Asset):
     """
@@ -468,6 +540,11 @@ class PlaylistItem(models.Model):
         ordering = ('position',)
 
 
+#: Sent with the ids of playlists after items were added to them in bulk, which skips the
+#: ``post_save`` signal of every item.
+playlist_items_added = Signal(providing_args=['playlist_ids'])
+
+
 class Playlist(models.Model):
     """
     This model represents a Playlist.
@@ -492,13 +569,19 @@ class Playlist(models.Model):
     def __str__(self):
         return self.name
 
+    @enforce_query_budget(10)
     def as_list(self):
         """
         Returns a list with the dictionary representation of all the items in this playlist.
+
+        Assets are loaded along with the items, so only feeds, which look up today's snippet,
+        and calendars that aren't in the page cache need further queries.
         """
         playlist = []
         playlist_items = self.playlistitem_set.exclude(expire_on__lt=timezone.now())
-        playlist_items = playlist_items.order_by('position')
+        playlist_items = playlist_items.order_by('position').select_related(
+                'item__videoasset', 'item__imageasset', 'item__webasset',
+                'item__calendarasset__template', 'item__feedasset__feed')
         for pl_item in playlist_items:
             try:
                 media_item = pl_item.item.get_subtype().as_dict()
@@ -513,6 +596,31 @@ class Playlist(models.Model):
 
         return playlist
 
+    def get_valid_until(self, now=None):
+        """
+        Returns the earliest time at which the output of :meth:`as_list` can change on its own,
+        or ``None`` if it will only change when the playlist is edited.
+
+        This is the next item expiry, the next start or end of an event in a calendar asset or
+        the next midnight if the playlist includes any feeds since their snippets change daily.
+        """
+        if now is None:
+            now = timezone.now()
+        playlist_items = self.playlistitem_set.exclude(expire_on__lt=now)
+        next_expiry = playlist_items.filter(expire_on__gt=now).aggregate(
+                next_expiry=Min('expire_on'))['next_expiry']
+
+        item_types = set(playlist_items.values_list('item__type', flat=True))
+        feed_change = next_midnight(now) if AssetTypes.FEED in item_types else None
+
+        calendar_changes = []
+        if AssetTypes.CALENDAR in item_types:
+            calendar_assets = CalendarAsset.objects.filter(
+                    playlistitem__in=playlist_items).distinct()
+            calendar_changes = [cal.get_next_change(now) for cal in calendar_assets]
+
+        return earliest(next_expiry, feed_change, *calendar_changes)
+
     def get_absolute_url(self):
         """ Returns the preview url for this playlist. """
         return reverse('playlist-view', args=[str(self.pk)], host='content')
@@ -549,17 +657,41 @@ class ContentFeed(models.Model):
             'displayTicker': self.ticker_series is not None
         }
 
-    def as_dict(self):
+    def get_valid_until(self, device_group=None, now=None):
+        """
+        Returns the earliest time at which this content feed can change without being edited, or
+        ``None`` if there is no such time. If a device group is provided, the next change in its
+        schedule is also taken into account.
+        """
+        from schedule_manager.models import get_next_schedule_change
+
+        if now is None:
+            now = timezone.now()
+        playlist_change = None
+        if self.media_playlist is not None:
+            playlist_change = self.media_playlist.get_valid_until(now)
+        schedule_change = None
+        if device_group is not None:
+            schedule_change = get_next_schedule_change(device_group, now)
+        return earliest(playlist_change, schedule_change)
+
+    def as_dict(self, device_group=None):
         """
         Returns a dictionary representation of this content feed.
         Can raise an error if the media_playlist is missing.
+
+        The ``valid_until`` key tells devices when they need to check for updates next. Devices
+        should poll at that time (or on their update interval if it is ``None``) unless they are
+        notified of a change earlier.
         """
         if self.media_playlist is None:
             raise ContentFeed.PlaylistNotSetError('No playlist configured for device group.')
+        valid_until = self.get_valid_until(device_group=device_group)
         feed_dict = {
             'playlist': self.media_playlist.as_list(),
             'tickers': self.ticker_series.as_list() if self.ticker_series else [],
             'settings': self.settings(),
+            'valid_until': valid_until.isoformat() if valid_until is not None else None,
         }
         return feed_dict
 
@@ -653,9 +785,8 @@ class CalendarAsset(Asset):
         self.validate()
         try:
             cal = Calendar.from_ical(self.data)
-            for event in cal.subcomponents:
-                start = event.decoded('DTSTART')
-                end = event.decoded('DTEND')
+            for event in cal.walk('VEVENT'):
+                start, end = _event_span(event)
 
                 if isinstance(start, datetime.datetime):
                     now = timezone.now()
@@ -671,6 +802,32 @@ class CalendarAsset(Asset):
             #  The calendar has returned invalid data, this asset is invalid.
             raise InvalidAssetError
 
+    def get_next_change(self, now=None):
+        """
+        Returns the next time an event in this calendar starts or ends, which is when the
+        rendered content of this asset can change. Returns ``None`` if there is no such time or
+        the calendar data is invalid.
+        """
+        if self.data is None:
+            return None
+        if now is None:
+            now = timezone.now()
+        boundaries = []
+        try:
+            cal = Calendar.from_ical(self.data)
+            for event in cal.walk('VEVENT'):
+                start, end = _event_span(event)
+                if isinstance(start, datetime.datetime):
+                    boundaries.extend(_aware(moment) for moment in (start, end))
+                else:
+                    # All-day events include their end date, so they end at the start of the
+                    # following day.
+                    boundaries.append(start_of_day(start))
+                    boundaries.append(start_of_day(end + datetime.timedelta(days=1)))
+        except (ValueError, KeyError):
+            return None
+        return earliest(*(moment for moment in boundaries if moment > now))
+
     @property
     def rendered_content(self):
         cal_data = self.get_current_event()
@@ -679,6 +836,17 @@ class CalendarAsset(Asset):
         else:
             return self.template.render(cal_data)
 
+    def render_page(self):
+        """
+        Returns the content of the page for the current event, or None if there is no current
+        event, and the time at which the page changes.
+        """
+        expires = self.get_next_change()
+        try:
+            return self.rendered_content, expires
+        except NoContentAssetError:
+            return None, expires
+
     @property
     def checksum(self):
         """ Calculates checksum for calendar asset based on content. """
@@ -695,6 +863,28 @@ class CalendarAsset(Asset):
         }
 
 
+def _event_span(event):
+    """
+    Returns the start and end of a calendar event. Events without a DTEND last for their
+    DURATION, or end when they start if they have neither. Like DTEND, the end of an all-day
+    event is the last day it includes.
+    """
+    start = event.decoded('DTSTART')
+    if 'DTEND' in event:
+        return start, event.decoded('DTEND')
+    duration = event.decoded('DURATION') if 'DURATION' in event else datetime.timedelta()
+    if isinstance(start, datetime.datetime):
+        return start, start + duration
+    return start, start + max(duration - datetime.timedelta(days=1), datetime.timedelta())
+
+
+def _aware(moment):
+    """ Treats naive (floating) calendar times as being in the current timezone. """
+    if timezone.is_naive(moment):
+        return timezone.make_aware(moment)
+    return moment
+
+
 # noinspection PyUnusedLocal
 def build_metadata_and_thumbnails(sender, instance=None, created=False, **kwargs):
     if isinstance(instance, VideoAsset):
@@ -705,6 +895,45 @@ def build_metadata_and_thumbnails(sender, instance=None, created=False, **kwargs
         Channel('create-thumbnail').send({'ids': [instance.id]})
 
 
+# noinspection PyUnusedLocal
+def update_asset_search_terms(sender, instance=None, **kwargs):
+    """ Keeps the search index up to date when an asset is saved. """
+    if not kwargs.get('raw', False):
+        instance.update_search_terms()
+
+
+# noinspection PyUnusedLocal
+def update_tagged_asset_search_terms(sender, instance=None, action=None, **kwargs):
+    """
+    Keeps the search index up to date when an asset is tagged or untagged. This uses the
+    m2m_changed signal sent by taggit so it runs once per operation rather than once per tag, and
+    so bulk deletes of tagged items can skip per-row signals.
+    """
+    if isinstance(instance, Asset) and action in ('post_add', 'post_remove', 'post_clear'):
+        instance.update_search_terms()
+
+
+# noinspection PyUnusedLocal
+def invalidate_rendered_pages(sender, instance=None, **kwargs):
+    """ Removes cached rendered pages affected by a change to the instance. """
+    if isinstance(instance, WebAsset):
+        invalidate_pages(WEB_ASSET_PAGE, instance.pk)
+    elif isinstance(instance, CalendarAsset):
+        invalidate_pages(CALENDAR_ASSET_PAGE, instance.pk)
+    elif isinstance(instance, WebAssetTemplate):
+        calendar_asset_ids = CalendarAsset.objects.filter(
+                template=instance).values_list('pk', flat=True)
+        invalidate_pages(CALENDAR_ASSET_PAGE, *calendar_asset_ids)
+
+
 post_save.connect(build_metadata_and_thumbnails, sender=VideoAsset)
 post_save.connect(build_metadata_and_thumbnails, sender=ImageAsset)
 post_save.connect(build_metadata_and_thumbnails, sender=WebAsset)
+
+for asset_model in (Asset, VideoAsset, ImageAsset, WebAsset, FeedAsset, CalendarAsset):
+    post_save.connect(update_asset_search_terms, sender=asset_model)
+m2m_changed.connect(update_tagged_asset_search_terms, sender=TaggedItem)
+
+for rendered_model in (WebAsset, CalendarAsset, WebAssetTemplate):
+    post_save.connect(invalidate_rendered_pages, sender=rendered_model)
+    post_delete.connect(invalidate_rendered_pages, sender=rendered_model)
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+""" Helpers to build the search terms that make up the asset search index. """
+import re
+
+#: Maximum length of a single search term, longer values are truncated.
+MAX_TERM_LENGTH = 100
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+class TermKinds:
+    """ The kinds of search terms stored for an asset. """
+    NAME = 'name'
+    TAG = 'tag'
+    CODEC = 'codec'
+    RESOLUTION = 'resolution'
+    DURATION = 'duration'
+    FILE_TYPE = 'file_type'
+
+    CHOICES = (
+        (NAME, 'Name'),
+        (TAG, 'Tag'),
+        (CODEC, 'Codec'),
+        (RESOLUTION, 'Resolution'),
+        (DURATION, 'Duration'),
+        (FILE_TYPE, 'File Type'),
+    )
+
+
+def normalise_term(value):
+    """ Converts a value to the form stored in the index. """
+    return str(value).strip().lower()[:MAX_TERM_LENGTH]
+
+
+def split_query(query):
+    """ Splits a search query into normalised words, each of which is matched as a prefix. """
+    return [normalise_term(word) for word in WORD_RE.findall(query or '')]
+
+
+def _metadata_terms(metadata):
+    """
+    Returns terms for the key fields of cleaned video or image metadata. The codec is left out,
+    the cleaned metadata has its long name while assets are filtered by the short name in the
+    codec column.
+    """
+    if not metadata:
+        return
+    video_streams = metadata.get('video_streams') or []
+    if video_streams:
+        stream = video_streams[0]
+        if stream.get('Width') and stream.get('Height'):
+            yield TermKinds.RESOLUTION, '{}x{}'.format(stream['Width'], stream['Height'])
+    duration = (metadata.get('format') or {}).get('Duration')
+    if duration:
+        # Drop fractional seconds from sexagesimal durations such as 0:01:30.040000
+        yield TermKinds.DURATION, str(duration).split('.')[0]
+    file_data = metadata.get('File') or {}
+    if file_data.get('File Type'):
+        yield TermKinds.FILE_TYPE, file_data['File Type']
+    if file_data.get('Width') and file_data.get('Height'):
+        yield TermKinds.RESOLUTION, '{}x{}'.format(file_data['Width'], file_data['Height'])
+
+
+def build_search_terms(name, tag_names, metadata, codec=None):
+    """
+    Returns a set of ``(kind, term)`` tuples to index for an asset with the provided name, tags,
+    cleaned metadata and codec column. Each word of the name is indexed so any of them can be
+    prefix matched, while tags and metadata values are indexed whole.
+    """
+    terms = {(TermKinds.NAME, word) for word in split_query(name)}
+    terms.update((TermKinds.TAG, normalise_term(tag)) for tag in tag_names)
+    terms.update((kind, normalise_term(value)) for kind, value in _metadata_terms(metadata))
+    if codec:
+        terms.add((TermKinds.CODEC, normalise_term(codec)))
+    return terms
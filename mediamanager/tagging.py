@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+""" Set-based tag operations for many assets at once. """
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Count
+from taggit.models import Tag, TaggedItem
+
+from mediamanager.models import Asset, AssetSearchTerm
+from mediamanager.search import TermKinds, normalise_term
+
+
+def _get_or_create_tags(names):
+    """ Returns tags with the provided names, creating the ones that don't exist. """
+    tags = list(Tag.objects.filter(name__in=names))
+    existing_names = {tag.name for tag in tags}
+    for name in names:
+        if name not in existing_names:
+            tags.append(Tag.objects.create(name=name))
+            existing_names.add(name)
+    return tags
+
+
+def _rebuild_tag_search_terms(asset_ids, tagged_items):
+    """ Replaces the tag entries in the search index for the provided assets. """
+    AssetSearchTerm.objects.filter(asset_id__in=asset_ids, kind=TermKinds.TAG).delete()
+    owners = dict(Asset.objects.filter(id__in=asset_ids).values_list('id', 'owner_id'))
+    terms = {(object_id, normalise_term(tag_name))
+             for object_id, tag_name in tagged_items.values_list('object_id', 'tag__name')}
+    AssetSearchTerm.objects.bulk_create(
+            AssetSearchTerm(asset_id=asset_id, owner_id=owners[asset_id],
+                            kind=TermKinds.TAG, term=term)
+            for asset_id, term in terms)
+
+
+def bulk_update_tags(asset_ids, add=None, remove=None, replace=None):
+    """
+    Updates the tags of many assets in a single transaction using set-based queries instead of
+    a few queries per asset and tag.
+
+    :param asset_ids: ids of the assets to update
+    :param add: tag names to add to every asset
+    :param remove: tag names to remove from every asset
+    :param replace: if provided, every asset ends up with exactly these tags
+    :return: a dictionary mapping each tag name on the assets to the number of assets it is on
+    """
+    asset_ids = list(asset_ids)
+    add = set(add or [])
+    remove = set(remove or [])
+    content_type = ContentType.objects.get_for_model(Asset)
+
+    with transaction.atomic():
+        tagged_items = TaggedItem.objects.filter(content_type=content_type,
+                                                 object_id__in=asset_ids)
+        if replace is not None:
+            tagged_items.exclude(tag__name__in=replace).delete()
+            add |= set(replace)
+        if remove:
+            tagged_items.filter(tag__name__in=remove).delete()
+        if add:
+            tags = _get_or_create_tags(add)
+            existing = set(tagged_items.filter(tag__in=tags).values_list('object_id', 'tag_id'))
+            TaggedItem.objects.bulk_create(
+                    TaggedItem(content_type=content_type, object_id=asset_id, tag=tag)
+                    for asset_id in asset_ids
+                    for tag in tags
+                    if (asset_id, tag.id) not in existing)
+
+        _rebuild_tag_search_terms(asset_ids, tagged_items)
+
+        tag_counts = tagged_items.values('tag__name').annotate(count=Count('id'))
+        return {tag_count['tag__name']: tag_count['count'] for tag_count in tag_counts}
@@ -1,2 +1,172 @@
 # -*- coding: utf-8 -*-
 """ Tests for media manager. """
+import datetime
+
+import pytest
+from django.contrib.auth.models import User
+from rest_framework.test import APIClient
+
+from client_manager.models import Client, ClientUserProfile
+from mediamanager.models import CalendarAsset, WebAsset
+from mediamanager.search import TermKinds, build_search_terms, split_query
+from mediamanager.types import AssetTypes
+from utils.bulk import bulk_create_inherited
+
+
+def test_split_query_normalises_words():
+    assert split_query('  Summer-Sale 2018 ') == ['summer', 'sale', '2018']
+    assert split_query(None) == []
+
+
+def test_build_search_terms_for_video():
+    metadata = {
+        'format': {'Duration': '0:01:30.040000'},
+        'video_streams': [{'Codec': 'H.264 / AVC', 'Width': 1920, 'Height': 1080}],
+    }
+    terms = build_search_terms('Summer Sale', ['Promo', 'Outdoor'], metadata, 'h264')
+    assert terms == {
+        (TermKinds.NAME, 'summer'),
+        (TermKinds.NAME, 'sale'),
+        (TermKinds.TAG, 'promo'),
+        (TermKinds.TAG, 'outdoor'),
+        (TermKinds.CODEC, 'h264'),
+        (TermKinds.RESOLUTION, '1920x1080'),
+        (TermKinds.DURATION, '0:01:30'),
+    }
+
+
+def test_build_search_terms_for_image():
+    metadata = {'File': {'File Type': 'JPEG', 'Width': 800, 'Height': 600}}
+    terms = build_search_terms('Logo', [], metadata)
+    assert terms == {
+        (TermKinds.NAME, 'logo'),
+        (TermKinds.FILE_TYPE, 'jpeg'),
+        (TermKinds.RESOLUTION, '800x600'),
+    }
+
+
+@pytest.fixture
+def owner(db):
+    return Client.objects.create(name='Search Client', logo='logos/search.png')
+
+
+@pytest.fixture
+def api_client(owner):
+    user = User.objects.create_user('search', password='search')
+    ClientUserProfile.objects.create(user=user, client=owner)
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+def _web_assets(owner, *names):
+    assets = bulk_create_inherited(WebAsset, [
+        WebAsset(name=name, type=AssetTypes.WEB, owner=owner, content='', asset_url='')
+        for name in names
+    ])
+    for asset in assets:
+        asset.update_search_terms()
+    return assets
+
+
+def _search(api_client, **params):
+    response = api_client.get('/api/assets/search/', params)
+    assert response.status_code == 200
+    return response.data
+
+
+def test_search_matches_prefixes_of_every_word(owner, api_client):
+    summer, winter, _ = _web_assets(owner, 'Summer Sale', 'Winter Sale', 'Opening Hours')
+
+    results = _search(api_client, q='sa')['results']
+    assert {asset['id'] for asset in results} == {summer.pk, winter.pk}
+
+    results = _search(api_client, q='SUM sal')['results']
+    assert [asset['id'] for asset in results] == [summer.pk]
+
+
+def test_search_is_limited_to_the_owner(owner, api_client):
+    other_owner = Client.objects.create(name='Other Client', logo='logos/other.png')
+    own, = _web_assets(owner, 'Summer Sale')
+    other, = _web_assets(other_owner, 'Summer Sale')
+    other.tags.add('Promo')
+
+    data = _search(api_client, q='summer')
+    assert [asset['id'] for asset in data['results']] == [own.pk]
+    assert data['facets'] == {'tags': []}
+
+
+def test_search_filters_and_counts_tags(owner, api_client):
+    summer, winter = _web_assets(owner, 'Summer Sale', 'Winter Sale')
+    summer.tags.add('Promo', 'Outdoor')
+    winter.tags.add('Promo')
+
+    data = _search(api_client, q='sale', tag='outdoor')
+    assert [asset['id'] for asset in data['results']] == [summer.pk]
+
+    data = _search(api_client, q='sale')
+    assert data['facets'] == {'tags': [{'name': 'promo', 'count': 2},
+                                       {'name': 'outdoor', 'count': 1}]}
+
+
+def test_bulk_tags_updates_the_owners_assets(owner, api_client):
+    summer, winter = _web_assets(owner, 'Summer Sale', 'Winter Sale')
+    other, = _web_assets(Client.objects.create(name='Other Client', logo='logos/other.png'),
+                         'Summer Sale')
+
+    response = api_client.post('/api/assets/bulk_tags/',
+                               {'ids': [summer.pk, winter.pk, other.pk], 'add': ['Promo']},
+                               format='json')
+    assert response.status_code == 200
+    assert not other.tags.exists()
+    results = _search(api_client, tag='promo')['results']
+    assert {asset['id'] for asset in results} == {summer.pk, winter.pk}
+
+
+@pytest.mark.parametrize('data', (
+        {'ids': ['summer'], 'add': ['Promo']},
+        {'ids': [], 'add': ['Promo']},
+        {'ids': [1], 'add': 'Promo'},
+        ['summer'],
+))
+def test_bulk_tags_rejects_invalid_requests(api_client, data):
+    response = api_client.post('/api/assets/bulk_tags/', data, format='json')
+    assert response.status_code == 400
+
+
+CALENDAR = '''BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//Signoxe//Tests//EN
+BEGIN:VTIMEZONE
+TZID:Europe/Amsterdam
+BEGIN:STANDARD
+DTSTART:19701025T030000
+TZOFFSETFROM:+0200
+TZOFFSETTO:+0100
+END:STANDARD
+END:VTIMEZONE
+BEGIN:VEVENT
+UID:duration@signoxe
+SUMMARY:Opening
+DESCRIPTION:Doors open
+DTSTART:20180105T090000Z
+DURATION:PT2H
+END:VEVENT
+BEGIN:VEVENT
+UID:instant@signoxe
+SUMMARY:Reminder
+DESCRIPTION:Reminder
+DTSTART:20180105T150000Z
+END:VEVENT
+END:VCALENDAR
+'''
+
+
+def test_calendar_next_change_without_dtend():
+    asset = CalendarAsset(data=CALENDAR)
+    moment = datetime.datetime(2018, 1, 5, 8, tzinfo=datetime.timezone.utc)
+
+    assert asset.get_next_change(moment) == moment.replace(hour=9)
+    assert asset.get_next_change(moment.replace(hour=9)) == moment.replace(hour=11)
+    assert asset.get_next_change(moment.replace(hour=12)) == moment.replace(hour=15)
+    assert asset.get_next_change(moment.replace(hour=15)) is None
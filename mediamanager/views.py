@@ -3,24 +3,42 @@
 View for media manager app.
 """
 from channels import Channel
-from django.http import HttpResponse, HttpResponseNotFound, HttpResponseRedirect
+from django.db.models import Count
+from django.http import Http404, HttpResponseNotFound, HttpResponseRedirect
 from django.views.decorators.clickjacking import xframe_options_exempt
-from rest_framework import mixins, status, viewsets
-from rest_framework.decorators import detail_route
+from rest_framework import mixins, serializers, status, viewsets
+from rest_framework.decorators import detail_route, list_route
 from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 
-from mediamanager.models import (Asset, CalendarAsset, ContentFeed, FeedAsset, ImageAsset,
-                                 Playlist, PlaylistItem, Ticker, TickerSeries, VideoAsset,
-                                 WebAsset, WebAssetTemplate, )
+from devicemanager.consumers import get_device_groups_for_content_feeds
+from devicemanager.models import DeviceGroup
+from mediamanager.models import (CALENDAR_ASSET_PAGE, WEB_ASSET_PAGE, Asset, AssetSearchTerm,
+                                 CalendarAsset, ContentFeed, FeedAsset, ImageAsset, Playlist,
+                                 PlaylistItem, Ticker, TickerSeries, VideoAsset, WebAsset,
+                                 WebAssetTemplate, )
+from mediamanager.bundles import BUNDLE_STORAGE, Compression, collect_bundle, get_bundle_name
+from mediamanager.search import TermKinds, normalise_term, split_query
 from mediamanager.serializers import (AssetSerializer, CalendarSerializer, ContentFeedSerializer,
                                       FeedSerializer, ImageSerializer, PlaylistItemSerializer,
                                       PlaylistSerializer, TickerSerializer,
                                       TickerSeriesSerializer, VideoSerializer,
                                       WebAssetTemplateSerializer, WebSerializer, )
-from utils.errors import NoContentAssetError
+from mediamanager.tagging import bulk_update_tags
 from utils.files import verify_mime
-from utils.mixins import FilterByOwnerMixin, get_owner_from_request
+from utils.mixins import FilterByOwnerMixin, SparseFieldsetMixin, get_owner_from_request
+from utils.page_cache import cached_page_response
+from utils.pagination import IdKeysetPagination, KeysetPagination, SearchPagination
+from utils.queries import query_budget
+
+#: Asset fields that are expensive to load and that list views rarely need.
+HEAVY_ASSET_FIELDS = ('raw_metadata', 'metadata')
+
+#: Maximum number of tag facets returned with search results.
+MAX_SEARCH_FACETS = 50
+
+#: Queries allowed for a page of a list endpoint, which must not depend on the page size.
+LIST_QUERY_BUDGET = 5
 
 
 # noinspection PyUnusedLocal
@@ -52,10 +70,15 @@ class TickerViewSet(viewsets.ModelViewSet):
     serializer_class = TickerSerializer
 
 
-class PlaylistViewSet(FilterByOwnerMixin, viewsets.ModelViewSet):
+class PlaylistViewSet(SparseFieldsetMixin, FilterByOwnerMixin, viewsets.ModelViewSet):
     """ API ViewSet class for playlists. """
     queryset = Playlist.objects.all()
     serializer_class = PlaylistSerializer
+    pagination_class = IdKeysetPagination
+
+    @query_budget(LIST_QUERY_BUDGET)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
 
     @detail_route(methods=['POST'])
     def clone(self, request, pk=None):
@@ -85,6 +108,32 @@ class PlaylistItemViewSet(viewsets.ModelViewSet):
     serializer_class = PlaylistItemSerializer
 
 
+class MetadataFilterMixin:
+    """
+    Filters assets by their extracted metadata columns using query parameters such as
+    ``?min_width=1920&codec=h264&max_duration=30``.
+    It is intended to be mixed in with a ViewSet class.
+    """
+    range_filter_fields = ('width', 'height', 'duration', 'file_size')
+
+    def get_queryset(self):
+        """ Applies metadata filters from the query parameters. """
+        queryset = super().get_queryset()
+        params = self.request.query_params
+        filters = {}
+        for field in self.range_filter_fields:
+            for prefix, lookup in (('min', 'gte'), ('max', 'lte')):
+                value = params.get('{}_{}'.format(prefix, field))
+                if value is not None:
+                    try:
+                        filters['{}__{}'.format(field, lookup)] = float(value)
+                    except ValueError:
+                        raise ValidationError({'{}_{}'.format(prefix, field): 'Invalid number.'})
+        if params.get('codec'):
+            filters['codec__iexact'] = params['codec']
+        return queryset.filter(**filters)
+
+
 class ValidateMimesOnCreateMixin:
     """ A mixin to validate the mime-type of uploaded files. """
 
@@ -96,10 +145,30 @@ class ValidateMimesOnCreateMixin:
         return super().create(request, *args, **kwargs)
 
 
-class AssetViewSet(FilterByOwnerMixin, viewsets.ModelViewSet):
+class BulkTagsSerializer(serializers.Serializer):
+    """ Validates the asset ids and the tag names to add, remove or set of a bulk tag update. """
+    ids = serializers.ListField(child=serializers.IntegerField())
+    add = serializers.ListField(child=serializers.CharField(max_length=100), required=False)
+    remove = serializers.ListField(child=serializers.CharField(max_length=100), required=False)
+    set = serializers.ListField(child=serializers.CharField(max_length=100), required=False)
+
+    def validate_ids(self, value):
+        if not value:
+            raise ValidationError('A list of asset ids is required.')
+        return value
+
+
+class AssetViewSet(MetadataFilterMixin, SparseFieldsetMixin, FilterByOwnerMixin,
+                   viewsets.ModelViewSet):
     """ API ViewSet class for assets. """
     queryset = Asset.objects.order_by('-created')
     serializer_class = AssetSerializer
+    pagination_class = KeysetPagination
+    deferrable_fields = HEAVY_ASSET_FIELDS
+
+    @query_budget(LIST_QUERY_BUDGET)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
 
     @detail_route(methods=['GET', 'POST', 'PUT', 'DELETE'])
     def tags(self, request, pk=None):
@@ -127,24 +196,90 @@ class AssetViewSet(FilterByOwnerMixin, viewsets.ModelViewSet):
                 raise ValidationError
         return Response(asset.get_tags_list())
 
-
-class ImageViewSet(FilterByOwnerMixin, ValidateMimesOnCreateMixin, viewsets.ModelViewSet):
+    @list_route(methods=['POST'])
+    def bulk_tags(self, request):
+        """
+        Updates the tags of many assets at once. The request contains a list of asset ``ids``
+        and any of ``add``, ``remove`` or ``set`` with a list of tag names. The response has the
+        number of the assets each of their tags is on.
+        """
+        serializer = BulkTagsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        asset_ids = self.get_queryset().filter(id__in=data['ids']).values_list('id', flat=True)
+        tag_counts = bulk_update_tags(asset_ids,
+                                      add=data.get('add'),
+                                      remove=data.get('remove'),
+                                      replace=data.get('set'))
+        return Response(tag_counts)
+
+    @query_budget(LIST_QUERY_BUDGET + 1)
+    @list_route(methods=['GET'])
+    def search(self, request):
+        """
+        Searches the client's assets using the search index. Each word in the ``q`` parameter is
+        matched as a prefix of words in the asset name, tags, codec, resolution or duration, and
+        each ``tag`` parameter limits results to assets with that tag. Results are always
+        paginated and include the tags of all matching assets with their counts.
+        """
+        owner = get_owner_from_request(request)
+        search_terms = AssetSearchTerm.objects.filter(owner=owner)
+        assets = self.get_queryset()
+        for word in split_query(request.query_params.get('q')):
+            matching_terms = search_terms.filter(term__startswith=word)
+            assets = assets.filter(id__in=matching_terms.values('asset_id'))
+        for tag in request.query_params.getlist('tag'):
+            matching_terms = search_terms.filter(kind=TermKinds.TAG, term=normalise_term(tag))
+            assets = assets.filter(id__in=matching_terms.values('asset_id'))
+
+        tag_facets = search_terms.filter(
+                kind=TermKinds.TAG,
+                asset_id__in=assets.values('id'),
+        ).values('term').annotate(count=Count('asset_id')).order_by('-count', 'term')
+
+        paginator = SearchPagination()
+        page = paginator.paginate_queryset(assets, request, view=self)
+        serializer = self.get_serializer(page, many=True)
+        response = paginator.get_paginated_response(serializer.data)
+        response.data['facets'] = {
+            'tags': [{'name': facet['term'], 'count': facet['count']}
+                     for facet in tag_facets[:MAX_SEARCH_FACETS]],
+        }
+        return response
+
+
+class ImageViewSet(MetadataFilterMixin, SparseFieldsetMixin, FilterByOwnerMixin,
+                   ValidateMimesOnCreateMixin, viewsets.ModelViewSet):
     """ API ViewSet class for image assets. """
     queryset = ImageAsset.objects.all()
     serializer_class = ImageSerializer
+    pagination_class = KeysetPagination
+    deferrable_fields = HEAVY_ASSET_FIELDS
 
     supported_mimes = ['image/png', 'image/jpeg', 'image/pjpeg']
     file_field = 'media_file'
 
+    @query_budget(LIST_QUERY_BUDGET)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
 
-class VideoViewSet(FilterByOwnerMixin, ValidateMimesOnCreateMixin, viewsets.ModelViewSet):
+
+class VideoViewSet(MetadataFilterMixin, SparseFieldsetMixin, FilterByOwnerMixin,
+                   ValidateMimesOnCreateMixin, viewsets.ModelViewSet):
     """ API ViewSet class for video assets. """
     queryset = VideoAsset.objects.all()
     serializer_class = VideoSerializer
+    pagination_class = KeysetPagination
+    deferrable_fields = HEAVY_ASSET_FIELDS
 
     supported_mimes = ['video/mp4', 'video/webm']
     file_field = 'media_file'
 
+    @query_budget(LIST_QUERY_BUDGET)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
 
 class FeedViewSet(viewsets.ModelViewSet):
     """ API ViewSet class for feed assets. """
@@ -160,10 +295,16 @@ class FeedViewSet(viewsets.ModelViewSet):
         return self.queryset.filter(feed__publish_to__in=[owner])
 
 
-class WebViewSet(FilterByOwnerMixin, viewsets.ModelViewSet):
+class WebViewSet(SparseFieldsetMixin, FilterByOwnerMixin, viewsets.ModelViewSet):
     """ API ViewSet class for web assets. """
     queryset = WebAsset.objects.all()
     serializer_class = WebSerializer
+    pagination_class = KeysetPagination
+    deferrable_fields = HEAVY_ASSET_FIELDS + ('content',)
+
+    @query_budget(LIST_QUERY_BUDGET)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
 
 
 class CalendarViewSet(FilterByOwnerMixin, viewsets.ModelViewSet):
@@ -185,6 +326,50 @@ class ContentFeedViewSet(mixins.UpdateModelMixin,
     queryset = ContentFeed.objects.all()
     serializer_class = ContentFeedSerializer
 
+    @detail_route(methods=['GET'])
+    def bundle(self, request, pk=None):
+        """
+        Returns the location of the offline bundle for this content feed. If the bundle for
+        the current content hasn't been built yet, it is queued for building and a 202 response
+        is returned so the device can try again later. Devices pass their ``device_group`` so
+        that ``valid_until`` includes the next change of its schedule.
+        """
+        content_feed = self.get_object()  # type: ContentFeed
+        compression = request.query_params.get('compression', Compression.NONE)
+        if not Compression.is_available(compression):
+            raise ValidationError({'compression': 'Unsupported compression format.'})
+        device_group = None
+        if 'device_group' in request.query_params:
+            try:
+                device_group = get_device_groups_for_content_feeds([content_feed]).get(
+                        pk=int(request.query_params['device_group']))
+            except (ValueError, DeviceGroup.DoesNotExist):
+                raise ValidationError({'device_group': 'Not a device group showing this feed.'})
+        try:
+            manifest, _ = collect_bundle(content_feed, device_group=device_group)
+        except ContentFeed.PlaylistNotSetError as error:
+            raise ValidationError(str(error))
+
+        bundle_name = get_bundle_name(manifest['bundle_id'], compression)
+        if not BUNDLE_STORAGE.exists(bundle_name):
+            Channel('build-content-bundle').send({
+                'ids': [content_feed.id],
+                'compression': compression,
+            })
+            return Response({
+                'bundle_id': manifest['bundle_id'],
+                'ready': False,
+            }, status=status.HTTP_202_ACCEPTED)
+
+        return Response({
+            'bundle_id': manifest['bundle_id'],
+            'ready': True,
+            'compression': compression,
+            'url': BUNDLE_STORAGE.url(bundle_name),
+            'size': BUNDLE_STORAGE.size(bundle_name),
+            'valid_until': manifest['valid_until'],
+        })
+
 
 class WebAssetTemplateViewSet(viewsets.ReadOnlyModelViewSet):
     """ API ViewSet class for web asset templates. """
@@ -210,30 +395,34 @@ def asset_view(request, asset_id):
     return HttpResponseRedirect(asset.get_asset_url())
 
 
+@query_budget(1)
 @xframe_options_exempt
 def web_asset_view(request, asset_id):
     """ This view renders a web asset's content page. """
     # TODO: Add authentication for client devices
     # owner = get_owner_from_request(request)
-    try:
-        # webasset = filter_by_owner(WebAsset.objects, owner).get(pk=asset_id)
-        webasset = WebAsset.objects.get(pk=asset_id)
-    except WebAsset.DoesNotExist:
-        return HttpResponseNotFound()
-    return HttpResponse(webasset.content)
+    def render():
+        try:
+            # webasset = filter_by_owner(WebAsset.objects, owner).get(pk=asset_id)
+            webasset = WebAsset.objects.get(pk=asset_id)
+        except WebAsset.DoesNotExist:
+            raise Http404()
+        return webasset.content, None
+
+    return cached_page_response(request, WEB_ASSET_PAGE, asset_id, render)
 
 
+@query_budget(1)
 @xframe_options_exempt
 def cal_asset_view(request, asset_id):
     """ This view renders a calendar asset's content page. """
     # TODO: Add authentication for client devices
     # owner = get_owner_from_request(request)
-    try:
-        calasset = CalendarAsset.objects.get(pk=asset_id)
-    except CalendarAsset.DoesNotExist:
-        return HttpResponseNotFound()
-    try:
-        content = calasset.rendered_content
-        return HttpResponse(content)
-    except NoContentAssetError:
-        return HttpResponse(status=204)
+    def render():
+        try:
+            calasset = CalendarAsset.objects.select_related('template').get(pk=asset_id)
+        except CalendarAsset.DoesNotExist:
+            raise Http404()
+        return calasset.render_page()
+
+    return cached_page_response(request, CALENDAR_ASSET_PAGE, asset_id, render)
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+""" Notification manager app config. """
+from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save, pre_save
+
+
+class NotificationManagerConfig(AppConfig):
+    """ Notification manager app config class. """
+    name = 'notification_manager'
+    verbose_name = 'Notification Manager'
+
+    def ready(self):
+        """ Connects the signals that keep unread counters up to date. """
+        from notification_manager.models import Post, UserPostStatus
+        from notification_manager import unread
+        pre_save.connect(unread.post_pre_save, sender=Post)
+        post_save.connect(unread.post_saved, sender=Post)
+        post_delete.connect(unread.post_deleted, sender=Post)
+        post_save.connect(unread.post_status_saved, sender=UserPostStatus)
+        post_delete.connect(unread.post_status_deleted, sender=UserPostStatus)
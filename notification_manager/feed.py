@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+""" Views for the notification bell: unread counts and the post feed of a topic. """
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+
+from notification_manager.models import UserPostStatus
+from notification_manager.unread import get_unread_counts
+from notification_manager.views import PostViewSet
+from utils.pagination import PostFeedPagination
+
+
+@api_view(['GET'])
+@permission_classes((IsAuthenticated,))
+def unread_counts_view(request):
+    """ Returns the number of unread posts of the current user per topic and in total. """
+    counts = get_unread_counts(request.user.pk)
+    return Response({
+        'total': sum(counts.values()),
+        'topics': {str(topic_id): count for topic_id, count in counts.items()},
+    })
+
+
+def get_visible_posts(request):
+    """ Returns the posts the user can see, scoped to their client like the notifications API. """
+    view = PostViewSet(request=request, args=(), kwargs={}, action='list', format_kwarg=None)
+    return view.get_queryset()
+
+
+@api_view(['GET'])
+@permission_classes((IsAuthenticated,))
+def topic_feed_view(request, topic_id):
+    """ Returns a page of posts in the topic, newest first, marking the ones the user has read. """
+    paginator = PostFeedPagination()
+    posts = paginator.paginate_queryset(
+            get_visible_posts(request).filter(topic_id=topic_id), request)
+    read_post_ids = set(UserPostStatus.objects.filter(
+            user=request.user, post__in=[post.pk for post in posts]
+    ).values_list('post_id', flat=True))
+    return paginator.get_paginated_response([{
+        'id': post.pk,
+        'title': post.title,
+        'body': post.body,
+        'posted_on': post.posted_on,
+        'read': post.pk in read_post_ids,
+    } for post in posts])
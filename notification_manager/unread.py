@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Unread counters for notification posts.
+
+The number of posts in every topic, and the number of posts each user has read in every topic,
+are kept in Redis hashes and updated as posts are published or deleted and marked as read. The
+unread count of a topic is the difference of the two, so the notification bell doesn't need to
+scan posts and read states on every page load. Hashes that are missing, for instance after a
+cache flush, are rebuilt from the database with a single aggregate query.
+
+Counters are only updated once the transaction that changed the posts commits. A rebuild watches
+its hash and discards its counts if an update arrives while it runs, since the aggregate may or
+may not have seen that change.
+"""
+from django.db import transaction
+from django.db.models import Count, F
+from django_redis import get_redis_connection
+from redis import WatchError
+
+from notification_manager.models import Post, UserPostStatus
+
+#: Counters are rebuilt after this many seconds without use, so hashes of inactive users and of
+#: old generations don't pile up.
+COUNTER_TIMEOUT = 30 * 24 * 60 * 60
+
+#: Incremented whenever counters can't be updated incrementally, to discard all of them at once.
+GENERATION_KEY = 'post-counters:generation'
+
+#: Marker field that tells a rebuilt hash apart from one that only has a few increments.
+BUILT_FIELD = '_built'
+
+#: Marker field set on a hash that hasn't been built when a counter in it changes.
+STALE_FIELD = '_stale'
+
+#: Increments a counter only if the hash has been built, otherwise leaves it to the rebuild and
+#: marks the hash so that a rebuild that is running doesn't store counts that miss the change.
+INCREMENT_IF_BUILT = """
+if redis.call('HEXISTS', KEYS[1], ARGV[3]) == 1 then
+    return redis.call('HINCRBY', KEYS[1], ARGV[1], ARGV[2])
+end
+redis.call('HSET', KEYS[1], ARGV[4], 1)
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+"""
+
+
+def _redis():
+    return get_redis_connection('default')
+
+
+def _generation():
+    return int(_redis().get(GENERATION_KEY) or 0)
+
+
+def _post_counts_key():
+    return 'post-counts:{}'.format(_generation())
+
+
+def _read_counts_key(user_id):
+    return 'post-reads:{}:{}'.format(_generation(), user_id)
+
+
+def _increment(key, topic_id, amount):
+    _redis().eval(INCREMENT_IF_BUILT, 1, key, topic_id, amount, BUILT_FIELD, STALE_FIELD,
+                  COUNTER_TIMEOUT)
+
+
+def _on_commit(update, *args):
+    """ Runs a counter update once the current transaction commits, with a fresh key. """
+    transaction.on_commit(lambda: update(*args))
+
+
+def _increment_post_counts(topic_id, amount):
+    _increment(_post_counts_key(), topic_id, amount)
+
+
+def _increment_read_counts(user_id, topic_id, amount):
+    _increment(_read_counts_key(user_id), topic_id, amount)
+
+
+def _delete_read_counts(user_id):
+    _redis().delete(_read_counts_key(user_id))
+
+
+def _load_counts(key, build):
+    """
+    Returns the counts stored in the hash as a dict of topic id to count, rebuilding the hash
+    with the counts returned by ``build`` if it hasn't been built yet.
+    """
+    with _redis().pipeline() as pipeline:
+        pipeline.watch(key)
+        stored = pipeline.hgetall(key)
+        if BUILT_FIELD.encode('utf-8') in stored:
+            pipeline.unwatch()
+            _redis().expire(key, COUNTER_TIMEOUT)
+            return {int(topic_id): int(count) for topic_id, count in stored.items()
+                    if not topic_id.startswith(b'_')}
+
+        counts = {row['topic_id']: row['count'] for row in build()}
+        pipeline.multi()
+        pipeline.delete(key)
+        pipeline.hmset(key, dict(counts, **{BUILT_FIELD: 1}))
+        pipeline.expire(key, COUNTER_TIMEOUT)
+        try:
+            pipeline.execute()
+        except WatchError:
+            # A counter changed during the rebuild, the next request rebuilds the hash again.
+            pass
+    return counts
+
+
+def get_post_counts():
+    """ Returns a dict of topic id to the number of posts in the topic. """
+    return _load_counts(_post_counts_key(), lambda: (
+        Post.objects.order_by().values('topic_id').annotate(count=Count('id'))))
+
+
+def get_read_counts(user_id):
+    """ Returns a dict of topic id to the number of posts in the topic the user has read. """
+    return _load_counts(_read_counts_key(user_id), lambda: (
+        UserPostStatus.objects.filter(user_id=user_id).order_by()
+        .values(topic_id=F('post__topic_id')).annotate(count=Count('id'))))
+
+
+def get_unread_counts(user_id):
+    """ Returns a dict of topic id to the number of unread posts for the user in that topic. """
+    read_counts = get_read_counts(user_id)
+    return {topic_id: max(count - read_counts.get(topic_id, 0), 0)
+            for topic_id, count in get_post_counts().items()}
+
+
+def reset_counters():
+    """ Discards all counters, they are rebuilt from the database as they are needed. """
+    _redis().incr(GENERATION_KEY)
+
+
+# noinspection PyUnusedLocal
+def post_pre_save(sender, instance=None, raw=False, **kwargs):
+    """ Resets counters when a post moves to another topic, which changes counts of readers. """
+    if raw or instance.pk is None:
+        return
+    old_topic_id = Post.objects.filter(pk=instance.pk).values_list('topic_id', flat=True).first()
+    if old_topic_id is not None and old_topic_id != instance.topic_id:
+        _on_commit(reset_counters)
+
+
+# noinspection PyUnusedLocal
+def post_saved(sender, instance=None, created=False, **kwargs):
+    if created:
+        _on_commit(_increment_post_counts, instance.topic_id, 1)
+
+
+# noinspection PyUnusedLocal
+def post_deleted(sender, instance=None, **kwargs):
+    # Read states of the post are deleted along with it, which updates the read counts.
+    _on_commit(_increment_post_counts, instance.topic_id, -1)
+
+
+# noinspection PyUnusedLocal
+def post_status_saved(sender, instance=None, created=False, **kwargs):
+    if created:
+        topic_id = Post.objects.filter(pk=instance.post_id).values_list('topic_id', flat=True)[0]
+        _on_commit(_increment_read_counts, instance.user_id, topic_id, 1)
+
+
+# noinspection PyUnusedLocal
+def post_status_deleted(sender, instance=None, **kwargs):
+    # The post may already be gone, so rebuild the counts of the user instead of looking it up.
+    _on_commit(_delete_read_counts, instance.user_id)
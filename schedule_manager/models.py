@@ -4,8 +4,10 @@ import datetime
 from django.core.exceptions import ValidationError
 from django.db import models
 from django.db.models import Q
+from django.utils import timezone
 
 from mediamanager.models import ContentFeed
+from utils.dates import next_midnight
 
 
 class WeekDays:
@@ -160,3 +162,26 @@ class SpecialContent(models.Model):
         verbose_name_plural = 'Special Content'
         unique_together = (('device_group', 'date',),)
         ordering = ('date',)
+
+
+def get_next_schedule_change(device_group, now=None):
+    """
+    Returns the next time the scheduled content for the device group changes. This is the next
+    start or end of a schedule for today, or the next midnight, when a different set of day
+    schedules and special content applies.
+    """
+    if now is None:
+        now = timezone.now()
+    local_now = timezone.localtime(now)
+    boundaries = []
+    schedules = ScheduledContent.objects.filter(
+            device_group=device_group,
+            day=WeekDays.CODES[local_now.weekday()],
+            default=False,
+    ).values_list('start_time', 'end_time')
+    for start_time, end_time in schedules:
+        boundaries.extend(boundary for boundary in (start_time, end_time)
+                          if boundary > local_now.time())
+    if not boundaries:
+        return next_midnight(now)
+    return timezone.make_aware(datetime.datetime.combine(local_now.date(), min(boundaries)))
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+import pytest
+from django.utils import timezone
+
+from schedule_manager.models import ScheduledContent, WeekDays, get_next_schedule_change
+from utils.dates import next_midnight
+
+
+def _local_time(hour, minute):
+    today = timezone.localtime(timezone.now()).date()
+    return timezone.make_aware(datetime.datetime.combine(today, datetime.time(hour, minute)))
+
+
+def _today():
+    return WeekDays.CODES[timezone.localtime(timezone.now()).weekday()]
+
+
+@pytest.mark.django_db
+def test_next_change_without_schedules_is_midnight(device_group_1):
+    now = _local_time(10, 0)
+    assert get_next_schedule_change(device_group_1, now) == next_midnight(now)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('hour,minute,expected', (
+        (8, 0, datetime.time(9, 0)),
+        (9, 30, datetime.time(11, 0)),
+        (11, 30, datetime.time(13, 0)),
+        (13, 30, datetime.time(14, 0)),
+))
+def test_next_change_is_next_schedule_boundary(hour, minute, expected,
+                                               device_group_1, content_feed_1):
+    for start_time, end_time in ((datetime.time(9, 0), datetime.time(11, 0)),
+                                 (datetime.time(13, 0), datetime.time(14, 0))):
+        ScheduledContent.objects.create(
+                day=_today(),
+                default=False,
+                start_time=start_time,
+                end_time=end_time,
+                content=content_feed_1,
+                device_group=device_group_1
+        )
+    now = _local_time(hour, minute)
+    next_change = get_next_schedule_change(device_group_1, now)
+    assert timezone.localtime(next_change).time() == expected
+
+
+@pytest.mark.django_db
+def test_next_change_after_last_schedule_is_midnight(device_group_1, content_feed_1):
+    ScheduledContent.objects.create(
+            day=_today(),
+            default=False,
+            start_time=datetime.time(9, 0),
+            end_time=datetime.time(11, 0),
+            content=content_feed_1,
+            device_group=device_group_1
+    )
+    now = _local_time(12, 0)
+    assert get_next_schedule_change(device_group_1, now) == next_midnight(now)
@@ -3,15 +3,35 @@
 from channels.routing import route
 
 from client_manager.consumers import notify_connect, notify_disconnect
-from mediamanager.consumers import (create_thumbnail, update_calendar_assets,
-                                    update_image_metadata,
+from devicemanager.consumers import device_connect, device_disconnect, device_receive
+from devicemanager.deltas import generate_app_patches
+from devicemanager.screenshots import process_screenshots
+from feedmanager.imports import import_snippets
+from mediamanager.consumers import (build_content_bundles, create_thumbnail,
+                                    update_calendar_assets, update_image_metadata,
                                     update_video_metadata)
+from utils.metrics import measure_consumer
+from utils.profiling import profile_consumer
+from utils.queries import capture_consumer
+
+
+def instrument(consumer):
+    """ Adds metrics, query capture and on-demand profiling to a consumer. """
+    return measure_consumer(capture_consumer(profile_consumer(consumer)))
+
 
 channel_routing = [
-    route('update-video-metadata', update_video_metadata),
-    route('update-image-metadata', update_image_metadata),
-    route('update-calendar-assets', update_calendar_assets),
-    route('create-thumbnail', create_thumbnail),
-    route('websocket.connect', notify_connect, path=r'^/notify_updates/$'),
-    route('websocket.disconnect', notify_disconnect, path=r'^/notify_updates/$'),
+    route('update-video-metadata', instrument(update_video_metadata)),
+    route('update-image-metadata', instrument(update_image_metadata)),
+    route('update-calendar-assets', instrument(update_calendar_assets)),
+    route('create-thumbnail', instrument(create_thumbnail)),
+    route('build-content-bundle', instrument(build_content_bundles)),
+    route('process-screenshots', instrument(process_screenshots)),
+    route('generate-app-patches', instrument(generate_app_patches)),
+    route('import-snippets', instrument(import_snippets)),
+    route('websocket.connect', instrument(notify_connect), path=r'^/notify_updates/$'),
+    route('websocket.disconnect', instrument(notify_disconnect), path=r'^/notify_updates/$'),
+    route('websocket.connect', instrument(device_connect), path=r'^/device_updates/$'),
+    route('websocket.receive', instrument(device_receive), path=r'^/device_updates/$'),
+    route('websocket.disconnect', instrument(device_disconnect), path=r'^/device_updates/$'),
 ]
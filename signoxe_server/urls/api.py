@@ -4,14 +4,20 @@ from django.conf.urls import include, url
 from rest_framework import routers
 from rest_framework.schemas import get_schema_view
 
+from devicemanager.commands import device_commands_view
+from devicemanager.deltas import app_update_view
+from devicemanager.fleet import fleet_summary_view
+from devicemanager.mirrors import mirror_manifest_view
 from devicemanager.views import DeviceGroupViewSet, DeviceScreenShotViewSet, DeviceViewSet
 from mediamanager.views import (AssetViewSet, CalendarViewSet, ContentFeedViewSet,
                                 FeedViewSet,
                                 ImageViewSet, PlaylistItemViewSet, PlaylistViewSet,
                                 TickerSeriesViewSet, TickerViewSet,
                                 VideoViewSet, WebAssetTemplateViewSet, WebViewSet, )
+from notification_manager.feed import topic_feed_view, unread_counts_view
 from notification_manager.views import PostViewSet
 from schedule_manager.views import ScheduledContentViewSet, SpecialContentViewSet
+from utils.metrics import metrics_view
 
 schema_view = get_schema_view(title='Signoxe Frontend API',
                               urlconf='signoxe_server.urls.api')
@@ -41,4 +47,14 @@ urlpatterns = [
     url(r'', include(router.urls, namespace='api')),
     url(r'auth/', include('djoser.urls.base')),
     url(r'auth/', include('djoser.urls.authtoken')),
+    url(r'^app_updates/(?P<device_id>[-\w]+)/$', app_update_view, name='app-update'),
+    url(r'^device_commands/(?P<device_id>[-\w]+)/$', device_commands_view,
+        name='device-commands'),
+    url(r'^fleet_summary/$', fleet_summary_view, name='fleet-summary'),
+    url(r'^metrics/$', metrics_view, name='metrics'),
+    url(r'^notification_counts/$', unread_counts_view, name='notification-counts'),
+    url(r'^notification_topics/(?P<topic_id>\d+)/posts/$', topic_feed_view,
+        name='notification-topic-feed'),
+    url(r'^mirrors/(?P<mirror_id>[-\w]+)/manifest/$', mirror_manifest_view,
+        name='mirror-manifest'),
 ]
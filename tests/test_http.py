@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db import models
+from django.db.models.fields.files import FieldFile
+from django.test import RequestFactory
+
+from utils.http import serve_media_file
+
+CONTENT = bytes(range(256)) * 1024
+
+
+def _field_file(tmp_path):
+    storage = FileSystemStorage(location=str(tmp_path), base_url='/media/')
+    storage.save('clip.mp4', ContentFile(CONTENT))
+    field = models.FileField(storage=storage)
+    return FieldFile(None, field, 'clip.mp4')
+
+
+def _streamed(response):
+    return b''.join(response.streaming_content)
+
+
+def test_streams_whole_file(tmp_path, settings):
+    settings.USE_S3_STORAGE = False
+    request = RequestFactory().get('/feeds/video/')
+
+    response = serve_media_file(request, _field_file(tmp_path), 'abc')
+
+    assert response.status_code == 200
+    assert response['Content-Type'] == 'video/mp4'
+    assert response['Content-Length'] == str(len(CONTENT))
+    assert _streamed(response) == CONTENT
+
+
+def test_streams_requested_range(tmp_path, settings):
+    settings.USE_S3_STORAGE = False
+    request = RequestFactory().get('/feeds/video/', HTTP_RANGE='bytes=100-199')
+
+    response = serve_media_file(request, _field_file(tmp_path), 'abc')
+
+    assert response.status_code == 206
+    assert response['Content-Range'] == 'bytes 100-199/{}'.format(len(CONTENT))
+    assert _streamed(response) == CONTENT[100:200]
+
+
+def test_s3_redirects_are_not_cached(tmp_path, settings):
+    settings.USE_S3_STORAGE = True
+    request = RequestFactory().get('/feeds/video/')
+
+    response = serve_media_file(request, _field_file(tmp_path), 'abc')
+
+    assert response.status_code == 302
+    assert 'public' not in response['Cache-Control']
+    assert 'no-cache' in response['Cache-Control']
+    assert not response.has_header('ETag')
+
+
+def test_media_is_revalidated(tmp_path, settings):
+    settings.USE_S3_STORAGE = False
+    request = RequestFactory().get('/feeds/video/')
+
+    response = serve_media_file(request, _field_file(tmp_path), 'abc')
+
+    assert 'no-cache' in response['Cache-Control']
+    assert 'max-age' not in response['Cache-Control']
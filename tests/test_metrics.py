@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+from collections import Counter
+
+import pytest
+
+from utils import metrics
+
+
+def test_histogram_samples_are_cumulative(monkeypatch):
+    samples = Counter()
+    monkeypatch.setattr(metrics.buffer, 'add',
+                        lambda family, sample, amount: samples.update({sample: amount}))
+
+    metrics.CONSUMER_DURATION.observe(0.2, channel='create-thumbnail')
+
+    name = 'signoxe_consumer_duration_seconds'
+    assert samples[name + '_bucket{channel="create-thumbnail",le="0.1"}'] == 0
+    assert samples[name + '_bucket{channel="create-thumbnail",le="0.25"}'] == 1
+    assert samples[name + '_bucket{channel="create-thumbnail",le="+Inf"}'] == 1
+    assert samples[name + '_sum{channel="create-thumbnail"}'] == 0.2
+    assert samples[name + '_count{channel="create-thumbnail"}'] == 1
+
+
+def test_cache_hit_ratios():
+    samples = [
+        ('signoxe_cache_lookups_total{cache="owner",result="hit"}', 3),
+        ('signoxe_cache_lookups_total{cache="owner",result="miss"}', 1),
+    ]
+    assert metrics._cache_hit_ratios(samples) == [
+        ('signoxe_cache_hit_ratio{cache="owner"}', 0.75)]
+
+
+def test_label_values_are_escaped():
+    assert metrics._format_labels((('group', 'a"b\\c'),)) == '{group="a\\"b\\\\c"}'
+
+
+def test_failed_flush_keeps_samples(monkeypatch):
+    from redis.exceptions import ConnectionError
+
+    def unavailable(alias):
+        raise ConnectionError('Redis is down')
+
+    monkeypatch.setattr(metrics, 'get_redis_connection', unavailable)
+    buffer = metrics.MetricsBuffer('metrics:test', interval=0)
+
+    buffer.add('signoxe_test_total', 'signoxe_test_total', 2)
+    buffer.add('signoxe_test_total', 'signoxe_test_total', 3)
+
+    assert buffer._samples['signoxe_test_total|signoxe_test_total'] == 5
+
+
+def test_flush_disables_metrics_without_redis_cache(monkeypatch):
+    def not_redis(alias):
+        raise NotImplementedError('This backend does not support this feature')
+
+    monkeypatch.setattr(metrics, 'get_redis_connection', not_redis)
+    buffer = metrics.MetricsBuffer('metrics:test', interval=0)
+
+    buffer.add('signoxe_test_total', 'signoxe_test_total', 1)
+    buffer.add('signoxe_test_total', 'signoxe_test_total', 1)
+
+    assert not buffer.enabled
+    assert not buffer._samples
+
+
+@pytest.fixture
+def redis():
+    try:
+        connection = metrics.get_redis_connection('default')
+        connection.ping()
+    except Exception:
+        pytest.skip('The default cache is not a reachable Redis cache')
+    return connection
+
+
+def test_lost_disconnects_expire(redis):
+    connections = metrics.WebsocketConnections('metrics:test-websockets', expiry=60)
+    connections.reset()
+    connections.connect('frontend', 'updates-a-1', 'websocket.send!old', now=1000)
+    connections.connect('frontend', 'updates-a-1', 'websocket.send!open', now=1050)
+    connections.connect('device', 'device-group-2', 'websocket.send!closed', now=1050)
+    connections.disconnect('device', 'device-group-2', 'websocket.send!closed')
+
+    # The first connection never disconnected, e.g. because daphne restarted.
+    assert connections.counts(now=1070) == {('frontend', 'updates-a-1'): 1}
+    connections.reset()
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from django.test import RequestFactory
+
+from utils.page_cache import cached_page_response, invalidate_pages
+
+
+def test_pages_are_revalidated_by_downstream_caches():
+    content = {'page': 'first'}
+    factory = RequestFactory()
+    invalidate_pages('test-page', 1)
+
+    def render():
+        return content['page'], None
+
+    response = cached_page_response(factory.get('/'), 'test-page', 1, render)
+    assert 'no-cache' in response['Cache-Control']
+    assert 'max-age' not in response['Cache-Control']
+
+    etag = response['ETag']
+    revalidated = cached_page_response(factory.get('/', HTTP_IF_NONE_MATCH=etag), 'test-page', 1,
+                                       render)
+    assert revalidated.status_code == 304
+
+    content['page'] = 'edited'
+    invalidate_pages('test-page', 1)
+    edited = cached_page_response(factory.get('/', HTTP_IF_NONE_MATCH=etag), 'test-page', 1,
+                                  render)
+    assert edited.status_code == 200
+    assert edited.content == b'edited'
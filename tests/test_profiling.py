@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import time
+from types import SimpleNamespace
+
+import pytest
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.storage import FileSystemStorage
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+from utils import profiling
+from utils.profiling import (PROFILE_RESPONSE_HEADER, ProfilingMiddleware, SamplingProfiler,
+                             profile_consumer, profile_next)
+
+
+def busy_wait(seconds):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        pass
+
+
+@pytest.fixture
+def profile_storage(monkeypatch, tmpdir):
+    storage = FileSystemStorage(location=str(tmpdir))
+    monkeypatch.setattr(profiling, 'PROFILE_STORAGE', storage)
+    monkeypatch.setattr(profiling, 'cache', LocMemCache('profiling-tests', {}))
+    return storage
+
+
+def saved_profiles(storage):
+    if not storage.exists(profiling.PROFILE_DIR):
+        return []
+    kinds, _ = storage.listdir(profiling.PROFILE_DIR)
+    return [name for kind in kinds
+            for name in storage.listdir('{}/{}'.format(profiling.PROFILE_DIR, kind))[1]]
+
+
+def view_authenticating(user):
+    """ Returns a view that authenticates the user itself, like token authentication does. """
+    def view(request):
+        request.user = user
+        busy_wait(0.01)
+        return HttpResponse()
+
+    return view
+
+
+def test_profiler_collapses_sampled_stacks():
+    profiler = SamplingProfiler(interval=0.001)
+    profiler.start()
+    busy_wait(0.05)
+    profiler.stop()
+
+    lines = profiler.collapsed().splitlines()
+    assert lines
+    stack, count = lines[0].rsplit(' ', 1)
+    assert int(count) > 0
+    assert any('busy_wait (' in line for line in lines)
+    assert 'test_profiler_collapses_sampled_stacks (' in stack
+
+
+def test_middleware_keeps_profile_of_staff_authenticated_in_view(profile_storage):
+    request = RequestFactory().get('/api/playlists/', HTTP_X_PROFILE='1')
+    request.user = AnonymousUser()
+    middleware = ProfilingMiddleware(view_authenticating(SimpleNamespace(is_staff=True)))
+
+    response = middleware(request)
+
+    assert profile_storage.exists(response[PROFILE_RESPONSE_HEADER])
+
+
+def test_middleware_discards_profile_of_other_users(profile_storage):
+    request = RequestFactory().get('/api/playlists/', HTTP_X_PROFILE='1')
+    request.user = AnonymousUser()
+    middleware = ProfilingMiddleware(view_authenticating(SimpleNamespace(is_staff=False)))
+
+    response = middleware(request)
+
+    assert not response.has_header(PROFILE_RESPONSE_HEADER)
+    assert saved_profiles(profile_storage) == []
+
+
+def test_profile_next_profiles_the_next_requests(profile_storage):
+    middleware = ProfilingMiddleware(view_authenticating(AnonymousUser()))
+    profile_next(profiling.REQUESTS_TARGET, 1)
+
+    for _ in range(2):
+        request = RequestFactory().get('/api/playlists/')
+        request.user = AnonymousUser()
+        response = middleware(request)
+        assert not response.has_header(PROFILE_RESPONSE_HEADER)
+
+    assert len(saved_profiles(profile_storage)) == 1
+
+
+def test_profile_next_profiles_the_next_consumer_runs(profile_storage):
+    def create_thumbnail(message):
+        busy_wait(0.01)
+        return message
+
+    consumer = profile_consumer(create_thumbnail)
+    profile_next('create_thumbnail', 2)
+
+    for message in range(3):
+        assert consumer(message) == message
+
+    assert len(saved_profiles(profile_storage)) == 2
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import pytest
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from utils.queries import (QueryBudget, QueryBudgetExceeded, assert_max_queries,
+                           capture_queries)
+
+
+@pytest.mark.django_db
+def test_capture_records_queries_and_origin():
+    with capture_queries('outer') as outer:
+        User.objects.count()
+        with capture_queries('inner') as inner:
+            list(User.objects.all())
+
+    assert outer.count == 2
+    assert inner.count == 1
+    assert outer.slowest[0]['frame'].startswith('tests/test_queries.py')
+
+
+@pytest.mark.django_db
+def test_budget_is_enforced():
+    with assert_max_queries(1):
+        User.objects.count()
+
+    with pytest.raises(QueryBudgetExceeded):
+        with assert_max_queries(1):
+            User.objects.count()
+            User.objects.count()
+
+
+@pytest.mark.django_db
+def test_budget_logs_when_not_strict(caplog):
+    with capture_queries('view') as capture:
+        User.objects.count()
+        User.objects.count()
+
+    QueryBudget(1).check(capture, strict=False)
+    assert 'view exceeded its query budget: 2 queries, budget is 1' in caplog.text
+
+
+@pytest.mark.django_db
+def test_capture_keeps_django_query_log():
+    with CaptureQueriesContext(connection) as outer_log:
+        with capture_queries('outer') as capture:
+            User.objects.count()
+            with CaptureQueriesContext(connection) as inner_log:
+                User.objects.count()
+
+    assert capture.count == 2
+    assert len(outer_log) == 2
+    assert len(inner_log) == 1
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import hashlib
+
+import pytest
+from django.contrib.auth.models import User
+from django.test import RequestFactory
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from client_manager.models import Client, ClientUserProfile
+from feedmanager.models import Category, Template, WebFeed, WebSnippet
+from feedmanager.views import web_feed_view
+from mediamanager.models import FeedAsset, ImageAsset, Playlist, PlaylistItem, WebAsset
+from mediamanager.types import AssetTypes
+from utils.bulk import bulk_create_inherited
+from utils.queries import QueryCaptureMiddleware
+
+ITEM_COUNT = 30
+
+
+@pytest.fixture
+def strict_budgets(settings):
+    settings.SIGNOXE_QUERY_BUDGET_STRICT = True
+    settings.MIDDLEWARE = list(settings.MIDDLEWARE) + ['utils.queries.QueryCaptureMiddleware']
+
+
+@pytest.fixture
+def owner(db):
+    return Client.objects.create(name='Budget Client', logo='logos/budget.png')
+
+
+@pytest.fixture
+def api_client(owner):
+    user = User.objects.create_user('budget', password='budget')
+    ClientUserProfile.objects.create(user=user, client=owner)
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+@pytest.fixture
+def playlist(owner):
+    images = bulk_create_inherited(ImageAsset, [
+        ImageAsset(name='Image {}'.format(index), type=AssetTypes.IMAGE, owner=owner,
+                   checksum=hashlib.md5(str(index).encode('utf-8')).hexdigest(),
+                   media_file='budget/{}.png'.format(index), asset_url='')
+        for index in range(ITEM_COUNT)
+    ])
+    pages = bulk_create_inherited(WebAsset, [
+        WebAsset(name='Page {}'.format(index), type=AssetTypes.WEB, owner=owner,
+                 content='<p>Page {}</p>'.format(index), asset_url='')
+        for index in range(ITEM_COUNT)
+    ])
+    playlist = Playlist.objects.create(name='Budget Playlist', owner=owner, auto_add_feeds=False)
+    PlaylistItem.objects.bulk_create([
+        PlaylistItem(playlist=playlist, item_id=asset.pk, position=position, duration=10)
+        for position, asset in enumerate(images + pages)
+    ])
+    return playlist
+
+
+@pytest.fixture
+def web_feed(db):
+    category = Category.objects.create(name='Budget Category', type=Category.DATED_TYPE)
+    WebSnippet.objects.create(category=category, title='Today', content='Content',
+                              date=timezone.localtime(timezone.now()).date())
+    template = Template.objects.create(name='Budget Template', duration=10,
+                                       template_data='<h1>{{ title }}</h1>')
+    return WebFeed.objects.create(name='Budget Web Feed', category=category, template=template,
+                                  published=True)
+
+
+@pytest.mark.usefixtures('strict_budgets')
+def test_playlist_as_list(playlist):
+    assert len(Playlist.objects.get(pk=playlist.pk).as_list()) == 2 * ITEM_COUNT
+
+
+@pytest.mark.usefixtures('strict_budgets')
+def test_feed_is_added_to_playlists_in_bulk(owner, web_feed):
+    playlists = [Playlist.objects.create(name='Playlist {}'.format(index), owner=owner)
+                 for index in range(ITEM_COUNT)]
+    web_feed.publish_to.add(owner)
+    web_feed.save()
+
+    feed_asset = FeedAsset.objects.get(feed=web_feed)
+    items = PlaylistItem.objects.filter(item=feed_asset)
+    assert sorted(items.values_list('playlist_id', flat=True)) == [p.pk for p in playlists]
+    assert set(items.values_list('position', flat=True)) == {0}
+
+
+@pytest.mark.usefixtures('strict_budgets', 'playlist')
+@pytest.mark.parametrize('endpoint', (
+        '/api/assets/',
+        '/api/assets/search/?q=page',
+        '/api/image_assets/',
+        '/api/web_assets/',
+        '/api/playlists/',
+))
+def test_list_endpoint(api_client, endpoint):
+    assert api_client.get(endpoint).status_code == 200
+
+
+@pytest.mark.usefixtures('strict_budgets')
+def test_web_feed_view(web_feed):
+    def get_response(request):
+        middleware.process_view(request, web_feed_view, (web_feed.slug,), {})
+        return web_feed_view(request, web_feed.slug)
+
+    middleware = QueryCaptureMiddleware(get_response)
+    response = middleware(RequestFactory().get('/web/{}/'.format(web_feed.slug)))
+    assert response.status_code == 200
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+""" Authentication classes for the API. """
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from utils.cache import get_or_set_cached, token_cache_key
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication that caches the user associated with each token so authenticating a
+    request doesn't need a database query. Cached entries are invalidated when a token or its
+    user changes.
+    """
+
+    def authenticate_credentials(self, key):
+        model = self.get_model()
+
+        def fetch_user():
+            try:
+                return model.objects.select_related('user').get(key=key).user
+            except model.DoesNotExist:
+                return None
+
+        user = get_or_set_cached('token-user', token_cache_key(key), fetch_user)
+
+        if user is None:
+            raise AuthenticationFailed('Invalid token.')
+
+        if not user.is_active:
+            raise AuthenticationFailed('User inactive or deleted.')
+
+        return user, key
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+""" Bulk insert helpers. """
+
+
+def bulk_create_inherited(model, objs, batch_size=None):
+    """
+    Inserts instances of a multi-table inherited model with one bulk insert per table, which
+    ``bulk_create`` doesn't support. The rows of the root model are created first, and their ids
+    are then used as the primary keys of the rows of every child table. Like ``bulk_create``, it
+    doesn't call ``save()`` or send signals.
+
+    Relies on the database returning ids from bulk inserts, as PostgreSQL does.
+    """
+    objs = list(objs)
+    if not objs:
+        return objs
+    chain = list(reversed(model._meta.get_parent_list())) + [model]
+    root = chain[0]
+    root_fields = [field.attname for field in root._meta.concrete_fields if not field.primary_key]
+    roots = root._base_manager.bulk_create([
+        root(**{attname: getattr(obj, attname) for attname in root_fields}) for obj in objs
+    ], batch_size=batch_size)
+
+    for table in chain[1:]:
+        for root_obj, obj in zip(roots, objs):
+            setattr(obj, table._meta.pk.attname, root_obj.pk)
+        fields = table._meta.local_concrete_fields
+        step = batch_size or len(objs)
+        for start in range(0, len(objs), step):
+            table._base_manager._insert(objs[start:start + step], fields=fields)
+    for root_obj, obj in zip(roots, objs):
+        setattr(obj, root._meta.pk.attname, root_obj.pk)
+    return objs
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+""" Caching helpers for frequently resolved lookups, with hit rate tracking. """
+import threading
+
+from django.core.cache import cache
+
+from utils.metrics import CACHE_LOOKUPS
+
+#: How long resolved lookups stay in the cache. They are also invalidated by signals whenever the
+#: underlying data changes so this is only an upper bound.
+LOOKUP_CACHE_TIMEOUT = 60 * 60
+
+
+class CacheStats:
+    """ Keeps per-process hit and miss counters for named caches. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def record(self, name, hit):
+        # The counters here are per process, the metrics are aggregated across processes.
+        CACHE_LOOKUPS.inc(cache=name, result='hit' if hit else 'miss')
+        with self._lock:
+            hits, misses = self._counters.get(name, (0, 0))
+            if hit:
+                hits += 1
+            else:
+                misses += 1
+            self._counters[name] = (hits, misses)
+
+    def hit_rate(self, name):
+        """ Returns the ratio of hits to lookups for the named cache, or None if unused. """
+        hits, misses = self._counters.get(name, (0, 0))
+        if hits + misses == 0:
+            return None
+        return hits / (hits + misses)
+
+    def as_dict(self):
+        """ Returns the hits, misses and hit rate for every named cache. """
+        return {
+            name: {
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': self.hit_rate(name),
+            } for name, (hits, misses) in self._counters.items()
+        }
+
+
+cache_stats = CacheStats()
+
+
+def owner_cache_key(user_id):
+    """ Cache key for the client that owns the content of a user. """
+    return 'owner-of-user:{}'.format(user_id)
+
+
+def token_cache_key(token_key):
+    """ Cache key for the user that an auth token belongs to. """
+    return 'user-of-token:{}'.format(token_key)
+
+
+def get_or_set_cached(name, key, fetch, timeout=LOOKUP_CACHE_TIMEOUT):
+    """
+    Returns the cached value for the key, or calls ``fetch`` and caches its result. Unlike
+    ``cache.get_or_set`` this caches ``None`` results as well. The lookup is counted towards the
+    hit rate of the named cache.
+    """
+    cached = cache.get(key)
+    cache_stats.record(name, hit=cached is not None)
+    if cached is not None:
+        return cached[0]
+    value = fetch()
+    cache.set(key, (value,), timeout)
+    return value
+
+
+def invalidate(*keys):
+    """ Removes the provided keys from the cache. """
+    cache.delete_many(keys)
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+""" Date and time helpers shared between apps. """
+import datetime
+
+from django.utils import timezone
+
+
+def start_of_day(day):
+    """ Returns an aware datetime for midnight at the start of the provided date. """
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def next_midnight(now=None):
+    """
+    Returns an aware datetime for the next local midnight after ``now``. Anything that is picked
+    based on the current date, such as feed snippets and special content, changes at this time.
+    """
+    if now is None:
+        now = timezone.now()
+    tomorrow = timezone.localtime(now).date() + datetime.timedelta(days=1)
+    return start_of_day(tomorrow)
+
+
+def earliest(*moments):
+    """ Returns the earliest of the provided datetimes ignoring any that are ``None``. """
+    moments = [moment for moment in moments if moment is not None]
+    if not moments:
+        return None
+    return min(moments)
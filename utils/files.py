@@ -165,6 +165,29 @@ class DedupedS3MediaStorage(S3BotoStorage):
         return super()._save(name, content)
 
 
+class PrivateMediaStorage(FileSystemStorage):
+    """
+    A storage class for files that must not be served, such as profiles. Files are stored outside
+    of MEDIA_ROOT, in ``SIGNOXE_PRIVATE_ROOT``, and have no URL.
+    """
+
+    def __init__(self, location=None, **kwargs):
+        if location is None:
+            location = getattr(settings, 'SIGNOXE_PRIVATE_ROOT',
+                               os.path.join(settings.BASE_DIR, 'private'))
+        super().__init__(location=location, **kwargs)
+
+
+class PrivateS3MediaStorage(S3BotoStorage):
+    """
+    A storage class for files that must not be public on Amazon S3. Files are uploaded with a
+    private ACL and their URLs are signed.
+    """
+
+    default_acl = 'private'
+    querystring_auth = True
+
+
 def verify_mime(file, supported_types):
     """
     Checks if the provided file-like object has a mime-type that is in the provided list of
@@ -305,7 +328,7 @@ def clean_video_metadata(raw_metadata):
             clean_stream = _clean_stream(stream, SUBTITLE_STREAM_MAP)
             metadata.setdefault('subtitle_streams', []).append(clean_stream)
 
-    return json.dumps(metadata)
+    return metadata
 
 
 IMAGE_METADATA_KEY_FIELDS = {
@@ -334,5 +357,60 @@ def clean_image_metadata(raw_metadata):
                 if group_value is not None:
                     metadata.setdefault(group, {})[new_key] = group_value
 
-    print(json.dumps(metadata))
-    return json.dumps(metadata)
+    return metadata
+
+
+def parse_duration(value):
+    """
+    Parses a duration in seconds or in the sexagesimal format output by ffprobe, such as
+    ``0:01:30.040000``, to a number of seconds. Returns None if the value can't be parsed.
+    """
+    try:
+        seconds = 0.0
+        for part in str(value).split(':'):
+            seconds = seconds * 60 + float(part)
+        return seconds
+    except ValueError:
+        return None
+
+
+def _parse_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def extract_video_fields(raw_metadata):
+    """
+    Extracts the width, height, duration and codec of the first video stream from raw ffprobe
+    metadata so they can be stored in their own columns.
+    """
+    fields = {'width': None, 'height': None, 'duration': None, 'codec': None}
+    if raw_metadata is None:
+        return fields
+    for stream in raw_metadata.get('streams', []):
+        if stream.get('codec_type') == 'video':
+            fields['width'] = _parse_int(stream.get('width'))
+            fields['height'] = _parse_int(stream.get('height'))
+            fields['codec'] = stream.get('codec_name')
+            break
+    duration = (raw_metadata.get('format') or {}).get('duration')
+    if duration is not None:
+        fields['duration'] = parse_duration(duration)
+    return fields
+
+
+def extract_image_fields(raw_metadata):
+    """
+    Extracts the width, height and file type of an image from raw exiftool metadata so they can
+    be stored in their own columns.
+    """
+    fields = {'width': None, 'height': None, 'duration': None, 'codec': None}
+    if raw_metadata is None:
+        return fields
+    file_data = raw_metadata.get('File') or {}
+    fields['width'] = _parse_int(file_data.get('ImageWidth'))
+    fields['height'] = _parse_int(file_data.get('ImageHeight'))
+    fields['codec'] = file_data.get('FileType')
+    return fields
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+""" Helpers for serving media files and cacheable responses. """
+import mimetypes
+import re
+
+from django.conf import settings
+from django.http import (FileResponse, HttpResponse, HttpResponseRedirect,
+                         StreamingHttpResponse, )
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+#: Size of chunks used while streaming files.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def _parse_range(range_header, size):
+    """
+    Parses a single byte range from a Range header and returns a ``(start, end)`` tuple with an
+    inclusive end. Returns None for headers that can't be parsed, which means the range is
+    ignored, and raises ValueError for ranges that can't be satisfied.
+    """
+    match = RANGE_RE.match(range_header.strip())
+    if match is None:
+        return None
+    start, end = match.groups()
+    if start == '' and end == '':
+        return None
+    if start == '':
+        # A suffix range, i.e. the last n bytes of the file.
+        length = int(end)
+        if length == 0:
+            raise ValueError('Unsatisfiable range')
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = size - 1 if end == '' else min(int(end), size - 1)
+    if start > end or start >= size:
+        raise ValueError('Unsatisfiable range')
+    return start, end
+
+
+def _iterate_file(file, start, length):
+    """ Yields ``length`` bytes of the file starting at ``start`` in chunks. """
+    try:
+        file.seek(start)
+        remaining = length
+        while remaining > 0:
+            data = file.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+    finally:
+        file.close()
+
+
+def _offloaded_response(field_file):
+    """
+    Returns a response that hands off serving the file to the web server if that is configured,
+    otherwise returns None.
+    """
+    accel_prefix = getattr(settings, 'SIGNOXE_MEDIA_ACCEL_REDIRECT_PREFIX', None)
+    if accel_prefix:
+        response = HttpResponse()
+        response['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + field_file.name
+        return response
+    if getattr(settings, 'SIGNOXE_MEDIA_USE_SENDFILE', False):
+        response = HttpResponse()
+        response['X-Sendfile'] = field_file.path
+        return response
+    return None
+
+
+def serve_media_file(request, field_file, checksum):
+    """
+    Serves a stored file with the correct content type, an ETag based on its checksum and
+    support for Range and If-Range requests.
+
+    When configured, serving is offloaded to S3 with a redirect, or to the web server with
+    ``X-Accel-Redirect`` (nginx) or ``X-Sendfile`` (Apache), which handle ranges themselves.
+    Otherwise the file is streamed from storage without reading it into memory.
+    """
+    if settings.USE_S3_STORAGE:
+        # S3 storage generates presigned URLs, and S3 supports range requests itself. The URLs
+        # expire, so the redirect must not be cached or revalidated with the ETag.
+        response = HttpResponseRedirect(field_file.url)
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    etag = quote_etag(checksum)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = _offloaded_response(field_file) or _streaming_response(request, field_file,
+                                                                          etag)
+    if response.status_code in (200, 206):
+        content_type, encoding = mimetypes.guess_type(field_file.name)
+        response['Content-Type'] = content_type or 'application/octet-stream'
+    response['ETag'] = etag
+    # Snippets can be replaced at any time under the same URL, so caches must revalidate.
+    patch_cache_control(response, public=True, no_cache=True)
+    return response
+
+
+def _streaming_response(request, field_file, etag):
+    """ Streams the file from storage, honouring a Range header if there is one. """
+    size = field_file.size
+    range_header = request.META.get('HTTP_RANGE')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if range_header and (if_range is None or if_range == etag):
+        try:
+            byte_range = _parse_range(range_header, size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */{}'.format(size)
+            return response
+        if byte_range is not None:
+            start, end = byte_range
+            length = end - start + 1
+            # FieldFile.open() only returns the file from Django 2.0 on.
+            field_file.open('rb')
+            response = StreamingHttpResponse(_iterate_file(field_file, start, length),
+                                             status=206)
+            response['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, size)
+            response['Content-Length'] = str(length)
+            response['Accept-Ranges'] = 'bytes'
+            return response
+
+    field_file.open('rb')
+    response = FileResponse(field_file)
+    response['Content-Length'] = str(size)
+    response['Accept-Ranges'] = 'bytes'
+    return response
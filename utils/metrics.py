@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""
+Metrics in the Prometheus text format.
+
+Every process adds its samples to a local buffer that is written to a Redis hash with a single
+pipeline at most once per flush interval, so counters are aggregated across app servers and
+channel workers without a round trip per request. The metrics view renders the hash, along with
+channel queue depths that are read from the channel layer when scraped.
+
+Open websocket connections are tracked as members of a sorted set scored by connection time
+rather than as a counter, because channel workers don't own the connections they handle. Members
+older than the group expiry of the channel layer are dropped when scraped, like the channel
+layer drops them from groups, so connections whose disconnect was lost can't inflate the count
+for good.
+"""
+import functools
+import logging
+import threading
+import time
+from collections import Counter as Tally
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django_redis import get_redis_connection
+
+from utils.queries import capture_queries, get_view_name
+
+logger = logging.getLogger(__name__)
+
+#: Whether samples are recorded at all.
+METRICS_ENABLED = getattr(settings, 'SIGNOXE_METRICS_ENABLED', True)
+
+#: Minimum number of seconds between writes of buffered samples to Redis.
+METRICS_FLUSH_INTERVAL = getattr(settings, 'SIGNOXE_METRICS_FLUSH_INTERVAL', 1)
+
+#: Connections are no longer counted after this many seconds, the default group expiry of
+#: the channel layer.
+WEBSOCKET_EXPIRY = getattr(settings, 'SIGNOXE_WEBSOCKET_EXPIRY', 24 * 60 * 60)
+
+#: Token that scrapers send as a bearer token, staff can see the metrics without it.
+METRICS_TOKEN = getattr(settings, 'SIGNOXE_METRICS_TOKEN', None)
+
+#: Upper bounds in seconds of the latency histogram buckets.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+METRICS_KEY = 'metrics:samples'
+WEBSOCKETS_KEY = 'metrics:websockets'
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{{{}}}'.format(','.join('{}="{}"'.format(name, _escape(value))
+                                    for name, value in labels))
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class MetricsBuffer:
+    """ Sums samples in the process and adds them to the shared hash in Redis. """
+
+    def __init__(self, key, interval):
+        self.key = key
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._samples = Tally()
+        self._flushed_at = time.monotonic()
+        self.enabled = METRICS_ENABLED
+
+    def add(self, family, sample, amount):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._samples['{}|{}'.format(family, sample)] += amount
+            due = time.monotonic() - self._flushed_at >= self.interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        """
+        Adds the buffered samples to Redis. Errors are logged and the samples are kept for the
+        next flush, recording metrics must never fail the code being measured.
+        """
+        with self._lock:
+            samples, self._samples = self._samples, Tally()
+            self._flushed_at = time.monotonic()
+        if not samples:
+            return
+        try:
+            pipeline = get_redis_connection('default').pipeline(transaction=False)
+            for field, amount in samples.items():
+                pipeline.hincrbyfloat(self.key, field, amount)
+            pipeline.execute()
+        except NotImplementedError:
+            # The default cache isn't backed by Redis, so there is nowhere to aggregate metrics.
+            logger.warning('Metrics are disabled, the default cache is not a Redis cache')
+            self.enabled = False
+        except Exception:
+            logger.warning('Could not flush %d metric samples', len(samples), exc_info=True)
+            with self._lock:
+                self._samples.update(samples)
+
+    def read(self):
+        """ Returns the aggregated samples of every process, grouped by metric family. """
+        families = {}
+        for field, value in get_redis_connection('default').hgetall(self.key).items():
+            family, _, sample = field.decode('utf-8').partition('|')
+            families.setdefault(family, []).append((sample, float(value)))
+        return families
+
+
+buffer = MetricsBuffer(METRICS_KEY, METRICS_FLUSH_INTERVAL)
+
+#: Metrics in the order they are rendered.
+registry = []
+
+
+class Metric:
+    """ A metric family with a fixed set of label names. """
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        registry.append(self)
+
+    def _labels(self, labels, **extra):
+        if set(labels) != set(self.labelnames):
+            raise ValueError('{} takes the labels {}'.format(self.name, self.labelnames))
+        return tuple((name, labels[name]) for name in self.labelnames) + tuple(extra.items())
+
+    def _add(self, suffix, amount, labels, **extra):
+        sample = self.name + suffix + _format_labels(self._labels(labels, **extra))
+        buffer.add(self.name, sample, amount)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        self._add('', amount, labels)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        for bound in self.buckets:
+            if value <= bound:
+                self._add('_bucket', 1, labels, le=_format_value(bound))
+        self._add('_sum', value, labels)
+        self._add('_count', 1, labels)
+
+
+REQUEST_DURATION = Histogram('signoxe_request_duration_seconds',
+                             'Time spent handling requests.', ('endpoint', 'method', 'status'))
+REQUEST_QUERIES = Counter('signoxe_request_db_queries_total',
+                          'Database queries run while handling requests.', ('endpoint',))
+REQUEST_QUERY_TIME = Counter('signoxe_request_db_seconds_total',
+                             'Time spent in the database while handling requests.', ('endpoint',))
+CACHE_LOOKUPS = Counter('signoxe_cache_lookups_total', 'Lookups in named caches.',
+                        ('cache', 'result'))
+CONSUMER_DURATION = Histogram('signoxe_consumer_duration_seconds',
+                              'Time spent handling channel messages.', ('channel',))
+CONSUMER_QUERIES = Counter('signoxe_consumer_db_queries_total',
+                           'Database queries run while handling channel messages.', ('channel',))
+
+
+class WebsocketConnections:
+    """ Tracks open websocket connections by kind and group in a sorted set in Redis. """
+
+    def __init__(self, key, expiry):
+        self.key = key
+        self.expiry = expiry
+
+    @staticmethod
+    def _member(kind, group, reply_channel):
+        return '{}|{}|{}'.format(kind, group, reply_channel)
+
+    def _update(self, update):
+        if not buffer.enabled:
+            return
+        try:
+            update(get_redis_connection('default'))
+        except Exception:
+            # Like the other metrics, tracking connections must never fail the consumer.
+            logger.warning('Could not update websocket connections', exc_info=True)
+
+    def connect(self, kind, group, reply_channel, now=None):
+        member = self._member(kind, group, reply_channel)
+        score = now if now is not None else time.time()
+        self._update(lambda redis: redis.zadd(self.key, score, member))
+
+    def disconnect(self, kind, group, reply_channel):
+        member = self._member(kind, group, reply_channel)
+        self._update(lambda redis: redis.zrem(self.key, member))
+
+    def counts(self, now=None):
+        """ Returns the number of open connections by (kind, group), dropping expired ones. """
+        if now is None:
+            now = time.time()
+        redis = get_redis_connection('default')
+        redis.zremrangebyscore(self.key, '-inf', now - self.expiry)
+        counts = Tally()
+        for member in redis.zrange(self.key, 0, -1):
+            kind, group, _ = member.decode('utf-8').split('|', 2)
+            counts[kind, group] += 1
+        return counts
+
+    def reset(self):
+        """ Forgets all connections, e.g. after every interface server has been restarted. """
+        get_redis_connection('default').delete(self.key)
+
+
+websocket_connections = WebsocketConnections(WEBSOCKETS_KEY, WEBSOCKET_EXPIRY)
+
+
+def _render_family(lines, name, documentation, type, samples):
+    lines.append('# HELP {} {}'.format(name, documentation))
+    lines.append('# TYPE {} {}'.format(name, type))
+    for sample, value in sorted(samples):
+        lines.append('{} {}'.format(sample, _format_value(value)))
+
+
+def _cache_hit_ratios(samples):
+    totals = {}
+    for sample, value in samples:
+        cache_name = sample.split('cache="', 1)[1].split('"', 1)[0]
+        hits, lookups = totals.get(cache_name, (0, 0))
+        if 'result="hit"' in sample:
+            hits += value
+        totals[cache_name] = (hits, lookups + value)
+    return [('signoxe_cache_hit_ratio' + _format_labels((('cache', name),)), hits / lookups)
+            for name, (hits, lookups) in totals.items() if lookups]
+
+
+def _queue_depths():
+    """ Returns the number of pending messages of every routed channel, if the layer knows it. """
+    from channels import DEFAULT_CHANNEL_LAYER, channel_layers
+    from signoxe_server.routing import channel_routing
+
+    layer = channel_layers[DEFAULT_CHANNEL_LAYER].channel_layer
+    if 'statistics' not in getattr(layer, 'extensions', ()):
+        return []
+    channels = sorted({name for route in channel_routing for name in route.channel_names()})
+    return [('signoxe_channel_queue_depth' + _format_labels((('channel', name),)),
+             layer.channel_statistics(name).get('messages_pending', 0)) for name in channels]
+
+
+def render_metrics():
+    """ Returns all metrics in the Prometheus text format. """
+    buffer.flush()
+    families = buffer.read()
+    lines = []
+    for metric in registry:
+        _render_family(lines, metric.name, metric.documentation, metric.type,
+                       families.get(metric.name, []))
+    _render_family(lines, 'signoxe_cache_hit_ratio', 'Ratio of hits to lookups in named caches.',
+                   'gauge', _cache_hit_ratios(families.get(CACHE_LOOKUPS.name, [])))
+    _render_family(lines, 'signoxe_channel_queue_depth', 'Messages waiting in channels.',
+                   'gauge', _queue_depths())
+    _render_family(lines, 'signoxe_websocket_connections', 'Open websocket connections.',
+                   'gauge', [('signoxe_websocket_connections' +
+                              _format_labels((('kind', kind), ('group', group))), count)
+                             for (kind, group), count in websocket_connections.counts().items()])
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """ Serves the metrics to staff and to scrapers with the metrics token. """
+    token = request.META.get('HTTP_AUTHORIZATION', '')
+    allowed = ((METRICS_TOKEN and token == 'Bearer {}'.format(METRICS_TOKEN)) or
+               request.user.is_staff)
+    if not allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE)
+
+
+class MetricsMiddleware:
+    """ Records the latency and database queries of every request by endpoint. """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.monotonic()
+        with capture_queries() as capture:
+            response = self.get_response(request)
+        endpoint = getattr(request, 'metrics_endpoint', 'unmatched')
+        REQUEST_DURATION.observe(time.monotonic() - started, endpoint=endpoint,
+                                 method=request.method,
+                                 status='{}xx'.format(response.status_code // 100))
+        REQUEST_QUERIES.inc(capture.count, endpoint=endpoint)
+        REQUEST_QUERY_TIME.inc(capture.time, endpoint=endpoint)
+        return response
+
+    # noinspection PyUnusedLocal
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.metrics_endpoint = get_view_name(view_func)
+
+
+def measure_consumer(consumer):
+    """ Wraps a channel consumer to record its processing time and queries by channel. """
+
+    @functools.wraps(consumer)
+    def wrapper(message, *args, **kwargs):
+        started = time.monotonic()
+        with capture_queries() as capture:
+            try:
+                return consumer(message, *args, **kwargs)
+            finally:
+                channel = message.channel.name
+                CONSUMER_DURATION.observe(time.monotonic() - started, channel=channel)
+                CONSUMER_QUERIES.inc(capture.count, channel=channel)
+
+    return wrapper
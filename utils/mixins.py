@@ -4,6 +4,7 @@
 from rest_framework.exceptions import PermissionDenied
 
 from client_manager.models import ClientUserProfile
+from utils.cache import get_or_set_cached, owner_cache_key
 
 
 def get_owner_from_request(request):
@@ -17,11 +18,18 @@ def get_owner_from_request(request):
 
 
 def get_owner_from_user(user):
-    try:
-        userprofile = user.profile  # type: ClientUserProfile
-    except ClientUserProfile.DoesNotExist:
-        return None
-    return userprofile.client
+    """
+    Returns the client associated with the user, or None if the user has no profile.
+    The result is cached, and is invalidated when the profile or client changes.
+    """
+    def fetch_owner():
+        try:
+            userprofile = ClientUserProfile.objects.select_related('client').get(user=user)
+        except ClientUserProfile.DoesNotExist:
+            return None
+        return userprofile.client
+
+    return get_or_set_cached('owner', owner_cache_key(user.pk), fetch_owner)
 
 
 class AutoAddOwnerOnCreateMixin:
@@ -49,6 +57,48 @@ class FilterByOwnerMixin:
         return self.queryset.filter(owner=get_owner_from_request(self.request))
 
 
+class SparseFieldsetMixin:
+    """
+    Lets API clients pick the fields they need with a ``fields`` query parameter, e.g.
+    ``?fields=id,name,thumbnail``. Other fields are left out of the response, and any of the
+    ``deferrable_fields`` that aren't requested are not loaded from the database at all.
+    It is intended to be mixed in with a ViewSet class.
+    """
+    fields_query_param = 'fields'
+    #: Heavy model fields that should not be loaded unless they are requested.
+    deferrable_fields = ()
+
+    def get_requested_fields(self):
+        """ Returns the set of requested fields, or None if all fields should be returned. """
+        if self.request is None or self.request.method != 'GET':
+            return None
+        fields = self.request.query_params.get(self.fields_query_param)
+        if not fields:
+            return None
+        return {field.strip() for field in fields.split(',') if field.strip()}
+
+    def get_queryset(self):
+        """ Defers loading of heavy fields that have not been requested. """
+        queryset = super().get_queryset()
+        requested_fields = self.get_requested_fields()
+        if requested_fields is not None:
+            deferred = [field for field in self.deferrable_fields if field not in requested_fields]
+            if deferred:
+                queryset = queryset.defer(*deferred)
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        """ Drops fields that have not been requested from the serializer. """
+        serializer = super().get_serializer(*args, **kwargs)
+        requested_fields = self.get_requested_fields()
+        if requested_fields is not None:
+            # For list views the fields are on the child serializer
+            item_serializer = getattr(serializer, 'child', serializer)
+            for field_name in set(item_serializer.fields) - requested_fields:
+                item_serializer.fields.pop(field_name)
+        return serializer
+
+
 class AutoAddOwnerAdminMixin:
     """
     This mixin automatically adds an owner while saving an object without an owner in the admin
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+A cache for rendered pages such as web assets and web feeds that devices fetch repeatedly.
+
+Pages are cached by kind and id and invalidated by model signals when their content changes.
+Each cached page stores a checksum of its content which is used as its ETag. Pages are sent with
+``no-cache``: devices, CDNs and mirror servers may keep them, but must revalidate them on every
+use, which only costs a 304 response from the cache. A max-age would let them show an edited
+page until it runs out, since invalidation only reaches the cache here.
+"""
+import hashlib
+
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+#: Upper bound for how long a rendered page stays in the cache.
+PAGE_CACHE_TIMEOUT = 24 * 60 * 60
+
+
+def page_cache_key(kind, identifier):
+    """ Returns the cache key for a rendered page. """
+    return 'rendered-page:{kind}:{identifier}'.format(kind=kind, identifier=identifier)
+
+
+def invalidate_pages(kind, *identifiers):
+    """ Removes the rendered pages of the given kind with the given ids from the cache. """
+    cache.delete_many([page_cache_key(kind, identifier) for identifier in identifiers])
+
+
+def _render_and_cache(key, render, now):
+    content, expires = render()
+    page = {
+        'content': content,
+        'etag': quote_etag(hashlib.md5((content or '').encode('utf-8')).hexdigest()),
+        'last_modified': now,
+        'expires': expires,
+    }
+    timeout = PAGE_CACHE_TIMEOUT
+    if expires is not None:
+        timeout = min(max(int((expires - now).total_seconds()), 1), timeout)
+    cache.set(key, page, timeout)
+    return page
+
+
+def get_cached_page(kind, identifier, render, now=None):
+    """
+    Returns the cached page, a dict with its ``content``, ``etag``, ``last_modified`` and
+    ``expires``, rendering it with ``render`` only if it isn't cached or has expired.
+    """
+    if now is None:
+        now = timezone.now()
+    key = page_cache_key(kind, identifier)
+    page = cache.get(key)
+    if page is None or (page['expires'] is not None and page['expires'] <= now):
+        page = _render_and_cache(key, render, now)
+    return page
+
+
+def cached_page_response(request, kind, identifier, render):
+    """
+    Returns a response for a rendered page, rendering it only if it isn't already cached.
+
+    :param render: a callable that returns a tuple of the rendered content and the time at which
+                   it expires, or None if it only changes when invalidated. Content of None
+                   means there is nothing to show right now and results in a 204 response.
+                   It can raise exceptions such as Http404 which are not cached.
+    """
+    page = get_cached_page(kind, identifier, render)
+
+    last_modified = int(page['last_modified'].timestamp())
+    response = get_conditional_response(request, etag=page['etag'],
+                                        last_modified=last_modified)
+    if response is None:
+        if page['content'] is None:
+            response = HttpResponse(status=204)
+        else:
+            response = HttpResponse(page['content'])
+    response['ETag'] = page['etag']
+    response['Last-Modified'] = http_date(last_modified)
+
+    patch_cache_control(response, public=True, no_cache=True)
+    return response
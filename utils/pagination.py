@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+""" Pagination classes for the API. """
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor based pagination that walks through newest objects first using the (created, id)
+    keyset, so fetching any page costs the same regardless of how deep it is.
+
+    For compatibility with clients that expect a plain list, results are only paginated when the
+    client asks for it by passing a cursor or a page size.
+    """
+    ordering = ('-created', '-id')
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    #: Whether pagination only applies if the client asks for it.
+    optional = True
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """ Returns None, i.e. no pagination, unless the request asks for a page. """
+        if (self.optional and
+                self.cursor_query_param not in request.query_params and
+                self.page_size_query_param not in request.query_params):
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+
+class IdKeysetPagination(KeysetPagination):
+    """ Keyset pagination for models that don't have a created timestamp. """
+    ordering = ('-id',)
+
+
+class SearchPagination(KeysetPagination):
+    """ Keyset pagination for search results, which are always paginated. """
+    page_size = 50
+    optional = False
+
+
+class PostFeedPagination(KeysetPagination):
+    """ Keyset pagination for notification posts, newest first. """
+    ordering = ('-posted_on', '-id')
+    page_size = 20
+    max_page_size = 100
+    optional = False
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+On-demand sampling profiler.
+
+While a request or a channel consumer is profiled, a background thread samples the stack of the
+thread running it every few milliseconds. The samples are saved to storage in the collapsed
+stack format, one ``frame;frame;frame count`` line per distinct stack, which flamegraph.pl,
+speedscope and most other flame graph tools read directly.
+
+Profiling is triggered per request by staff with the ``X-Profile`` header, or for the next
+requests or the next runs of a consumer with :func:`profile_next`, e.g. from the
+``profile_next`` management command. Untriggered requests only pay for a cache read.
+"""
+import functools
+import sys
+import threading
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.utils import timezone
+
+from utils.storage import PrivateStorage
+
+#: Profiles contain file paths and the names of the code that ran, so they must not be public.
+PROFILE_STORAGE = PrivateStorage()
+PROFILE_DIR = 'profiles'
+
+#: Seconds between two samples of the profiled thread.
+SAMPLE_INTERVAL = getattr(settings, 'SIGNOXE_PROFILE_SAMPLE_INTERVAL', 0.005)
+
+#: Deepest stack recorded for a sample, the outermost frames are dropped beyond it.
+MAX_STACK_DEPTH = 128
+
+#: How long a profile_next request stays active if it isn't used up.
+TRIGGER_TIMEOUT = 60 * 60
+
+#: Target name used for requests by profile_next.
+REQUESTS_TARGET = 'requests'
+
+PROFILE_REQUEST_HEADER = 'HTTP_X_PROFILE'
+PROFILE_RESPONSE_HEADER = 'X-Profile-Path'
+
+
+class SamplingProfiler:
+    """ Samples the stack of a thread from a background thread. """
+
+    def __init__(self, thread_id=None, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.samples = Counter()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            codes = []
+            while frame is not None and len(codes) < MAX_STACK_DEPTH:
+                codes.append(frame.f_code)
+                frame = frame.f_back
+            if codes:
+                # Code objects are cheap to hash, formatting is left for when the profile is saved
+                self.samples[tuple(reversed(codes))] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sample, name='sampling-profiler',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def collapsed(self):
+        """ Returns the samples in the collapsed stack format. """
+        lines = []
+        for codes, count in self.samples.most_common():
+            stack = ';'.join('{} ({}:{})'.format(code.co_name, code.co_filename,
+                                                 code.co_firstlineno) for code in codes)
+            lines.append('{} {}\n'.format(stack, count))
+        return ''.join(lines)
+
+
+def _safe_name(name):
+    return ''.join(char if char.isalnum() or char in '-_.' else '_' for char in name).strip('_')
+
+
+def save_profile(kind, name, profiler):
+    """ Saves the samples of the profiler to storage and returns the name of the file. """
+    file_name = '{}/{}/{}-{}-{}.folded'.format(
+            PROFILE_DIR, kind, _safe_name(name) or 'root',
+            timezone.now().strftime('%Y%m%dT%H%M%S'), uuid.uuid4().hex[:8])
+    return PROFILE_STORAGE.save(file_name, ContentFile(profiler.collapsed().encode('utf-8')))
+
+
+@contextmanager
+def profile(kind, name):
+    """
+    Profiles the current thread inside the block and saves the profile. The context variable is a
+    dict whose ``path`` is set to the name of the saved file.
+    """
+    profiler = SamplingProfiler()
+    result = {'path': None}
+    profiler.start()
+    try:
+        yield result
+    finally:
+        profiler.stop()
+        result['path'] = save_profile(kind, name, profiler)
+
+
+def _trigger_cache_key(target):
+    return 'profile-next:{}'.format(target)
+
+
+def profile_next(target, count):
+    """
+    Profiles the next ``count`` requests if the target is ``'requests'``, or the next ``count``
+    runs of the consumer with the target name, across all workers.
+    """
+    cache.set(_trigger_cache_key(target), count, TRIGGER_TIMEOUT)
+
+
+def _take_trigger(target):
+    """ Returns whether the target should be profiled, using up one of its profile_next runs. """
+    key = _trigger_cache_key(target)
+    if not cache.get(key):
+        return False
+    try:
+        # Several workers can race for the last run, only the ones that got a run profile.
+        return cache.decr(key) >= 0
+    except ValueError:
+        return False
+
+
+class ProfilingMiddleware:
+    """
+    Profiles requests from staff that send the profile header and requests triggered by
+    profile_next. Staff get the name of the saved profile in a response header.
+
+    Token authentication only happens in the view, so requests with the header are profiled
+    unless they come from a logged in user that isn't staff, and whether the profile is kept is
+    decided from the user once the view has run.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        user = getattr(request, 'user', None)
+        requested = bool(request.META.get(PROFILE_REQUEST_HEADER)) and (
+                user is None or not user.is_authenticated or user.is_staff)
+        triggered = not requested and _take_trigger(REQUESTS_TARGET)
+        if not requested and not triggered:
+            return self.get_response(request)
+
+        profiler = SamplingProfiler()
+        profiler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.stop()
+
+        user = getattr(request, 'user', None)
+        is_staff = user is not None and user.is_staff
+        if triggered or is_staff:
+            path = save_profile(REQUESTS_TARGET, request.path, profiler)
+            if requested and is_staff:
+                response[PROFILE_RESPONSE_HEADER] = path
+        return response
+
+
+def profile_consumer(consumer):
+    """ Wraps a channel consumer so that profile_next can profile its runs by consumer name. """
+    name = consumer.__name__
+
+    @functools.wraps(consumer)
+    def wrapper(message, *args, **kwargs):
+        if not _take_trigger(name):
+            return consumer(message, *args, **kwargs)
+        with profile('consumers', name):
+            return consumer(message, *args, **kwargs)
+
+    return wrapper
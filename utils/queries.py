@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+Query capture and query budgets.
+
+A capture records the number of queries, the total time spent in the database and the slowest
+statements along with the line of project code that ran them. Views are captured by
+:class:`QueryCaptureMiddleware` and channel consumers by :func:`capture_consumer`. Views and
+consumers can declare a budget with :func:`query_budget`, and functions they call, such as model
+methods that build content, with :func:`enforce_query_budget`. Captures that exceed a budget are
+logged, or raise :class:`QueryBudgetExceeded` if ``SIGNOXE_QUERY_BUDGET_STRICT`` is enabled, as
+it should be in tests. Staff can also ask for the capture of a live request with the
+``X-Debug-Queries`` header.
+"""
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.utils import CursorDebugWrapper, CursorWrapper
+
+logger = logging.getLogger(__name__)
+
+#: Number of slowest statements kept in a capture.
+SLOW_QUERY_COUNT = 5
+
+#: Statements are truncated to this length in captures.
+MAX_SQL_LENGTH = 500
+
+DEBUG_REQUEST_HEADER = 'HTTP_X_DEBUG_QUERIES'
+DEBUG_RESPONSE_HEADER = 'X-Query-Capture'
+
+_PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_THIS_FILE = os.path.abspath(__file__)
+
+_local = threading.local()
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def _is_strict():
+    return getattr(settings, 'SIGNOXE_QUERY_BUDGET_STRICT', False)
+
+
+def _originating_frame():
+    """ Returns the innermost frame of project code, outside of installed packages. """
+    for frame in reversed(traceback.extract_stack()):
+        filename = os.path.abspath(frame.filename)
+        if (filename.startswith(_PROJECT_DIR) and filename != _THIS_FILE and
+                'site-packages' not in filename):
+            return '{}:{} in {}'.format(os.path.relpath(filename, _PROJECT_DIR), frame.lineno,
+                                        frame.name)
+    return None
+
+
+class QueryCapture:
+    """ Query statistics for a block of code. """
+
+    def __init__(self, name=None):
+        self.name = name
+        self.count = 0
+        self.time = 0.0
+        self.slowest = []
+
+    def record(self, sql, duration):
+        self.count += 1
+        self.time += duration
+        if len(self.slowest) < SLOW_QUERY_COUNT or duration > self.slowest[-1]['time']:
+            # The stack is only inspected for statements that make it into the slowest list,
+            # which keeps the overhead of capturing low.
+            self.slowest.append({
+                'time': duration,
+                'sql': sql[:MAX_SQL_LENGTH],
+                'frame': _originating_frame(),
+            })
+            self.slowest.sort(key=lambda query: query['time'], reverse=True)
+            del self.slowest[SLOW_QUERY_COUNT:]
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'count': self.count,
+            'time': round(self.time, 6),
+            'slowest': [dict(query, time=round(query['time'], 6)) for query in self.slowest],
+        }
+
+
+class CapturingCursorWrapper(CursorDebugWrapper):
+    """
+    Cursor wrapper that records every statement in the active captures of the thread. It also
+    writes to the query log of the connection, as the debug cursor does, if the connection
+    logs queries, so ``connection.queries`` and ``CaptureQueriesContext`` keep working.
+    """
+
+    def __init__(self, cursor, db, logged):
+        super().__init__(cursor, db)
+        self.logged = logged
+
+    def _record(self, sql, started):
+        duration = time.monotonic() - started
+        for capture in getattr(_local, 'captures', ()):
+            capture.record(str(sql), duration)
+
+    def execute(self, sql, params=None):
+        started = time.monotonic()
+        try:
+            if self.logged:
+                return super().execute(sql, params)
+            return CursorWrapper.execute(self, sql, params)
+        finally:
+            self._record(sql, started)
+
+    def executemany(self, sql, param_list):
+        started = time.monotonic()
+        try:
+            if self.logged:
+                return super().executemany(sql, param_list)
+            return CursorWrapper.executemany(self, sql, param_list)
+        finally:
+            self._record(sql, started)
+
+
+@contextmanager
+def capture_queries(name=None):
+    """
+    Captures the queries run by the current thread inside the block. Captures can be nested.
+
+    Django 1.11 has no hook to wrap query execution, so this replaces the factories that
+    connections of the thread use to wrap their cursors, for logged and unlogged queries alike.
+    """
+    capture = QueryCapture(name)
+    captures = getattr(_local, 'captures', None)
+    if captures is None:
+        captures = _local.captures = []
+    if not captures:
+        for connection in connections.all():
+            connection.make_cursor = functools.partial(CapturingCursorWrapper, db=connection,
+                                                       logged=False)
+            connection.make_debug_cursor = functools.partial(CapturingCursorWrapper,
+                                                             db=connection, logged=True)
+    captures.append(capture)
+    try:
+        yield capture
+    finally:
+        captures.remove(capture)
+        if not captures:
+            for connection in connections.all():
+                for factory in ('make_cursor', 'make_debug_cursor'):
+                    connection.__dict__.pop(factory, None)
+
+
+class QueryBudget:
+    """ The maximum number of queries, and optionally database time, allowed for some code. """
+
+    def __init__(self, max_queries, max_time=None):
+        self.max_queries = max_queries
+        self.max_time = max_time
+
+    def violations(self, capture):
+        """ Returns a list of the ways the capture exceeds the budget. """
+        violations = []
+        if capture.count > self.max_queries:
+            violations.append('{} queries, budget is {}'.format(capture.count, self.max_queries))
+        if self.max_time is not None and capture.time > self.max_time:
+            violations.append('{:.3f}s in the database, budget is {:.3f}s'.format(
+                    capture.time, self.max_time))
+        return violations
+
+    def check(self, capture, strict=None):
+        """ Logs, or raises in strict mode, if the capture exceeds the budget. """
+        violations = self.violations(capture)
+        if not violations:
+            return
+        message = '{} exceeded its query budget: {}'.format(capture.name, '; '.join(violations))
+        if strict if strict is not None else _is_strict():
+            raise QueryBudgetExceeded('{}\n{}'.format(
+                    message, json.dumps(capture.as_dict(), indent=2)))
+        logger.warning(message, extra={'query_capture': capture.as_dict()})
+
+
+def query_budget(max_queries, max_time=None):
+    """
+    Declares the query budget of a view function, a viewset or viewset action, or a channel
+    consumer. The budget is enforced where the code is captured.
+    """
+    def decorator(view_or_consumer):
+        view_or_consumer.query_budget = QueryBudget(max_queries, max_time)
+        return view_or_consumer
+
+    return decorator
+
+
+def enforce_query_budget(max_queries, max_time=None):
+    """
+    Checks every call of a function against a query budget. Unlike :func:`query_budget` it
+    doesn't depend on a middleware or consumer wrapper, so it suits code below the view level.
+    """
+    budget = QueryBudget(max_queries, max_time)
+
+    def decorator(function):
+        name = '{}.{}'.format(function.__module__, function.__qualname__)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with capture_queries(name) as capture:
+                result = function(*args, **kwargs)
+            budget.check(capture)
+            return result
+
+        wrapper.query_budget = budget
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def assert_max_queries(max_queries, max_time=None):
+    """ Test helper that raises QueryBudgetExceeded if the block exceeds the budget. """
+    with capture_queries('block') as capture:
+        yield capture
+    QueryBudget(max_queries, max_time).check(capture, strict=True)
+
+
+def get_view_budget(view_func, request):
+    """
+    Returns the budget declared for a view. Budgets on the view function, which is where they
+    end up for ``api_view`` functions, come first, then the viewset action, then the view class.
+    """
+    budget = getattr(view_func, 'query_budget', None)
+    view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    if budget is None and view_class is not None:
+        actions = getattr(view_func, 'actions', None) or {}
+        action = actions.get(request.method.lower(), request.method.lower())
+        handler = getattr(view_class, action, None)
+        budget = getattr(handler, 'query_budget', None) or getattr(view_class, 'query_budget', None)
+    return budget
+
+
+def get_view_name(view_func):
+    """ Returns the dotted name of the view function or of the view class behind it. """
+    view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    target = view_class or view_func
+    return '{}.{}'.format(target.__module__, target.__name__)
+
+
+class QueryCaptureMiddleware:
+    """
+    Captures the queries of every request, checks the budget of the view, and returns the
+    capture in a response header for staff requests that ask for it.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with capture_queries(request.path) as capture:
+            response = self.get_response(request)
+
+        budget = getattr(request, 'query_budget', None)
+        if budget is not None:
+            budget.check(capture)
+
+        user = getattr(request, 'user', None)
+        if request.META.get(DEBUG_REQUEST_HEADER) and user is not None and user.is_staff:
+            response[DEBUG_RESPONSE_HEADER] = json.dumps(capture.as_dict())
+        return response
+
+    # noinspection PyUnusedLocal
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = get_view_budget(view_func, request)
+        _local.captures[-1].name = get_view_name(view_func)
+
+
+def capture_consumer(consumer):
+    """ Wraps a channel consumer to capture its queries and check its budget. """
+    name = '{}.{}'.format(consumer.__module__, consumer.__name__)
+    budget = getattr(consumer, 'query_budget', None)
+
+    @functools.wraps(consumer)
+    def wrapper(message, *args, **kwargs):
+        with capture_queries(name) as capture:
+            result = consumer(message, *args, **kwargs)
+        if budget is not None:
+            budget.check(capture)
+        return result
+
+    return wrapper
@@ -3,13 +3,16 @@ from django.conf import settings
 from django.core.files.storage import FileSystemStorage
 from storages.backends.s3boto import S3BotoStorage
 
-from utils.files import DedupedMediaStorage, DedupedS3MediaStorage
+from utils.files import (DedupedMediaStorage, DedupedS3MediaStorage, PrivateMediaStorage,
+                         PrivateS3MediaStorage)
 
 if settings.USE_S3_STORAGE:
     DedupedStorage = DedupedS3MediaStorage
     NormalStorage = S3BotoStorage
+    PrivateStorage = PrivateS3MediaStorage
 else:
     DedupedStorage = DedupedMediaStorage
     NormalStorage = FileSystemStorage
+    PrivateStorage = PrivateMediaStorage
 
-__all__ = ['DedupedStorage', 'NormalStorage']
+__all__ = ['DedupedStorage', 'NormalStorage', 'PrivateStorage']